@@ -322,12 +322,11 @@
 
 // server.js
 const express = require('express');
-const multer = require('multer');
 const cors = require('cors');
 const axios = require('axios');
-const FormData = require('form-data');
-const fs = require('fs');
-const path = require('path');
+const http = require('http');
+const https = require('https');
+const { Transform, pipeline } = require('stream');
 const admin = require('firebase-admin');
 
 // Initialize Firebase Admin SDK
@@ -344,6 +343,29 @@ const PORT = process.env.PORT || 3001;
 const FLASK_API_URL = process.env.FLASK_API_URL || 'http://localhost:5000';
 console.log(`Flask API URL: ${FLASK_API_URL}`);
 
+// Flask capacity is gunicorn workers x threads (see scripts/setup-services.sh).
+// At most that many requests are forwarded at once; the rest wait here, so a
+// burst queues instead of timing out inside gunicorn's backlog.
+const FLASK_WORKERS = parseInt(process.env.FLASK_WORKERS || '2', 10);
+const FLASK_THREADS = parseInt(process.env.FLASK_THREADS || '8', 10);
+const FLASK_CONCURRENCY = parseInt(process.env.FLASK_CONCURRENCY || String(FLASK_WORKERS * FLASK_THREADS), 10);
+const FLASK_QUEUE_LIMIT = parseInt(process.env.FLASK_QUEUE_LIMIT || String(FLASK_CONCURRENCY * 16), 10);
+const FLASK_QUEUE_TIMEOUT = parseInt(process.env.FLASK_QUEUE_TIMEOUT || '60000', 10); // ms
+console.log(`Flask concurrency: ${FLASK_CONCURRENCY} (queue up to ${FLASK_QUEUE_LIMIT})`);
+
+const MAX_UPLOAD_SIZE = 10 * 1024 * 1024; // 10MB limit
+
+// Keep-alive connections to Flask, reused across requests, one per slot.
+// maxRedirects: 0 uses plain http, so upload bodies stream instead of being
+// buffered for a redirect replay.
+const agentOptions = { keepAlive: true, maxSockets: FLASK_CONCURRENCY, maxFreeSockets: FLASK_CONCURRENCY };
+const flask = axios.create({
+  baseURL: FLASK_API_URL,
+  httpAgent: new http.Agent(agentOptions),
+  httpsAgent: new https.Agent(agentOptions),
+  maxRedirects: 0,
+});
+
 // Middleware
 app.use(cors());
 app.use(express.json());
@@ -422,34 +444,92 @@ const rateLimitMiddleware = (req, res, next) => {
   next();
 };
 
-// Configure multer for file uploads
-const storage = multer.diskStorage({
-  destination: (req, file, cb) => {
-    const userId = req.user ? req.user.uid : 'anonymous';
-    const uploadDir = `uploads/${userId}/`;
-    if (!fs.existsSync(uploadDir)) {
-      fs.mkdirSync(uploadDir, { recursive: true });
-    }
-    cb(null, uploadDir);
-  },
-  filename: (req, file, cb) => {
-    cb(null, `${Date.now()}-${file.originalname}`);
+// Flask slots: requests hold one from dispatch until their response closes
+const flaskQueue = [];
+let flaskActive = 0;
+
+const releaseFlaskSlot = () => {
+  const waiter = flaskQueue.shift();
+  if (waiter) {
+    // Hand the slot straight to the oldest waiting request
+    clearTimeout(waiter.timer);
+    waiter.start();
+  } else {
+    flaskActive--;
   }
-});
+};
 
-const upload = multer({ 
-  storage,
-  limits: {
-    fileSize: 10 * 1024 * 1024, // 10MB limit
-  },
-  fileFilter: (req, file, cb) => {
-    if (file.mimetype.startsWith('image/')) {
-      cb(null, true);
-    } else {
-      cb(new Error('Only image files are allowed'));
+const rejectBusy = (res) => {
+  res.setHeader('Retry-After', '5');
+  res.status(503).json({
+    error: 'Server busy',
+    message: 'Too many requests in progress, please try again shortly'
+  });
+};
+
+const flaskSlot = (req, res, next) => {
+  const queuedAt = Date.now();
+  const start = () => {
+    let released = false;
+    const release = () => {
+      if (!released) {
+        released = true;
+        releaseFlaskSlot();
+      }
+    };
+    res.once('finish', release);
+    res.once('close', release);
+    req.queueWait = Date.now() - queuedAt;
+    next();
+  };
+
+  if (flaskActive < FLASK_CONCURRENCY) {
+    flaskActive++;
+    return start();
+  }
+  if (flaskQueue.length >= FLASK_QUEUE_LIMIT) {
+    return rejectBusy(res);
+  }
+
+  const waiter = { start };
+  const dequeue = () => {
+    const position = flaskQueue.indexOf(waiter);
+    if (position !== -1) flaskQueue.splice(position, 1);
+    return position !== -1;
+  };
+  waiter.timer = setTimeout(() => {
+    if (dequeue()) rejectBusy(res);
+  }, FLASK_QUEUE_TIMEOUT);
+  // Client gave up while waiting
+  res.once('close', () => {
+    if (dequeue()) clearTimeout(waiter.timer);
+  });
+  flaskQueue.push(waiter);
+};
+
+// Upload body passed through to Flask, failing once it exceeds MAX_UPLOAD_SIZE
+const uploadSizeLimit = () => {
+  let received = 0;
+  return new Transform({
+    transform(chunk, encoding, callback) {
+      received += chunk.length;
+      if (received > MAX_UPLOAD_SIZE) {
+        const error = new Error('File too large');
+        error.code = 'LIMIT_FILE_SIZE';
+        return callback(error);
+      }
+      callback(null, chunk);
     }
+  });
+};
+
+// A Flask error response that was requested as a stream has to be read to
+// the end, or its keep-alive connection never returns to the pool
+const discardResponse = (error) => {
+  if (error.response?.data && typeof error.response.data.resume === 'function') {
+    error.response.data.resume();
   }
-});
+};
 
 // Routes
 
@@ -459,7 +539,12 @@ app.get('/api/health', (req, res) => {
     message: 'Server is running',
     timestamp: new Date().toISOString(),
     authenticated: false,
-    flask_url: FLASK_API_URL
+    flask_url: FLASK_API_URL,
+    flask_requests: {
+      active: flaskActive,
+      queued: flaskQueue.length,
+      concurrency: FLASK_CONCURRENCY
+    }
   });
 });
 
@@ -474,37 +559,31 @@ app.get('/api/protected-health', authenticateToken, (req, res) => {
 });
 
 // Protected face search endpoint with better error handling
-app.post('/api/search-face', authenticateToken, rateLimitMiddleware, upload.single('image'), async (req, res) => {
+app.post('/api/search-face', authenticateToken, rateLimitMiddleware, flaskSlot, async (req, res) => {
   try {
-    if (!req.file) {
+    if (!req.is('multipart/form-data')) {
       return res.status(400).json({ error: 'No image file provided' });
     }
+    const contentLength = parseInt(req.headers['content-length'] || '0', 10);
+    if (contentLength > MAX_UPLOAD_SIZE) {
+      return res.status(400).json({ error: 'File too large. Maximum size is 10MB.' });
+    }
 
-    console.log(`Processing file: ${req.file.filename} for user: ${req.user.email}`);
-
-    // Create form data to send to Flask API
-    const formData = new FormData();
-    formData.append('file', fs.createReadStream(req.file.path), req.file.originalname);
-
-    // Add similarity threshold if provided
-    const threshold = req.body.threshold || 50;
-    formData.append('threshold', threshold);
+    console.log(`Streaming upload (${contentLength || 'chunked'} bytes) for user: ${req.user.email}, ` +
+                `queued ${req.queueWait}ms`);
 
-    console.log(`Sending request to Flask API: ${FLASK_API_URL}/search`);
+    // The browser's multipart body goes to Flask as it arrives, with its
+    // "image" file and any events/gallery fields; nothing is written to disk
+    const body = pipeline(req, uploadSizeLimit(), () => {});
+    const headers = { 'content-type': req.headers['content-type'] };
+    if (req.headers['content-length']) headers['content-length'] = req.headers['content-length'];
 
-    // Send to Flask API
-    const flaskResponse = await axios.post(`${FLASK_API_URL}/search`, formData, {
-      headers: {
-        ...formData.getHeaders(),
-      },
+    // The timeout starts once the request holds a Flask slot, not while queued
+    const flaskResponse = await flask.post('/search', body, {
+      headers,
       timeout: 30000, // 30 second timeout
     });
 
-    console.log(`Flask response for user ${req.user.email}:`, JSON.stringify(flaskResponse.data, null, 2));
-
-    // Clean up uploaded file
-    fs.unlinkSync(req.file.path);
-
     // Extract results from new Flask response format
     let results = [];
     if (flaskResponse.data.results && Array.isArray(flaskResponse.data.results)) {
@@ -519,6 +598,11 @@ app.post('/api/search-face', authenticateToken, rateLimitMiddleware, upload.sing
     // Log the search for audit purposes
     console.log(`Face search completed for user: ${req.user.email} at ${new Date().toISOString()}`);
 
+    // Per-face grouped results (one gallery per person in the query photo)
+    if (req.query.group === 'faces') {
+      return res.json(flaskResponse.data);
+    }
+
     // Return results in format expected by frontend
     res.json(results);
 
@@ -532,10 +616,14 @@ app.post('/api/search-face', authenticateToken, rateLimitMiddleware, upload.sing
         details: 'Please ensure the Flask API is running'
       });
     }
-        
-    // Clean up uploaded file in case of error
-    if (req.file && fs.existsSync(req.file.path)) {
-      fs.unlinkSync(req.file.path);
+
+    if (error.code === 'LIMIT_FILE_SIZE') {
+      return res.status(400).json({ error: 'File too large. Maximum size is 10MB.' });
+    }
+
+    // No file, an unreadable image or bad search options
+    if (error.response?.status === 400) {
+      return res.status(400).json({ error: error.response.data?.error || 'No image file provided' });
     }
 
     res.status(500).json({
@@ -546,31 +634,64 @@ app.post('/api/search-face', authenticateToken, rateLimitMiddleware, upload.sing
 });
 
 // Protected proxy endpoint to download images from Flask API
-app.get('/api/download/:filename', authenticateToken, async (req, res) => {
+app.get('/api/download/:filename', authenticateToken, flaskSlot, async (req, res) => {
   try {
     const { filename } = req.params;
     console.log(`User ${req.user.email} downloading image: ${filename}`);
 
-    const flaskResponse = await axios.get(`${FLASK_API_URL}/download/${filename}`, {
+    // Pass through the event (required by Flask once several events are
+    // indexed) and resize options, plus the browser's cache validators
+    const params = {};
+    for (const key of ['event', 'size', 'quality']) {
+      if (req.query[key]) params[key] = req.query[key];
+    }
+    const headers = {};
+    for (const key of ['if-none-match', 'if-modified-since']) {
+      if (req.headers[key]) headers[key] = req.headers[key];
+    }
+
+    const flaskResponse = await flask.get(`/download/${encodeURIComponent(filename)}`, {
+      params,
+      headers,
       responseType: 'stream',
       timeout: 10000, // 10 second timeout
+      validateStatus: (status) => (status >= 200 && status < 300) || status === 304,
     });
 
+    for (const key of ['etag', 'last-modified']) {
+      if (flaskResponse.headers[key]) res.setHeader(key, flaskResponse.headers[key]);
+    }
+    res.setHeader('Cache-Control', 'public, max-age=3600');
+
+    if (flaskResponse.status === 304) {
+      flaskResponse.data.resume();
+      return res.status(304).end();
+    }
+
     // Set proper headers
     res.setHeader('Content-Type', flaskResponse.headers['content-type'] || 'image/jpeg');
     res.setHeader('Content-Disposition', `attachment; filename="${filename}"`);
-    res.setHeader('Cache-Control', 'public, max-age=3600');
-        
-    console.log(`Image download completed for user: ${req.user.email}, file: ${filename}`);
+    if (flaskResponse.headers['content-length']) {
+      res.setHeader('Content-Length', flaskResponse.headers['content-length']);
+    }
 
-    // Pipe the response
-    flaskResponse.data.pipe(res);
+    // Stream the photo through; a client that disconnects aborts the Flask read
+    pipeline(flaskResponse.data, res, (error) => {
+      if (error) {
+        console.error(`Image download aborted for user: ${req.user.email}, file: ${filename}:`, error.message);
+      } else {
+        console.log(`Image download completed for user: ${req.user.email}, file: ${filename}`);
+      }
+    });
 
   } catch (error) {
     console.error(`Error downloading image for user ${req.user?.email}:`, error.message);
+    discardResponse(error);
     
     if (error.response?.status === 404) {
       res.status(404).json({ error: 'Image not found' });
+    } else if (error.response?.status === 400) {
+      res.status(400).json({ error: 'Invalid download request', details: 'Check the event, size and quality' });
     } else if (error.code === 'ECONNREFUSED') {
       res.status(503).json({ 
         error: 'Image service unavailable',
@@ -585,11 +706,55 @@ app.get('/api/download/:filename', authenticateToken, async (req, res) => {
   }
 });
 
+// Protected proxy endpoint to download several images as one ZIP archive
+app.post('/api/download-zip', authenticateToken, flaskSlot, async (req, res) => {
+  try {
+    const { files } = req.body;
+    if (!Array.isArray(files) || files.length === 0) {
+      return res.status(400).json({ error: 'No files selected' });
+    }
+    console.log(`User ${req.user.email} downloading ${files.length} images as ZIP`);
+
+    // Flask builds the archive while reading the photos; pipe it straight through
+    const flaskResponse = await flask.post('/download/zip', { files }, {
+      responseType: 'stream',
+      timeout: 120000, // 2 minute timeout for large selections
+    });
+
+    res.setHeader('Content-Type', 'application/zip');
+    res.setHeader('Content-Disposition', 'attachment; filename="photos.zip"');
+    if (flaskResponse.headers['x-missing-files']) {
+      res.setHeader('X-Missing-Files', flaskResponse.headers['x-missing-files']);
+    }
+    pipeline(flaskResponse.data, res, (error) => {
+      if (error) console.error(`ZIP download aborted for user ${req.user.email}:`, error.message);
+    });
+
+  } catch (error) {
+    console.error(`Error downloading ZIP for user ${req.user?.email}:`, error.message);
+    discardResponse(error);
+
+    if (error.response?.status === 400) {
+      res.status(400).json({ error: 'None of the selected images were found' });
+    } else if (error.code === 'ECONNREFUSED') {
+      res.status(503).json({
+        error: 'Image service unavailable',
+        details: 'Please ensure the Flask API is running'
+      });
+    } else {
+      res.status(500).json({
+        error: 'Failed to download images',
+        details: error.message
+      });
+    }
+  }
+});
+
 // Protected test endpoint to check Flask connectivity
 app.get('/api/test-flask', authenticateToken, async (req, res) => {
   try {
     console.log(`Testing Flask connectivity at: ${FLASK_API_URL}/health`);
-    const flaskResponse = await axios.get(`${FLASK_API_URL}/health`, { timeout: 5000 });
+    const flaskResponse = await flask.get('/health', { timeout: 5000 });
     
     res.json({ 
       status: 'Flask API is reachable',
@@ -611,7 +776,7 @@ app.get('/api/test-flask', authenticateToken, async (req, res) => {
 // Debug endpoint to check Flask dataset
 app.get('/api/debug/flask-dataset', authenticateToken, async (req, res) => {
   try {
-    const flaskResponse = await axios.get(`${FLASK_API_URL}/debug/dataset`, { timeout: 10000 });
+    const flaskResponse = await flask.get('/debug/dataset', { timeout: 10000 });
     res.json(flaskResponse.data);
   } catch (error) {
     res.status(500).json({ 
@@ -651,12 +816,6 @@ app.get('/api/admin/user-activity', authenticateToken, async (req, res) => {
 app.use((error, req, res, next) => {
   console.error('Unhandled error:', error);
   
-  if (error instanceof multer.MulterError) {
-    if (error.code === 'LIMIT_FILE_SIZE') {
-      return res.status(400).json({ error: 'File too large. Maximum size is 10MB.' });
-    }
-  }
-  
   res.status(500).json({ 
     error: 'Internal server error',
     message: 'Something went wrong'
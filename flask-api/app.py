@@ -269,30 +269,626 @@
 #     app.run(debug=True, port=5000)
 
 import os
+import io
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 import numpy as np
 import faiss
 from deepface import DeepFace
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, send_file, g
 from flask_cors import CORS  # Add this import
 from flasgger import Swagger
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram
+
+# Shared helpers live next to the index builder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+from index_factory import (
+    DEFAULT_NPROBE, DEFAULT_EF_SEARCH, MAX_NPROBE, MAX_EF_SEARCH, EXACT_VECTORS_NAME, read_index, search_parameters,
+    describe_index, rerank, merge_shard_results
+)
+from embedding_cache import EmbeddingCache, content_hash
+from face_embedding import embed_face_crops
+from utils import (
+    MAX_IMAGE_SIZE, MODEL_NAME, DETECTOR_BACKEND as INDEX_DETECTOR_BACKEND, BOX_COLUMNS, resize_image_for_processing, pil_to_cv2,
+    face_box, face_rows
+)
+from metadata_store import FaceMetadataStore
+from pagination import encode_cursor, decode_cursor
+from zip_stream import stream_zip
+from micro_batcher import MicroBatcher, process_groups
+from process_memory import process_memory
+from shard_registry import load_registry, registry_path
+from thumbnail_cache import ThumbnailCache
+import metrics
+from metrics import DEFAULT_BUCKETS, StageTimer
 
 # === CONFIG ===
+# Per-event shards are listed in embeddings/shards.json (see src/shard_registry.py);
+# without it the single index below is served as one shard
+EMBEDDINGS_DIR = "embeddings"
 INDEX_PATH = "embeddings/faces.index"
-FILENAMES_PATH = "embeddings/filenames.npy"
+METADATA_DIR = "embeddings/metadata"
+FILENAMES_PATH = "embeddings/filenames.npy"  # Older builds, before the metadata store
 DATASET_DIR = "dataset/convocation-2024"
-MODEL_NAME = "ArcFace"
-DETECTOR_BACKEND = "mtcnn"
+# MODEL_NAME (FACE_MODEL) must match the index; queries may use a faster
+# detector than the build, see src/benchmark_detectors.py
+DETECTOR_BACKEND = os.environ.get("QUERY_DETECTOR", INDEX_DETECTOR_BACKEND)
+SEARCH_K = 5
+MAX_QUERY_FACES = int(os.environ.get("MAX_QUERY_FACES", "10"))  # Faces searched per upload
+
+# Threshold (range search) mode: cap on matches per query face, and page size
+RANGE_SEARCH_MAX_RESULTS = int(os.environ.get("RANGE_SEARCH_MAX_RESULTS", "1000"))
+RANGE_SEARCH_PAGE_SIZE = int(os.environ.get("RANGE_SEARCH_PAGE_SIZE", "50"))
+
+# Gallery mode (see src/cluster_faces.py): the best match must be at least this
+# similar for the query to take on its person cluster (default: the clustering threshold)
+CLUSTER_MATCH_SIMILARITY = float(os.environ["CLUSTER_MATCH_SIMILARITY"]) \
+    if os.environ.get("CLUSTER_MATCH_SIMILARITY") else None
+
+# Search-time parameters for approximate indexes (overridable per request)
+FAISS_NPROBE = int(os.environ.get("FAISS_NPROBE", DEFAULT_NPROBE))
+FAISS_EF_SEARCH = int(os.environ.get("FAISS_EF_SEARCH", DEFAULT_EF_SEARCH))
+# Quantized shards built with --exact-vectors: re-rank this many candidates by
+# exact similarity from the memory-mapped float32 vectors (0 disables). In
+# threshold mode candidates are gathered RERANK_MARGIN below the threshold.
+RERANK_CANDIDATES = int(os.environ.get("RERANK_CANDIDATES", "0"))
+RERANK_MARGIN = float(os.environ.get("RERANK_MARGIN", "0.05"))
+# Memory-map the index read-only so all workers on a host share one copy in
+# the page cache instead of each holding its own (set to 0 to read it in full)
+FAISS_MMAP = os.environ.get("FAISS_MMAP", "1") == "1"
+# Threads searching shards in parallel (FAISS releases the GIL)
+SHARD_SEARCH_THREADS = int(os.environ.get("SHARD_SEARCH_THREADS", "4"))
+
+# Query embedding cache: in-process LRU size, plus optional shared on-disk store
+EMBEDDING_CACHE_SIZE = int(os.environ.get("EMBEDDING_CACHE_SIZE", "1024"))
+EMBEDDING_CACHE_DIR = os.environ.get("EMBEDDING_CACHE_DIR")
+EMBEDDING_CACHE_MAX_MB = int(os.environ.get("EMBEDDING_CACHE_MAX_MB", "512"))  # On-disk store cap
+
+# Concurrent /search requests arriving within SEARCH_BATCH_WAIT_MS are embedded
+# and searched together, up to SEARCH_BATCH_SIZE at a time
+SEARCH_BATCH_SIZE = int(os.environ.get("SEARCH_BATCH_SIZE", "32"))
+SEARCH_BATCH_WAIT_MS = float(os.environ.get("SEARCH_BATCH_WAIT_MS", "5"))
+# Seconds a /search waits for its batch before giving up with 503; matches the
+# Node proxy's 30 s timeout, after which nobody is waiting for the answer
+SEARCH_TIMEOUT = float(os.environ.get("SEARCH_TIMEOUT", "30"))
+
+# /download?size=...: resized variants are cached on disk up to THUMBNAIL_CACHE_MAX_MB
+THUMBNAIL_CACHE_DIR = os.environ.get("THUMBNAIL_CACHE_DIR", "embeddings/thumbnails")
+THUMBNAIL_CACHE_MAX_MB = int(os.environ.get("THUMBNAIL_CACHE_MAX_MB", "1024"))
+DOWNLOAD_MAX_SIZE = int(os.environ.get("DOWNLOAD_MAX_SIZE", "2048"))
+DOWNLOAD_JPEG_QUALITY = int(os.environ.get("DOWNLOAD_JPEG_QUALITY", "85"))
+DOWNLOAD_MAX_AGE = int(os.environ.get("DOWNLOAD_MAX_AGE", "3600"))  # Cache-Control max-age, seconds
+ZIP_MAX_FILES = int(os.environ.get("ZIP_MAX_FILES", "500"))  # Photos per /download/zip request
+
+# Seconds between checks for a rebuilt index on disk (0 disables the watcher)
+INDEX_WATCH_INTERVAL = float(os.environ.get("INDEX_WATCH_INTERVAL", "0"))
+# POST /admin/reload writes a request id here; every worker's watcher sees the
+# change and reloads, then reports the id it loaded under on /health
+RELOAD_MARKER_PATH = os.path.join(EMBEDDINGS_DIR, "reload.request")
+# If set, POST /admin/reload requires a matching X-Admin-Token header
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+# Add a Server-Timing header with per-stage durations to every response
+# (otherwise only to requests with ?server_timing=1)
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "0") == "1"
+
+# === LOAD INDEX + METADATA ===
+class IndexShard:
+    """One event's FAISS index, the face metadata it was built with, and its photos"""
+
+    def __init__(self, event, index, metadata, dataset_dir, index_path, metadata_dir, exact_vectors=None):
+        self.event = event
+        self.index = index
+        self.metadata = metadata
+        self.dataset_dir = dataset_dir
+        self.index_path = index_path
+        self.metadata_dir = metadata_dir
+        self.exact_vectors = exact_vectors  # Float32 vectors by face id, for re-ranking
+
+class IndexState:
+    """Every loaded shard, swapped in together"""
+
+    def __init__(self, shards, generation, reload_id=None):
+        self.shards = shards  # Event name -> IndexShard, in registry order
+        self.generation = generation  # Counted per worker
+        self.reload_id = reload_id  # Last /admin/reload request seen when loading
+        self.loaded_at = time.time()
+
+    @property
+    def total_faces(self):
+        return sum(shard.index.ntotal for shard in self.shards.values())
+
+def load_shard(event, index_path, metadata_dir, dataset_dir, filenames_path=None):
+    # Builds replace faces.index by rename, so a mapped older generation
+    # keeps reading its own file until it is released
+    index = read_index(index_path, mmap=FAISS_MMAP)
+    if os.path.exists(os.path.join(metadata_dir, "meta.json")):
+        metadata = FaceMetadataStore.open(metadata_dir)
+    else:
+        metadata = FaceMetadataStore.from_legacy(filenames_path)
+
+    # Query embeddings are only comparable with an index of the same model
+    built_with = metadata.build_info.get("model", MODEL_NAME)
+    if built_with != MODEL_NAME:
+        raise ValueError(f"Shard {event} was built with {built_with}, but FACE_MODEL is {MODEL_NAME}")
+
+    exact_vectors = None
+    vectors_path = os.path.join(os.path.dirname(index_path), EXACT_VECTORS_NAME)
+    if RERANK_CANDIDATES > 0 and os.path.exists(vectors_path):
+        exact_vectors = np.load(vectors_path, mmap_mode="r")
+        if len(exact_vectors) != len(metadata):
+            print(f"  Warning: {vectors_path} has {len(exact_vectors)} vectors for {len(metadata)} faces; "
+                  "not re-ranking")
+            exact_vectors = None
+    print(f"  Shard {event}: {index.ntotal} faces" + (" (exact re-ranking)" if exact_vectors is not None else ""))
+    return IndexShard(event, index, metadata, dataset_dir, index_path, metadata_dir, exact_vectors)
+
+def read_reload_marker():
+    """The id of the last /admin/reload request, or None"""
+    try:
+        with open(RELOAD_MARKER_PATH) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+def load_index_state(generation):
+    """Read every shard's index and memory-map its face metadata"""
+    print(f"Loading FAISS index (generation {generation}, mmap={FAISS_MMAP})...")
+    reload_id = read_reload_marker()
+    registry = load_registry(EMBEDDINGS_DIR)
+    if registry is None:
+        # Single index from before per-event shards
+        shards = [load_shard(os.path.basename(DATASET_DIR), INDEX_PATH, METADATA_DIR,
+                             DATASET_DIR, FILENAMES_PATH)]
+    else:
+        shards = [load_shard(event, entry["index"], entry["metadata"], entry["dataset"])
+                  for event, entry in registry.items()]
+    return IndexState({shard.event: shard for shard in shards}, generation, reload_id)
+
+# Requests read `state` once and use that object throughout, so a reload
+# (a single reference assignment) never mixes an index with another
+# generation's metadata.
+state = load_index_state(1)
+reload_lock = threading.Lock()
+reload_status = {"in_progress": False, "last_error": None}
+
+def reload_index():
+    """Load the index files in the calling thread and swap them in"""
+    global state
+    with reload_lock:
+        reload_status["in_progress"] = True
+        try:
+            new_state = load_index_state(state.generation + 1)
+            update_index_metrics(state, new_state)
+            state = new_state
+            reload_status["last_error"] = None
+            print(f"Index generation {new_state.generation} loaded: "
+                  f"{new_state.total_faces} faces in {len(new_state.shards)} shards")
+        except Exception as e:
+            reload_status["last_error"] = str(e)
+            print(f"Error reloading index: {str(e)}")
+        finally:
+            reload_status["in_progress"] = False
+
+def index_files_signature():
+    # New or removed shards show up as a change to the registry itself
+    paths = [registry_path(EMBEDDINGS_DIR), INDEX_PATH, os.path.join(METADATA_DIR, "meta.json"), FILENAMES_PATH,
+             RELOAD_MARKER_PATH]
+    for shard in state.shards.values():
+        paths += [shard.index_path, os.path.join(shard.metadata_dir, "meta.json")]
+    return tuple(os.path.getmtime(path) if os.path.exists(path) else None for path in paths)
+
+def watch_index_files(interval):
+    """
+    Reload when the index files change on disk.
+    Every gunicorn worker runs its own watcher, so all of them pick up a
+    rebuild; a change is only acted on once it has been stable for one
+    interval, so the builder has finished writing both files.
+    """
+    last_signature = index_files_signature()
+    while True:
+        time.sleep(interval)
+        signature = index_files_signature()
+        if signature == last_signature:
+            continue
+        time.sleep(interval)
+        if index_files_signature() != signature:
+            continue
+        reload_index()
+        last_signature = signature
+
+if INDEX_WATCH_INTERVAL > 0:
+    threading.Thread(target=watch_index_files, args=(INDEX_WATCH_INTERVAL,), daemon=True).start()
+
+embedding_cache = EmbeddingCache(max_entries=EMBEDDING_CACHE_SIZE, disk_dir=EMBEDDING_CACHE_DIR,
+                                 max_disk_bytes=EMBEDDING_CACHE_MAX_MB * 1024 * 1024)
+thumbnail_cache = ThumbnailCache(THUMBNAIL_CACHE_DIR, THUMBNAIL_CACHE_MAX_MB * 1024 * 1024)
+
+# === METRICS ===
+# Exposed on /metrics, summed across gunicorn workers (see src/metrics.py).
+# Gauges are set when the value changes, not read at scrape time: the worker
+# answering a scrape cannot see the other workers' state.
+request_count = Counter(
+    "faceapi_requests_total", "HTTP requests by endpoint and status", ("endpoint", "status"))
+request_duration = Histogram(
+    "faceapi_request_duration_seconds", "HTTP request duration, until the body is sent", ("endpoint",),
+    buckets=DEFAULT_BUCKETS)
+stage_duration = Histogram(
+    "faceapi_stage_duration_seconds", "Duration of each stage of a request", ("endpoint", "stage"),
+    buckets=DEFAULT_BUCKETS)
+search_batch_size = Histogram(
+    "faceapi_search_batch_size", "Queries embedded and searched together",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+embedding_cache_lookups = Counter(
+    "faceapi_embedding_cache_lookups_total", "Query embedding cache lookups by result", ("result",))
+index_faces = Gauge(
+    "faceapi_index_faces", "Faces in each loaded shard (0 once unloaded), highest across workers", ("event",),
+    multiprocess_mode="livemax")
+index_generation = Gauge(
+    "faceapi_index_generation", "Index generation being served, per worker", multiprocess_mode="liveall")
+ready = Gauge(
+    "faceapi_ready", "1 once every worker has warmed up its models", multiprocess_mode="livemin")
+
+def update_index_metrics(old_state, new_state):
+    for event in set(old_state.shards if old_state else ()) - set(new_state.shards):
+        index_faces.labels(event=event).set(0)
+    for shard in new_state.shards.values():
+        index_faces.labels(event=shard.event).set(shard.index.ntotal)
+    index_generation.set(new_state.generation)
+
+update_index_metrics(None, state)
+ready.set(0)
+
+# === QUERY BATCHING ===
+# Query cache entries store one row per detected face (see utils.face_rows)
+def detect_query_faces(image):
+    """Faces in one query image, as DeepFace.extract_faces returns them"""
+    return DeepFace.extract_faces(image, detector_backend=DETECTOR_BACKEND, enforce_detection=False)
+
+def embed_query_images(images, stages=None):
+    """
+    Detect the faces in each query image, then embed every face of the batch
+    in one forward pass (the same two steps as the index builder).
+    Returns one face-row array (see BOX_COLUMNS) per image, or the exception
+    for an image that failed. Detect and embed durations are added to the
+    stages dict, if given.
+    """
+    stages = {} if stages is None else stages
+    start = time.perf_counter()
+    detected = []
+    for image in images:
+        try:
+            detected.append(detect_query_faces(image))
+        except Exception as e:
+            detected.append(e)
+    stages["detect"] = stages.get("detect", 0.0) + time.perf_counter() - start
+
+    start = time.perf_counter()
+    crops = [face["face"] for faces in detected if not isinstance(faces, Exception) for face in faces]
+    try:
+        embeddings = embed_face_crops(crops, MODEL_NAME) if crops else None
+    except Exception as e:
+        stages["embed"] = stages.get("embed", 0.0) + time.perf_counter() - start
+        if len(images) == 1:
+            return [e]
+        # Retry one by one so a single bad upload doesn't fail the whole batch
+        return [embed_query_images([image], stages)[0] for image in images]
+    stages["embed"] = stages.get("embed", 0.0) + time.perf_counter() - start
+
+    results = []
+    offset = 0
+    for faces, image in zip(detected, images):
+        if isinstance(faces, Exception):
+            results.append(faces)
+            continue
+        results.append(face_rows(
+            [face_box(face["facial_area"], image.shape) for face in faces],
+            [face.get("confidence", 0.0) for face in faces],
+            embeddings[offset:offset + len(faces)]
+        ))
+        offset += len(faces)
+    return results
+
+def range_search(index, queries, min_similarity, params=None):
+    """
+    Every stored face with cosine similarity >= min_similarity, per query
+    row, sorted best first and capped at RANGE_SEARCH_MAX_RESULTS.
+    Indexes without range search support (HNSW) fall back to a capped top-k
+    search filtered by the threshold.
+    """
+    try:
+        lims, D, I = index.range_search(queries, min_similarity, params=params)
+        rows = [(D[lims[i]:lims[i + 1]], I[lims[i]:lims[i + 1]]) for i in range(len(queries))]
+    except RuntimeError:
+        k = max(1, min(RANGE_SEARCH_MAX_RESULTS, index.ntotal))
+        D, I = index.search(queries, k=k, params=params)
+        rows = [(d[(d >= min_similarity) & (i >= 0)], i[(d >= min_similarity) & (i >= 0)])
+                for d, i in zip(D, I)]
+
+    distances, ids = [], []
+    for d, i in rows:
+        order = np.argsort(-d, kind="stable")[:RANGE_SEARCH_MAX_RESULTS]
+        distances.append(d[order])
+        ids.append(i[order])
+    return distances, ids
+
+shard_pool = ThreadPoolExecutor(max_workers=SHARD_SEARCH_THREADS, thread_name_prefix="shard-search")
+
+def search_shard(shard, queries, nprobe, ef_search, min_similarity):
+    """
+    Top-k (or threshold) search of one shard; one distances/ids row per
+    query. Shards with exact vectors re-score a wider candidate set.
+    """
+    params = search_parameters(shard.index, nprobe=nprobe, ef_search=ef_search)
+    vectors = shard.exact_vectors
+    if min_similarity is None:
+        if vectors is None:
+            return shard.index.search(queries, k=SEARCH_K, params=params)
+        _, I = shard.index.search(queries, k=max(SEARCH_K, RERANK_CANDIDATES), params=params)
+        return rerank(queries, I, vectors, SEARCH_K)
+    if vectors is None:
+        return range_search(shard.index, queries, min_similarity, params=params)
+
+    # Quantized scores can fall either side of the threshold
+    _, candidates = range_search(shard.index, queries, min_similarity - RERANK_MARGIN, params=params)
+    distances, ids = [], []
+    for query, i in zip(queries, candidates):
+        D, I = rerank(query[None], i[None], vectors, len(i))
+        keep = D[0] >= min_similarity
+        distances.append(D[0][keep])
+        ids.append(I[0][keep])
+    return distances, ids
+
+def search_shards(shards, queries, nprobe, ef_search, min_similarity):
+    """
+    Search the shards in parallel and merge their rows per query, best
+    first: the global top-k, or every threshold match up to the cap.
+    Returns (distances, shard positions, ids) per query row.
+    """
+    args = (queries, nprobe, ef_search, min_similarity)
+    if len(shards) == 1:
+        shard_results = [search_shard(shards[0], *args)]
+    else:
+        futures = [shard_pool.submit(search_shard, shard, *args) for shard in shards]
+        shard_results = [future.result() for future in futures]
+
+    limit = SEARCH_K if min_similarity is None else RANGE_SEARCH_MAX_RESULTS
+    return merge_shard_results(shard_results, limit)
+
+def select_shards(current, events):
+    """The shards for a list of event names (None = every shard)"""
+    if events is None:
+        return list(current.shards.values())
+    return [current.shards[event] for event in events if event in current.shards]
+
+def process_search_batch(items):
+    """
+    Embed the uncached queries of a batch in one forward pass, then search
+    once per distinct set of search parameters and events, covering every
+    face of every query. Returns (index_state, shards, query_rows, matches)
+    per item, with one (distances, shard positions, ids) row per searched
+    face (variable length in threshold mode). Each item's "stages" dict
+    receives the durations of the batch steps it took part in.
+    """
+    current = state
+    results = [None] * len(items)
+    search_batch_size.observe(len(items))
+
+    to_embed = [pos for pos, item in enumerate(items) if item["faces"] is None]
+    if to_embed:
+        stages = {}
+        embedded = embed_query_images([items[pos]["image"] for pos in to_embed], stages)
+        for pos, faces in zip(to_embed, embedded):
+            items[pos]["stages"].update(stages)
+            if isinstance(faces, Exception):
+                results[pos] = faces
+                continue
+            items[pos]["faces"] = faces
+            embedding_cache.put(items[pos]["cache_key"], faces)
+
+    def search_group(key, positions):
+        nprobe, ef_search, min_similarity, events = key
+        shards = select_shards(current, events)
+        query_rows = [items[pos]["faces"][:MAX_QUERY_FACES] for pos in positions]
+        queries = np.ascontiguousarray(np.vstack(query_rows)[:, BOX_COLUMNS:])
+        search_start = time.perf_counter()
+        if shards and len(queries):
+            matches = search_shards(shards, queries, nprobe, ef_search, min_similarity)
+        else:
+            # No shard left to search (e.g. a reload dropped the requested
+            # events): every face still gets its own, empty, row
+            no_match = (np.zeros(0, dtype="float32"), np.zeros(0, dtype="int64"), np.zeros(0, dtype="int64"))
+            matches = [no_match] * len(queries)
+        search_seconds = time.perf_counter() - search_start
+
+        group_results = []
+        start = 0
+        for pos, faces in zip(positions, query_rows):
+            items[pos]["stages"]["search"] = search_seconds
+            end = start + len(faces)
+            group_results.append((current, shards, faces, matches[start:end]))
+            start = end
+        return group_results
+
+    # Items with the same settings are searched together; a FAISS error
+    # fails only the requests in its group
+    return process_groups(
+        items, results,
+        lambda item: (item["nprobe"], item["ef_search"], item["min_similarity"], item["events"]),
+        search_group
+    )
+
+search_batcher = MicroBatcher(
+    process_search_batch,
+    max_batch_size=SEARCH_BATCH_SIZE,
+    max_wait_ms=SEARCH_BATCH_WAIT_MS,
+    name="search-batcher"
+)
+
+# === RESPONSE FORMATTING ===
+def format_matches(shards, distances, positions, ids, dedupe=False):
+    """
+    Turn one merged row of shard results into the /search result records.
+    With dedupe, only the best-scoring face of each original photo is kept.
+    """
+    results = []
+    seen = set()
+    for rank, idx in enumerate(ids):
+        if idx < 0:
+            # Approximate indexes return -1 when fewer than k neighbours are found
+            continue
+        shard = shards[positions[rank]]
+        image_id = int(shard.metadata.image_ids[idx])
+        if image_id < 0:
+            # Removed by an incremental update
+            continue
+        if dedupe:
+            if (shard.event, image_id) in seen:
+                continue
+            seen.add((shard.event, image_id))
+        original_filename = shard.metadata.image_name(image_id)
+        match_file = f"{original_filename}_face{int(shard.metadata.face_indices[idx])}"
+        match_path = os.path.join(shard.dataset_dir, original_filename)
+        result = {
+            "filename": match_file,
+            "original_filename": original_filename,  # Add original filename for easier access
+            "event": shard.event,
+            "similarity": float(distances[rank]),
+            "path": match_path
+        }
+        # Near-identical shots collapsed into this photo at build time
+        duplicates = shard.metadata.duplicates(image_id)
+        if duplicates:
+            result["duplicates"] = duplicates
+        results.append(result)
+    return results
+
+def cluster_gallery(shards, distances, positions, ids):
+    """
+    Every photo of the person a query face matched: the precomputed cluster
+    of its best match (see src/cluster_faces.py), or None if the shard has
+    no clusters or the best match is not close enough.
+    """
+    valid = np.flatnonzero(np.asarray(ids) >= 0)
+    if not len(valid):
+        return None
+    rank = valid[0]
+    shard, face_id = shards[positions[rank]], int(ids[rank])
+    metadata = shard.metadata
+    if metadata.cluster_ids is None:
+        return None
+    threshold = CLUSTER_MATCH_SIMILARITY if CLUSTER_MATCH_SIMILARITY is not None else metadata.clusters["threshold"]
+    cluster_id = int(metadata.cluster_ids[face_id])
+    if cluster_id < 0 or distances[rank] < threshold:
+        return None
+
+    members = metadata.cluster_members(cluster_id)
+    photos = []
+    seen = set()
+    for member in members:
+        image_id = int(metadata.image_ids[member])
+        if image_id < 0 or image_id in seen:
+            continue
+        seen.add(image_id)
+        original_filename = metadata.image_name(image_id)
+        photos.append({
+            "filename": f"{original_filename}_face{int(metadata.face_indices[member])}",
+            "original_filename": original_filename,
+            "event": shard.event,
+            "path": os.path.join(shard.dataset_dir, original_filename)
+        })
+    return {"event": shard.event, "cluster_id": cluster_id, "faces": len(members), "photos": photos}
+
+def event_required(current, event):
+    """
+    Whether a photo request must name its event: camera filenames such as
+    IMG_0001.jpg repeat across events, so with several shards a bare
+    filename is ambiguous.
+    """
+    return event is None and len(current.shards) > 1
 
-# === LOAD INDEX + FILENAMES ===
-print("Loading FAISS index...")
-index = faiss.read_index(INDEX_PATH)
-filenames = np.load(FILENAMES_PATH, allow_pickle=True)
+def find_photo(current, filename, event=None):
+    """
+    Path of a dataset photo in the given event's shard, or None if not
+    found. The event may only be omitted while a single shard is loaded.
+    """
+    if event is None:
+        if len(current.shards) != 1:
+            return None
+        shard = next(iter(current.shards.values()))
+    else:
+        shard = current.shards.get(event)
+        if shard is None:
+            return None
+    filepath = os.path.join(shard.dataset_dir, filename)
+    return filepath if os.path.exists(filepath) else None
+
+# === MODEL PRELOAD + WARM-UP ===
+# DeepFace builds models lazily on first use; keep our own references so the
+# singletons are built once per worker, before traffic arrives.
+face_model = None
+face_detector = None
+readiness = {"ready": False, "warmup_seconds": None, "error": None}
+
+def warm_up_models():
+    """Build ArcFace and the detector, then run a dummy query through them"""
+    global face_model, face_detector
+    start = time.time()
+    try:
+        face_model = DeepFace.build_model(MODEL_NAME, task="facial_recognition")
+        face_detector = DeepFace.build_model(DETECTOR_BACKEND, task="face_detector")
+
+        # Same code path as /search, so graph tracing happens here too
+        dummy = np.zeros((MAX_IMAGE_SIZE // 4, MAX_IMAGE_SIZE // 4, 3), dtype="uint8")
+        result = embed_query_images([dummy])[0]
+        if isinstance(result, Exception):
+            raise result
+
+        readiness["warmup_seconds"] = round(time.time() - start, 2)
+        readiness["ready"] = True
+        ready.set(1)
+        print(f"Models warmed up in {readiness['warmup_seconds']}s")
+    except Exception as e:
+        readiness["error"] = str(e)
+        print(f"Error warming up models: {str(e)}")
+
+threading.Thread(target=warm_up_models, name="model-warmup", daemon=True).start()
 
 # === FLASK APP ===
 app = Flask(__name__)
 CORS(app)  # Add this line to enable CORS for all routes
 swagger = Swagger(app)
 
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.timer = StageTimer()
+
+@app.after_request
+def record_request_metrics(response):
+    """Request count, duration and stage histograms; optional Server-Timing header"""
+    if "request_start" not in g:
+        return response
+    start, timer = g.request_start, g.timer
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    status = response.status_code
+
+    def record():
+        # Runs once the server has sent the whole body: a streamed
+        # /download/zip is still being written when after_request returns
+        request_count.labels(endpoint=endpoint, status=status).inc()
+        request_duration.labels(endpoint=endpoint).observe(time.perf_counter() - start)
+        for stage, seconds in timer.stages:
+            stage_duration.labels(endpoint=endpoint, stage=stage).observe(seconds)
+    response.call_on_close(record)
+
+    if SERVER_TIMING or request.args.get("server_timing") == "1":
+        # Headers go out before the body, so "total" excludes streaming it
+        response.headers["Server-Timing"] = timer.server_timing(total=time.perf_counter() - start)
+    return response
+
 @app.route("/")
 def home():
     return """
@@ -312,64 +908,196 @@ def search_faces():
         in: formData
         type: file
         required: true
-        description: Upload an image file for face search
+        description: Upload an image file for face search (also accepted as "image", as sent by the browser through the Node proxy)
+      - name: nprobe
+        in: formData
+        type: integer
+        required: false
+        description: IVF lists to scan (IVF indexes only), 1 to 4096
+      - name: ef_search
+        in: formData
+        type: integer
+        required: false
+        description: HNSW search depth (HNSW indexes only), 1 to 4096
+      - name: min_similarity
+        in: formData
+        type: number
+        required: false
+        description: >
+          Return every photo with a face at or above this cosine similarity
+          (range search, one result per photo) instead of the top 5 faces
+      - name: limit
+        in: formData
+        type: integer
+        required: false
+        description: Page size in threshold mode
+      - name: cursor
+        in: formData
+        type: string
+        required: false
+        description: next_cursor from the previous page in threshold mode
+      - name: events
+        in: formData
+        type: string
+        required: false
+        description: Comma-separated events to search (default all; see /health)
+      - name: gallery
+        in: formData
+        type: boolean
+        required: false
+        description: >
+          Also return, per face, every photo of the person it matched, from the
+          precomputed person clusters (shards without clusters return null)
     responses:
       200:
-        description: List of matching images
+        description: >
+          Matches for every face in the query, grouped per face. "results"
+          repeats the first face's matches for older clients.
         examples:
           application/json:
-            - filename: "celebrity1_face0.jpg"
-              similarity: 0.87
-              path: "dataset/celebrity/celebrity1.jpg"
+            results:
+              - filename: "celebrity1.jpg_face1"
+                original_filename: "celebrity1.jpg"
+                event: "convocation-2024"
+                similarity: 0.87
+                path: "dataset/convocation-2024/celebrity1.jpg"
+            faces:
+              - face_index: 1
+                box: {x: 0.31, y: 0.12, w: 0.18, h: 0.24}
+                confidence: 0.99
+                results: []
+                gallery:
+                  event: "convocation-2024"
+                  cluster_id: 42
+                  faces: 12
+                  photos: []
+            index_generation: 1
     """
-    if "file" not in request.files:
+    file = request.files.get("file") or request.files.get("image")
+    if file is None:
         return jsonify({"error": "No file uploaded"}), 400
 
-    file = request.files["file"]
+    try:
+        nprobe = int(request.form.get("nprobe", FAISS_NPROBE))
+        ef_search = int(request.form.get("ef_search", FAISS_EF_SEARCH))
+        if not 1 <= nprobe <= MAX_NPROBE or not 1 <= ef_search <= MAX_EF_SEARCH:
+            raise ValueError
+    except ValueError:
+        return jsonify({"error": f"nprobe must be an integer from 1 to {MAX_NPROBE} "
+                                 f"and ef_search from 1 to {MAX_EF_SEARCH}"}), 400
+
+    # Threshold mode: range search with cursor pagination
+    min_similarity = request.form.get("min_similarity")
+    offset, cursor_generation = 0, None
+    try:
+        if min_similarity is not None:
+            min_similarity = float(min_similarity)
+            limit = int(request.form.get("limit", RANGE_SEARCH_PAGE_SIZE))
+            if not -1.0 <= min_similarity <= 1.0 or limit < 1:
+                raise ValueError
+            if request.form.get("cursor"):
+                offset, cursor_generation = decode_cursor(request.form["cursor"])
+    except (ValueError, KeyError, TypeError):
+        return jsonify({"error": "Invalid min_similarity, limit or cursor"}), 400
+
+    gallery = request.form.get("gallery", "").lower() in ("1", "true", "yes")
+
+    # Restrict the search to some events' shards
+    events = None
+    if request.form.get("events"):
+        events = tuple(dict.fromkeys(
+            event.strip() for value in request.form.getlist("events")
+            for event in value.split(",") if event.strip()
+        ))
+        if not events:
+            return jsonify({"error": "events lists no event names", "events": list(state.shards)}), 400
+        unknown = [event for event in events if event not in state.shards]
+        if unknown:
+            return jsonify({
+                "error": f"Unknown events: {', '.join(unknown)}",
+                "events": list(state.shards)
+            }), 400
 
-    # Save query temporarily
-    query_path = os.path.join("uploads", file.filename)
-    os.makedirs("uploads", exist_ok=True)
-    file.save(query_path)
+    # Repeated uploads of the same image skip detection and inference
+    timer = g.timer
+    with timer.stage("read"):
+        data = file.read()
+        cache_key = EmbeddingCache.make_key(
+            content_hash(data), "query-faces", MODEL_NAME, DETECTOR_BACKEND, MAX_IMAGE_SIZE
+        )
+        item = {
+            "cache_key": cache_key,
+            "faces": embedding_cache.get(cache_key),
+            "image": None,
+            "nprobe": nprobe,
+            "ef_search": ef_search,
+            "min_similarity": min_similarity,
+            "events": events,
+            "stages": {}
+        }
+    embedding_cache_lookups.labels(result="miss" if item["faces"] is None else "hit").inc()
 
     try:
-        # Extract embedding
-        rep = DeepFace.represent(
-            query_path,
-            model_name=MODEL_NAME,
-            detector_backend=DETECTOR_BACKEND,
-            enforce_detection=False
-        )[0]["embedding"]
-
-        query_emb = np.array(rep).astype("float32")
-        query_emb = query_emb / (np.linalg.norm(query_emb) + 1e-10)
-
-        # Search in FAISS
-        D, I = index.search(query_emb.reshape(1, -1), k=5)
-
-        results = []
-        for rank, idx in enumerate(I[0]):
-            match_file = filenames[idx]
-            # Remove _face suffix to get original filename
-            original_filename = match_file.split("_face")[0]
-            match_path = os.path.join(DATASET_DIR, original_filename)
-            results.append({
-                "filename": match_file,
-                "original_filename": original_filename,  # Add original filename for easier access
-                "similarity": float(D[0][rank]),
-                "path": match_path
-            })
-
-        return jsonify(results)
+        if item["faces"] is None:
+            # Decode and resize in memory (in this request's thread), the same
+            # way the index builder does
+            with timer.stage("decode"):
+                query_img = resize_image_for_processing(io.BytesIO(data))
+                if query_img is not None:
+                    item["image"] = pil_to_cv2(query_img)
+            if item["image"] is None:
+                return jsonify({"error": "Could not decode image"}), 400
+
+        # Embedding and FAISS search run batched with concurrent requests;
+        # time not spent in the batch's own stages was spent waiting for it
+        submitted = time.perf_counter()
+        try:
+            current, shards, faces, matches = search_batcher.submit(item, timeout=SEARCH_TIMEOUT)
+        except TimeoutError:
+            return jsonify({"error": "Search timed out; the server is busy, please retry"}), 503
+        waited = time.perf_counter() - submitted
+        timer.record("queue", max(0.0, waited - sum(item["stages"].values())))
+        for stage, seconds in item["stages"].items():
+            timer.record(stage, seconds)
+
+        if cursor_generation is not None and cursor_generation != current.generation:
+            return jsonify({"error": "Index was reloaded; restart the search without a cursor"}), 409
+
+        format_start = time.perf_counter()
+        face_results = []
+        has_more = False
+        for face_pos, face in enumerate(faces):
+            x, y, w, h, confidence = (float(v) for v in face[:BOX_COLUMNS])
+            face_result = {
+                "face_index": face_pos + 1,
+                "box": {"x": x, "y": y, "w": w, "h": h},
+                "confidence": confidence
+            }
+            if min_similarity is None:
+                face_result["results"] = format_matches(shards, *matches[face_pos])
+            else:
+                face_matches = format_matches(shards, *matches[face_pos], dedupe=True)
+                face_result["total_matches"] = len(face_matches)
+                face_result["results"] = face_matches[offset:offset + limit]
+                has_more = has_more or offset + limit < len(face_matches)
+            if gallery:
+                face_result["gallery"] = cluster_gallery(shards, *matches[face_pos])
+            face_results.append(face_result)
+
+        response = {
+            "results": face_results[0]["results"] if face_results else [],
+            "faces": face_results,
+            "index_generation": current.generation
+        }
+        if min_similarity is not None:
+            response["next_cursor"] = encode_cursor(offset + limit, current.generation) if has_more else None
+        timer.record("format", time.perf_counter() - format_start)
+        with timer.stage("serialize"):
+            return jsonify(response)
 
     except Exception as e:
         print(f"Error during face recognition: {str(e)}")
         return jsonify({"error": f"Face recognition failed: {str(e)}"}), 500
-    
-    finally:
-        # Clean up uploaded file
-        if os.path.exists(query_path):
-            os.remove(query_path)
 
 @app.route("/download/<filename>", methods=["GET"])
 def download_image(filename):
@@ -382,33 +1110,261 @@ def download_image(filename):
         type: string
         required: true
         description: The filename of the image to download
+      - name: event
+        in: query
+        type: string
+        required: false
+        description: Event the photo belongs to (the "event" of a search result); required when several events are indexed
+      - name: size
+        in: query
+        type: integer
+        required: false
+        description: Longest side in pixels for a resized JPEG (default the original file)
+      - name: quality
+        in: query
+        type: integer
+        required: false
+        description: JPEG quality of the resized image (1-95)
     responses:
       200:
-        description: Returns the image file
+        description: Returns the image file, with ETag and Last-Modified
+      304:
+        description: Not modified since the client's cached copy
+      400:
+        description: Invalid size or quality, or no event with several events indexed
       404:
         description: File not found
     """
-    filepath = os.path.join(DATASET_DIR, filename)
-    if os.path.exists(filepath):
-        return send_file(filepath, mimetype="image/jpeg")
-    return jsonify({"error": "File not found"}), 404
+    try:
+        size = int(request.args["size"]) if request.args.get("size") else None
+        quality = int(request.args.get("quality", DOWNLOAD_JPEG_QUALITY))
+        if (size is not None and not 16 <= size <= DOWNLOAD_MAX_SIZE) or not 1 <= quality <= 95:
+            raise ValueError
+    except ValueError:
+        return jsonify({"error": f"size must be 16-{DOWNLOAD_MAX_SIZE} and quality 1-95"}), 400
+
+    current = state
+    event = request.args.get("event")
+    if event_required(current, event):
+        return jsonify({"error": "event is required when several events are indexed"}), 400
+
+    timer = g.timer
+    with timer.stage("lookup"):
+        filepath = find_photo(current, filename, event)
+    if filepath is None:
+        return jsonify({"error": "File not found"}), 404
+    if size is None:
+        with timer.stage("send"):
+            return send_file(filepath, mimetype="image/jpeg", max_age=DOWNLOAD_MAX_AGE)
+
+    with timer.stage("resize"):
+        resized_path = thumbnail_cache.get(filepath, size, quality)
+    if resized_path is None:
+        return jsonify({"error": "Could not decode image"}), 400
+    # The variant's mtime is bumped on every hit for LRU eviction, so
+    # validators come from the cache key and the original photo instead
+    with timer.stage("send"):
+        return send_file(
+            resized_path,
+            mimetype="image/jpeg",
+            etag=os.path.splitext(os.path.basename(resized_path))[0],
+            last_modified=os.path.getmtime(filepath),
+            max_age=DOWNLOAD_MAX_AGE
+        )
+
+@app.route("/download/zip", methods=["POST"])
+def download_zip():
+    """
+    Download several photos as one ZIP archive, streamed as it is read from disk
+    ---
+    consumes:
+      - application/json
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          properties:
+            files:
+              type: array
+              description: >
+                {filename, event} objects; plain filenames are accepted while a
+                single event is indexed
+              items: {}
+    responses:
+      200:
+        description: >
+          ZIP archive; X-Missing-Files counts requested photos that were not found
+      400:
+        description: No files requested, too many, a file without its event, or none found
+    """
+    body = request.get_json(silent=True) or {}
+    requested = body.get("files")
+    if not isinstance(requested, list) or not requested:
+        return jsonify({"error": "Expected a JSON body with a non-empty files list"}), 400
+    if len(requested) > ZIP_MAX_FILES:
+        return jsonify({"error": f"At most {ZIP_MAX_FILES} files per archive"}), 400
+
+    current = state
+    entries, names, missing = [], set(), 0
+    for item in requested:
+        filename, event = (item.get("filename"), item.get("event")) if isinstance(item, dict) else (item, None)
+        if event_required(current, event):
+            return jsonify({"error": "Every file needs its event when several events are indexed"}), 400
+        # Plain filenames only: no directories or parent references
+        if not isinstance(filename, str) or os.path.basename(filename) != filename or filename.startswith("."):
+            missing += 1
+            continue
+        filepath = find_photo(current, filename, event)
+        if filepath is None:
+            missing += 1
+            continue
+        # Same name in two events: keep both, one under its event's folder
+        arcname = filename if filename not in names else f"{event or 'photos'}/{filename}"
+        if arcname in names:
+            continue
+        names.add(arcname)
+        entries.append((arcname, filepath))
+
+    if not entries:
+        return jsonify({"error": "None of the requested files were found"}), 400
+
+    return Response(stream_zip(entries), mimetype="application/zip", headers={
+        "Content-Disposition": 'attachment; filename="photos.zip"',
+        "X-Missing-Files": str(missing)
+    })
+
+@app.route("/admin/reload", methods=["POST"])
+def admin_reload():
+    """
+    Reload the FAISS index and face metadata in the background
+    With the index watcher on (INDEX_WATCH_INTERVAL > 0) the request is
+    broadcast: a new reload_id is written to the reload marker file and
+    every gunicorn worker reloads within about two watch intervals. Poll
+    /health until the workers answering report that reload_id. With the
+    watcher off, only the worker receiving this request reloads.
+    ---
+    parameters:
+      - name: X-Admin-Token
+        in: header
+        type: string
+        required: false
+        description: Required when ADMIN_TOKEN is configured
+    responses:
+      202:
+        description: Reload requested; see reload_id and broadcast
+      403:
+        description: Invalid admin token
+      409:
+        description: A reload is already in progress
+    """
+    if ADMIN_TOKEN and request.headers.get("X-Admin-Token") != ADMIN_TOKEN:
+        return jsonify({"error": "Invalid admin token"}), 403
+    if reload_lock.locked():
+        return jsonify({"error": "Reload already in progress"}), 409
+
+    reload_id = None
+    if INDEX_WATCH_INTERVAL > 0:
+        reload_id = f"{time.time():.6f}-{os.getpid()}"
+        try:
+            tmp_path = f"{RELOAD_MARKER_PATH}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(reload_id)
+            os.replace(tmp_path, RELOAD_MARKER_PATH)
+        except OSError as e:
+            print(f"Error writing reload marker, reloading this worker only: {e}")
+            reload_id = None
+    if reload_id is None:
+        threading.Thread(target=reload_index, daemon=True).start()
+
+    return jsonify({
+        "status": "reloading",
+        "broadcast": reload_id is not None,
+        "reload_id": reload_id,
+        "worker": os.getpid(),
+        "current_generation": state.generation
+    }), 202
+
+@app.route("/ready", methods=["GET"])
+def readiness_check():
+    """
+    Readiness check for load balancers
+    ---
+    responses:
+      200:
+        description: Models are warmed up and the index is loaded
+      503:
+        description: Worker is alive but still warming up
+    """
+    body = {
+        "ready": readiness["ready"],
+        "index_generation": state.generation,
+        "warmup_seconds": readiness["warmup_seconds"],
+        "warmup_error": readiness["error"]
+    }
+    return jsonify(body), 200 if readiness["ready"] else 503
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """
+    Prometheus metrics of all gunicorn workers
+    ---
+    responses:
+      200:
+        description: >
+          Request counts and durations, per-stage durations of /search and
+          /download, search batch sizes, embedding cache lookups, index size
+          and readiness, aggregated across workers when
+          PROMETHEUS_MULTIPROC_DIR is set
+    """
+    return Response(metrics.render(), mimetype=CONTENT_TYPE_LATEST)
 
 # Add a health check endpoint
 @app.route("/health", methods=["GET"])
 def health_check():
     """
-    Health check endpoint
+    Health check endpoint (liveness; see /ready for readiness)
     ---
     responses:
       200:
         description: API is healthy
     """
+    current = state
+    try:
+        # Each gunicorn worker answers for itself; see src/process_memory.py
+        # for all workers at once
+        memory = process_memory()
+    except OSError:
+        memory = None
     return jsonify({
         "status": "healthy",
         "message": "Face recognition API is running",
-        "index_loaded": index is not None,
-        "filenames_loaded": filenames is not None,
-        "total_faces": len(filenames) if filenames is not None else 0
+        "ready": readiness["ready"],
+        "index_loaded": bool(current.shards),
+        "filenames_loaded": bool(current.shards),
+        # Incremental builds leave removed faces as empty filename slots
+        "total_faces": current.total_faces,
+        "model": MODEL_NAME,
+        "detector": DETECTOR_BACKEND,
+        "index_type": ", ".join(sorted({describe_index(shard.index) for shard in current.shards.values()})),
+        "index_mmap": FAISS_MMAP,
+        "shards": {
+            event: dict(shard.metadata.build_info, faces=shard.index.ntotal, index_type=describe_index(shard.index),
+                        clusters=shard.metadata.clusters.get("clusters"),
+                        rerank=shard.exact_vectors is not None)
+            for event, shard in current.shards.items()
+        },
+        "worker": os.getpid(),
+        "index_generation": current.generation,
+        "index_reload_id": current.reload_id,
+        "index_loaded_at": current.loaded_at,
+        "reload_in_progress": reload_status["in_progress"],
+        "last_reload_error": reload_status["last_error"],
+        "embedding_cache": embedding_cache.stats(),
+        "thumbnail_cache": thumbnail_cache.stats(),
+        "search_batching": search_batcher.stats(),
+        "memory": memory
     })
 
 if __name__ == "__main__":
@@ -0,0 +1,22 @@
+"""
+gunicorn settings, read automatically when gunicorn is started from flask-api/.
+Command-line flags (scripts/setup-services.sh) still set workers, threads and
+timeouts.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+def on_starting(server):
+    # Samples left by a previous run would be added to this run's counters
+    directory = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            if name.endswith(".db"):
+                os.remove(os.path.join(directory, name))
+
+def child_exit(server, worker):
+    from metrics import mark_worker_dead
+    mark_worker_dead(worker.pid)
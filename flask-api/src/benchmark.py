@@ -0,0 +1,406 @@
+"""
+End-to-end benchmarks for index builds and /search, with JSON reports that
+can be compared across commits.
+
+index: builds each index type over a synthetic face-embedding corpus and
+measures build time, memory and single-query latency (p50/p95/p99) plus
+recall@k against exact search. The corpus mimics ArcFace embeddings of a
+convocation: a few photos per person, each a noisy copy of that person's
+direction on the unit sphere (cosine ~0.5 between two photos of the same
+person, ~0 otherwise). It is generated in fixed-size chunks from (seed,
+chunk) and cached as .npy files, so 10M-vector runs are reproducible and
+never hold the whole corpus in memory outside the index itself.
+
+load: replays concurrent /search uploads against a running API (or one
+started here with gunicorn) and reports throughput, latency percentiles
+and the per-stage breakdown from the Server-Timing header.
+
+Usage (from flask-api/src):
+    python benchmark.py index --sizes 10k,100k,1M --types flat,ivf-flat,hnsw
+    python benchmark.py index --sizes 1M --baseline ../embeddings/benchmarks/index-20251001-120000.json
+    python benchmark.py load --start --images ../dataset/convocation-2024 --concurrency 1,4,16
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import faiss
+import requests
+
+from index_factory import (
+    INDEX_TYPES, DEFAULT_NPROBE, DEFAULT_EF_SEARCH, DEFAULT_PQ_M, DEFAULT_HNSW_M,
+    DEFAULT_TRAIN_SIZE, create_index_from_chunks, search_parameters, describe_index
+)
+from evaluate_index import time_queries, recall_at_k
+from process_memory import process_memory
+
+DEFAULT_REPORT_DIR = "../embeddings/benchmarks"
+DEFAULT_CORPUS_DIR = "../embeddings/benchmarks/corpus"
+DEFAULT_QUERY_DIR = "../dataset/convocation-2024"
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+EMBEDDING_DIM = 512           # ArcFace
+CORPUS_CHUNK_SIZE = 100000    # Vectors generated (and cached) per chunk
+FACES_PER_PERSON = 8
+SAME_PERSON_SPREAD = 1.0      # Noise norm relative to the unit identity vector
+
+# === SHARED ===
+def parse_size(value):
+    """10000, 10k or 1M"""
+    value = value.strip().lower()
+    multiplier = {"k": 1000, "m": 1000000}.get(value[-1:], 1)
+    return int(float(value.rstrip("km")) * multiplier)
+
+def latency_summary(latencies_ms):
+    latencies_ms = np.asarray(latencies_ms, dtype="float64")
+    if not len(latencies_ms):
+        return {"mean_ms": None, "p50_ms": None, "p95_ms": None, "p99_ms": None}
+    return {
+        "mean_ms": round(float(latencies_ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies_ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 3)
+    }
+
+def environment():
+    """What the numbers depend on besides the code, recorded in every report"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=APP_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "faiss": faiss.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "faiss_threads": faiss.omp_get_max_threads()
+    }
+
+def write_report(report_dir, kind, report):
+    os.makedirs(report_dir, exist_ok=True)
+    path = os.path.join(report_dir, f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nReport saved to: {path}")
+    return path
+
+# === SYNTHETIC CORPUS ===
+def chunk_identities(seed, chunk, dim=EMBEDDING_DIM):
+    """Unit identity vectors of the people whose faces make up one chunk"""
+    rng = np.random.default_rng([seed, chunk])
+    identities = rng.standard_normal((CORPUS_CHUNK_SIZE // FACES_PER_PERSON, dim)).astype("float32")
+    identities /= np.linalg.norm(identities, axis=1, keepdims=True)
+    return identities, rng
+
+def noisy_faces(identities, rng):
+    """One normalized "photo" embedding per identity row"""
+    noise = rng.standard_normal(identities.shape).astype("float32")
+    noise *= SAME_PERSON_SPREAD / np.sqrt(identities.shape[1])
+    faces = identities + noise
+    return faces / np.linalg.norm(faces, axis=1, keepdims=True)
+
+def generate_chunk(seed, chunk, dim=EMBEDDING_DIM):
+    """FACES_PER_PERSON consecutive photos of each of the chunk's people"""
+    identities, rng = chunk_identities(seed, chunk, dim)
+    return noisy_faces(np.repeat(identities, FACES_PER_PERSON, axis=0), rng)
+
+def synthetic_corpus(n_vectors, corpus_dir, seed=0, dim=EMBEDDING_DIM):
+    """The first n_vectors of the corpus, as memory-mapped chunks"""
+    directory = os.path.join(corpus_dir, f"seed{seed}-dim{dim}")
+    os.makedirs(directory, exist_ok=True)
+    chunks = []
+    for chunk, start in enumerate(range(0, n_vectors, CORPUS_CHUNK_SIZE)):
+        size = min(CORPUS_CHUNK_SIZE, n_vectors - start)
+        # Full chunks are cached; a smaller corpus uses a prefix of them
+        path = os.path.join(directory, f"chunk_{chunk:05d}.npy")
+        if not os.path.exists(path):
+            tmp_path = path + ".tmp.npy"
+            np.save(tmp_path, generate_chunk(seed, chunk, dim))
+            os.replace(tmp_path, path)
+        chunks.append(np.load(path, mmap_mode="r")[:size])
+    return chunks
+
+def synthetic_queries(n_vectors, n_queries, seed=0, dim=EMBEDDING_DIM):
+    """New photos of people in the corpus, not stored in it"""
+    rng = np.random.default_rng([seed, 1 << 30])
+    people = rng.integers(0, -(-n_vectors // FACES_PER_PERSON), n_queries)
+    people_per_chunk = CORPUS_CHUNK_SIZE // FACES_PER_PERSON
+    queries = np.empty((n_queries, dim), dtype="float32")
+    for chunk in np.unique(people // people_per_chunk):
+        identities, _ = chunk_identities(seed, int(chunk), dim)
+        rows = np.flatnonzero(people // people_per_chunk == chunk)
+        queries[rows] = noisy_faces(identities[people[rows] % people_per_chunk], rng)
+    return queries
+
+def exact_neighbours(chunks, queries, k):
+    """Exact top-k ids over all chunks, merged chunk by chunk"""
+    best_d = np.full((len(queries), k), -np.inf, dtype="float32")
+    best_i = np.full((len(queries), k), -1, dtype="int64")
+    offset = 0
+    for chunk in chunks:
+        d, i = faiss.knn(queries, np.ascontiguousarray(chunk), min(k, len(chunk)),
+                         metric=faiss.METRIC_INNER_PRODUCT)
+        d, i = np.hstack([best_d, d]), np.hstack([best_i, i + offset])
+        order = np.argsort(-d, axis=1, kind="stable")[:, :k]
+        best_d, best_i = np.take_along_axis(d, order, 1), np.take_along_axis(i, order, 1)
+        offset += len(chunk)
+    return best_i
+
+# === INDEX BENCHMARK ===
+def benchmark_index(chunks, index_type, queries, exact_ids, k, args, work_dir):
+    rss_before = process_memory()["rss_mb"]
+    start = time.perf_counter()
+    index = create_index_from_chunks(chunks, index_type, nlist=args.nlist, pq_m=args.pq_m,
+                                     hnsw_m=args.hnsw_m, train_size=args.train_size)
+    build_seconds = time.perf_counter() - start
+    rss_after = process_memory()["rss_mb"]
+
+    index_path = os.path.join(work_dir, f"{index_type}.index.tmp")
+    faiss.write_index(index, index_path)
+    index_bytes = os.path.getsize(index_path)
+    os.remove(index_path)
+
+    params = search_parameters(index, nprobe=args.nprobe, ef_search=args.ef_search)
+    found_ids, latencies = time_queries(index, queries, k, params)
+    # Batched throughput, as the micro-batcher searches
+    start = time.perf_counter()
+    index.search(queries, k, params=params)
+    batch_qps = len(queries) / (time.perf_counter() - start)
+
+    row = dict({
+        "vectors": index.ntotal,
+        "index_type": index_type,
+        "index": describe_index(index),
+        "build_seconds": round(build_seconds, 2),
+        "index_mb": round(index_bytes / 1024 / 1024, 1),
+        "rss_delta_mb": round(rss_after - rss_before, 1),
+        "recall_at_k": round(recall_at_k(found_ids, exact_ids), 4),
+        "batch_qps": round(batch_qps, 1)
+    }, **latency_summary(latencies))
+    print(f"{index.ntotal:>9} {index_type:<9} build={row['build_seconds']}s  index={row['index_mb']}MB  "
+          f"recall@k={row['recall_at_k']:.4f}  p50={row['p50_ms']}ms  p95={row['p95_ms']}ms  "
+          f"p99={row['p99_ms']}ms")
+    del index
+    return row
+
+def compare_with_baseline(rows, baseline_path):
+    """Print how build time, p95 and recall moved since a previous report"""
+    with open(baseline_path) as f:
+        baseline = {(r["vectors"], r["index_type"]): r for r in json.load(f)["results"]}
+    print(f"\n=== Compared with {baseline_path} ===")
+    for row in rows:
+        old = baseline.get((row["vectors"], row["index_type"]))
+        if old is None:
+            continue
+        print(f"{row['vectors']:>9} {row['index_type']:<9} "
+              f"build {old['build_seconds']}s -> {row['build_seconds']}s  "
+              f"p95 {old['p95_ms']}ms -> {row['p95_ms']}ms  "
+              f"recall {old['recall_at_k']} -> {row['recall_at_k']}")
+
+def run_index_benchmark(args):
+    index_types = [t for t in args.types.split(",") if t]
+    for index_type in index_types:
+        if index_type not in INDEX_TYPES:
+            sys.exit(f"Unknown index type: {index_type}")
+    sizes = [parse_size(s) for s in args.sizes.split(",") if s]
+
+    rows = []
+    for n_vectors in sizes:
+        print(f"=== {n_vectors} vectors ===")
+        chunks = synthetic_corpus(n_vectors, args.corpus_dir, args.seed)
+        queries = synthetic_queries(n_vectors, args.queries, args.seed)
+        k = min(args.k, n_vectors)
+        exact_ids = exact_neighbours(chunks, queries, k)
+        for index_type in index_types:
+            rows.append(benchmark_index(chunks, index_type, queries, exact_ids, k, args, args.corpus_dir))
+
+    report = {
+        "benchmark": "index",
+        "environment": environment(),
+        "config": {
+            "queries": args.queries, "k": args.k, "seed": args.seed, "dim": EMBEDDING_DIM,
+            "nprobe": args.nprobe, "ef_search": args.ef_search, "nlist": args.nlist,
+            "pq_m": args.pq_m, "hnsw_m": args.hnsw_m, "train_size": args.train_size
+        },
+        "results": rows
+    }
+    write_report(args.output_dir, "index", report)
+    if args.baseline:
+        compare_with_baseline(rows, args.baseline)
+
+# === LOAD GENERATOR ===
+def parse_server_timing(header):
+    """{"detect": ms, ...} from a Server-Timing header"""
+    stages = {}
+    for entry in (header or "").split(","):
+        name, _, params = entry.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip() == "dur":
+                stages[name] = float(value)
+    return stages
+
+def load_query_images(directory, limit):
+    filenames = sorted(f for f in os.listdir(directory) if f.lower().endswith((".jpg", ".jpeg", ".png")))
+    images = []
+    for filename in filenames[:limit]:
+        with open(os.path.join(directory, filename), "rb") as f:
+            images.append((filename, f.read()))
+    return images
+
+def send_search(session, url, image, unique, form):
+    """One /search upload; returns (status or error name, latency ms, stages)"""
+    filename, data = image
+    if unique:
+        # Bytes after the JPEG end marker are ignored by decoders but defeat
+        # the query embedding cache
+        data = data + os.urandom(16)
+    start = time.perf_counter()
+    try:
+        response = session.post(f"{url}/search", params={"server_timing": "1"},
+                                files={"file": (filename, data, "image/jpeg")}, data=form, timeout=120)
+        status = response.status_code
+        stages = parse_server_timing(response.headers.get("Server-Timing"))
+    except requests.RequestException as e:
+        status, stages = type(e).__name__, {}
+    return status, (time.perf_counter() - start) * 1000, stages
+
+def run_load_level(url, images, concurrency, n_requests, unique, form):
+    sessions = [requests.Session() for _ in range(concurrency)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(
+            lambda i: send_search(sessions[i % concurrency], url, images[i % len(images)], unique, form),
+            range(n_requests)
+        ))
+    elapsed = time.perf_counter() - start
+
+    statuses = {}
+    for status, _, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    ok = [(latency, stages) for status, latency, stages in results if status == 200]
+    stage_names = sorted({name for _, stages in ok for name in stages})
+    row = dict({
+        "concurrency": concurrency,
+        "requests": n_requests,
+        "statuses": statuses,
+        "errors": n_requests - len(ok),
+        "throughput_rps": round(n_requests / elapsed, 2)
+    }, **latency_summary([latency for latency, _ in ok]))
+    row["stages"] = {
+        name: latency_summary([stages[name] for _, stages in ok if name in stages])
+        for name in stage_names
+    }
+    print(f"concurrency={concurrency:<4} rps={row['throughput_rps']:<8} p50={row['p50_ms']}ms  "
+          f"p95={row['p95_ms']}ms  p99={row['p99_ms']}ms  errors={row['errors']}")
+    return row
+
+def start_api(port, workers, threads, ready_timeout):
+    """Start app.py under gunicorn, as in production, and wait for /ready"""
+    process = subprocess.Popen(
+        ["gunicorn", "--bind", f"127.0.0.1:{port}", "--workers", str(workers),
+         "--threads", str(threads), "--timeout", "120", "app:app"],
+        cwd=APP_DIR
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + ready_timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            sys.exit(f"API exited with status {process.returncode}")
+        try:
+            if requests.get(f"{url}/ready", timeout=2).status_code == 200:
+                return process, url
+        except requests.RequestException:
+            pass
+        time.sleep(1)
+    process.terminate()
+    sys.exit(f"API not ready after {ready_timeout}s")
+
+def run_load_benchmark(args):
+    images = load_query_images(args.images, args.max_images)
+    if not images:
+        sys.exit(f"No query images in {args.images}")
+    form = {"min_similarity": str(args.min_similarity)} if args.min_similarity is not None else {}
+
+    process, url = start_api(args.port, args.workers, args.threads, args.ready_timeout) if args.start \
+        else (None, args.url.rstrip("/"))
+    try:
+        print(f"=== {url}/search, {len(images)} query images ===")
+        session = requests.Session()
+        for image in images[:args.warmup]:
+            send_search(session, url, image, args.unique, form)
+        health = requests.get(f"{url}/health", timeout=10).json()
+        rows = [run_load_level(url, images, concurrency, args.requests, args.unique, form)
+                for concurrency in (int(c) for c in args.concurrency.split(",") if c)]
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    report = {
+        "benchmark": "load",
+        "environment": environment(),
+        "config": {
+            "url": url, "images": len(images), "requests_per_level": args.requests,
+            "unique": args.unique, "min_similarity": args.min_similarity,
+            "workers": args.workers if args.start else None,
+            "threads": args.threads if args.start else None
+        },
+        "server": {key: health.get(key) for key in ("model", "detector", "index_type", "total_faces", "search_batching")},
+        "results": rows
+    }
+    write_report(args.output_dir, "load", report)
+
+def main():
+    parser = argparse.ArgumentParser(description="Index build/search and /search load benchmarks")
+    parser.add_argument("--output-dir", default=DEFAULT_REPORT_DIR, help="Where to write JSON reports")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    index_parser = commands.add_parser("index", help="Build and search synthetic corpora")
+    index_parser.add_argument("--sizes", default="10k,100k,1M", help="Comma-separated corpus sizes (10k ... 10M)")
+    index_parser.add_argument("--types", default=",".join(INDEX_TYPES), help="Comma-separated index types")
+    index_parser.add_argument("--corpus-dir", default=DEFAULT_CORPUS_DIR, help="Cache of generated vectors")
+    index_parser.add_argument("--seed", type=int, default=0)
+    index_parser.add_argument("--queries", type=int, default=1000)
+    # The exact top FACES_PER_PERSON are the query person's own photos, so
+    # recall@k measures finding them rather than ranking unrelated faces
+    index_parser.add_argument("--k", type=int, default=FACES_PER_PERSON)
+    index_parser.add_argument("--nprobe", type=int, default=DEFAULT_NPROBE)
+    index_parser.add_argument("--ef-search", type=int, default=DEFAULT_EF_SEARCH)
+    index_parser.add_argument("--nlist", type=int, default=None)
+    index_parser.add_argument("--pq-m", type=int, default=DEFAULT_PQ_M)
+    index_parser.add_argument("--hnsw-m", type=int, default=DEFAULT_HNSW_M)
+    index_parser.add_argument("--train-size", type=int, default=DEFAULT_TRAIN_SIZE)
+    index_parser.add_argument("--baseline", default=None, help="Earlier index report to compare against")
+
+    load_parser = commands.add_parser("load", help="Concurrent /search requests against the API")
+    load_parser.add_argument("--url", default="http://127.0.0.1:5000")
+    load_parser.add_argument("--start", action="store_true", help="Start app.py with gunicorn first")
+    load_parser.add_argument("--port", type=int, default=5055, help="Port for --start")
+    load_parser.add_argument("--workers", type=int, default=2, help="gunicorn workers for --start")
+    load_parser.add_argument("--threads", type=int, default=8, help="gunicorn threads for --start")
+    load_parser.add_argument("--ready-timeout", type=int, default=300)
+    load_parser.add_argument("--images", default=DEFAULT_QUERY_DIR, help="Directory of query images")
+    load_parser.add_argument("--max-images", type=int, default=200)
+    load_parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated concurrency levels")
+    load_parser.add_argument("--requests", type=int, default=200, help="Requests per concurrency level")
+    load_parser.add_argument("--warmup", type=int, default=5)
+    load_parser.add_argument("--unique", action="store_true", help="Make every upload miss the embedding cache")
+    load_parser.add_argument("--min-similarity", type=float, default=None, help="Benchmark threshold mode")
+
+    args = parser.parse_args()
+    if args.command == "index":
+        run_index_benchmark(args)
+    else:
+        run_load_benchmark(args)
+
+if __name__ == "__main__":
+    main()
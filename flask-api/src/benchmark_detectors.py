@@ -0,0 +1,169 @@
+"""
+Face detector quality/speed benchmark.
+
+Runs candidate DeepFace detectors over a sample of dataset photos, through
+the same resize path as the builder and the API, and compares the faces
+each one finds against a reference: MTCNN (the build default) or, with
+--labels, hand-labelled boxes. A detected face matches a reference face
+when their boxes overlap with IoU >= --iou.
+
+Labels are JSON mapping a filename to its face boxes as fractions of the
+image, the same x, y, w, h convention as the metadata store:
+    {"IMG_0001.jpg": [[0.31, 0.12, 0.18, 0.24], ...], ...}
+
+Usage (from flask-api/src):
+    python benchmark_detectors.py --sample 200
+    python benchmark_detectors.py --labels ../dataset/labels.json --detectors opencv,yunet
+"""
+import os
+import json
+import time
+import argparse
+import numpy as np
+from deepface import DeepFace
+
+from utils import DETECTOR_BACKENDS, resize_image_for_processing, pil_to_cv2, face_box
+
+DEFAULT_DATASET_DIR = "../dataset/convocation-2024"
+DEFAULT_REPORT_PATH = "../embeddings/detector_report.json"
+DEFAULT_DETECTORS = "opencv,ssd,retinaface,yunet,mediapipe"
+REFERENCE_DETECTOR = "mtcnn"
+
+def detect_boxes(image, detector):
+    """Face boxes (fractions of the image) found by a detector"""
+    faces = DeepFace.extract_faces(image, detector_backend=detector, enforce_detection=False)
+    height, width = image.shape[:2]
+    boxes = []
+    for face in faces:
+        area = face["facial_area"]
+        # With enforce_detection=False, "no face" comes back as the whole image
+        if face.get("confidence", 0) == 0 and (area["w"], area["h"]) == (width, height):
+            continue
+        boxes.append(face_box(area, image.shape))
+    return boxes
+
+def iou(a, b):
+    """Intersection over union of two x, y, w, h boxes"""
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[0] + a[2], b[0] + b[2]), min(a[1] + a[3], b[1] + b[3])
+    intersection = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = a[2] * a[3] + b[2] * b[3] - intersection
+    return intersection / union if union > 0 else 0.0
+
+def count_matches(found, reference, threshold):
+    """Reference boxes matched by a found box, pairing greedily by best IoU"""
+    pairs = sorted(((iou(f, r), i, j) for i, f in enumerate(found) for j, r in enumerate(reference)),
+                   reverse=True)
+    used_found, used_reference = set(), set()
+    for overlap, i, j in pairs:
+        if overlap < threshold:
+            break
+        if i not in used_found and j not in used_reference:
+            used_found.add(i)
+            used_reference.add(j)
+    return len(used_reference)
+
+def run_detector(detector, images):
+    """Boxes per image and per-image latency in ms; None for images that failed"""
+    # Build the model outside the timed loop
+    DeepFace.build_model(detector, task="face_detector")
+    boxes, latencies, errors = {}, [], 0
+    for filename, image in images.items():
+        start = time.perf_counter()
+        try:
+            boxes[filename] = detect_boxes(image, detector)
+        except Exception as e:
+            print(f"  {detector} failed on {filename}: {e}")
+            boxes[filename] = None
+            errors += 1
+            continue
+        latencies.append((time.perf_counter() - start) * 1000)
+    return boxes, np.array(latencies), errors
+
+def summarize(detector, boxes, latencies, errors, reference, iou_threshold):
+    found = sum(len(b) for b in boxes.values() if b is not None)
+    reference_faces = sum(len(reference[f]) for f, b in boxes.items() if b is not None)
+    matched = sum(count_matches(b, reference[f], iou_threshold) for f, b in boxes.items() if b is not None)
+    row = {
+        "detector": detector,
+        "faces_found": found,
+        "reference_faces": reference_faces,
+        "recall": round(matched / reference_faces, 4) if reference_faces else None,
+        "precision": round(matched / found, 4) if found else None,
+        "mean_ms": round(float(latencies.mean()), 1) if len(latencies) else None,
+        "p50_ms": round(float(np.percentile(latencies, 50)), 1) if len(latencies) else None,
+        "p95_ms": round(float(np.percentile(latencies, 95)), 1) if len(latencies) else None,
+        "errors": errors
+    }
+    print(f"{detector:<12} faces={found:<6} recall={row['recall']}  precision={row['precision']}  "
+          f"mean={row['mean_ms']}ms  p95={row['p95_ms']}ms  errors={errors}")
+    return row
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare face detectors on dataset photos")
+    parser.add_argument("--dataset", default=DEFAULT_DATASET_DIR)
+    parser.add_argument("--output", default=DEFAULT_REPORT_PATH, help="Where to write the JSON report")
+    parser.add_argument("--detectors", default=DEFAULT_DETECTORS, help="Comma-separated detectors")
+    parser.add_argument("--labels", default=None, help="Hand-labelled boxes (default: compare against MTCNN)")
+    parser.add_argument("--sample", type=int, default=200, help="Photos sampled from the dataset")
+    parser.add_argument("--iou", type=float, default=0.5, help="Minimum IoU for a match")
+    args = parser.parse_args()
+
+    detectors = [d for d in args.detectors.split(",") if d]
+    for detector in detectors:
+        if detector not in DETECTOR_BACKENDS:
+            parser.error(f"Unknown detector: {detector}")
+
+    if args.labels:
+        with open(args.labels) as f:
+            labels = {name: [tuple(box) for box in boxes] for name, boxes in json.load(f).items()}
+        filenames = sorted(labels)
+    else:
+        labels = None
+        filenames = sorted(f for f in os.listdir(args.dataset)
+                           if f.lower().endswith((".jpg", ".jpeg", ".png")))
+    rng = np.random.default_rng(0)
+    if len(filenames) > args.sample:
+        filenames = sorted(rng.choice(filenames, args.sample, replace=False))
+
+    # Decode once; every detector sees the same resized images
+    images = {}
+    for filename in filenames:
+        resized = resize_image_for_processing(os.path.join(args.dataset, filename))
+        if resized is not None:
+            images[filename] = pil_to_cv2(resized)
+    print(f"=== {len(images)} images, reference: {'labels' if labels else REFERENCE_DETECTOR} ===")
+
+    rows = []
+    if labels is None:
+        # MTCNN is the reference: its own recall is 1 by definition
+        reference_boxes, latencies, errors = run_detector(REFERENCE_DETECTOR, images)
+        reference = {f: b for f, b in reference_boxes.items() if b is not None}
+        images = {f: image for f, image in images.items() if f in reference}
+        rows.append(summarize(REFERENCE_DETECTOR, reference_boxes, latencies, errors, reference, args.iou))
+        detectors = [d for d in detectors if d != REFERENCE_DETECTOR]
+    else:
+        reference = labels
+
+    for detector in detectors:
+        try:
+            boxes, latencies, errors = run_detector(detector, images)
+        except Exception as e:
+            # Optional dependency missing (e.g. mediapipe not installed)
+            print(f"{detector:<12} unavailable: {e}")
+            rows.append({"detector": detector, "error": str(e)})
+            continue
+        rows.append(summarize(detector, boxes, latencies, errors, reference, args.iou))
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump({
+            "images": len(images),
+            "reference": "labels" if labels else REFERENCE_DETECTOR,
+            "iou_threshold": args.iou,
+            "results": rows
+        }, f, indent=2)
+    print(f"\nReport saved to: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -118,69 +118,140 @@
 # print(f"Index built with {len(filenames)} faces (from {len(os.listdir(dataset_dir))} images)")
 
 import os
+import json
+import shutil
+import argparse
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import faiss
 from deepface import DeepFace
-from PIL import Image
-import cv2
+
+from utils import (
+    MAX_IMAGE_SIZE, MODEL_NAME, DETECTOR_BACKEND, DETECTOR_BACKENDS,
+    BOX_COLUMNS, resize_image_for_processing, pil_to_cv2,
+    face_box, face_rows, image_phash
+)
+from index_factory import (
+    INDEX_TYPES, QUANTIZED_TYPES, DEFAULT_PQ_M, DEFAULT_HNSW_M, DEFAULT_TRAIN_SIZE, EXACT_VECTORS_NAME,
+    create_index_from_chunks, describe_index, write_exact_vectors, unwrap_index, unwrap_id_mapped_ivf
+)
+from embedding_cache import EmbeddingCache, file_content_hash
+from face_embedding import embed_face_crop, embed_face_crops
+from detection_cache import DetectionCache
+from metadata_store import FaceMetadataStore, face_record, stage_metadata_store
+from shard_registry import shard_dir, register_shard
+from duplicate_groups import DEFAULT_HASH_DISTANCE, DEFAULT_FACE_SIMILARITY, duplicate_groups
 
 # Configuration
 dataset_dir = "../dataset/convocation-2024"
 output_dir = "../embeddings"
 os.makedirs(output_dir, exist_ok=True)
 
-model_name = "ArcFace"
-detector_backend = "mtcnn"
+# Per-event shards (--event / --all-events): one dataset subdirectory per event
+dataset_root = "../dataset"
+
+# Output artifacts
+index_path = os.path.join(output_dir, "faces.index")
+metadata_dir = os.path.join(output_dir, "metadata")
+manifest_path = os.path.join(output_dir, "manifest.json")
+# Optional float32 copy of the vectors for exact re-ranking (--exact-vectors)
+vectors_path = os.path.join(output_dir, EXACT_VECTORS_NAME)
 
-# Image preprocessing settings
-MAX_IMAGE_SIZE = 800  # Maximum dimension (width or height)
+# Superseded by the metadata store; read once to migrate older builds
+filenames_path = os.path.join(output_dir, "filenames.npy")
+metadata_path = os.path.join(output_dir, "face_metadata.npy")
+
+# Full builds stream embeddings here in chunks and resume after an interruption
+checkpoint_dir = os.path.join(output_dir, "build-checkpoint")
+CHECKPOINT_NAME = "checkpoint.json"
+DEFAULT_CHUNK_IMAGES = 500  # Images embedded between checkpoints
+
+# Defaults from FACE_MODEL / FACE_DETECTOR, overridable with --model / --detector
+model_name = MODEL_NAME
+detector_backend = DETECTOR_BACKEND
+
+# Image preprocessing settings (MAX_IMAGE_SIZE lives in utils)
 JPEG_QUALITY = 85     # Quality for temporary processing
 
-def resize_image_for_processing(image_path, max_size=MAX_IMAGE_SIZE):
+# Pipeline settings (only used with --pipeline)
+DEFAULT_WORKERS = os.cpu_count() or 4  # Decode/resize threads
+DEFAULT_BATCH_SIZE = 32                # Face crops per ArcFace forward pass
+
+# Embedding cache (replaced in main() from --cache-dir / --cache-entries)
+DEFAULT_CACHE_ENTRIES = 1024
+embedding_cache = EmbeddingCache(max_entries=DEFAULT_CACHE_ENTRIES)
+
+# Detected faces and aligned crops per image, independent of the embedding
+# model (set in main() from --detection-cache-dir; None disables it)
+DEFAULT_DETECTION_CACHE_DIR = os.path.join(output_dir, "detections")
+detection_cache = None
+
+# SHA-256 of each image of the last embed_images call, by path, so the
+# manifest fingerprints of those images reuse the hash of the cache lookup
+image_hashes = {}
+
+def hash_image(filepath):
+    """Content hash of a dataset image, remembered for its fingerprint"""
+    image_hashes[filepath] = file_content_hash(filepath)
+    return image_hashes[filepath]
+
+def build_cache_key(image_hash):
+    """Embedding cache key for a dataset image under the current build settings"""
+    return EmbeddingCache.make_key(image_hash, "build-faces", model_name, detector_backend, MAX_IMAGE_SIZE)
+
+def detection_cache_key(image_hash):
+    """Detection cache key: the embedding model is deliberately not part of it"""
+    return EmbeddingCache.make_key(image_hash, "detections", detector_backend, MAX_IMAGE_SIZE)
+
+def detect_faces(filepath, image_hash):
     """
-    Resize image for processing without modifying the original file.
-    Returns PIL Image object.
+    Detected faces of an image, from the detection cache or by decoding,
+    resizing and running the detector. Returns (image_shape, faces), with
+    faces as returned by DeepFace.extract_faces, or (None, []) if the image
+    cannot be read.
     """
-    try:
-        # Open image with PIL
-        with Image.open(image_path) as img:
-            # Convert to RGB if necessary (handles RGBA, grayscale, etc.)
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            
-            # Get current dimensions
-            width, height = img.size
-            
-            # Calculate new dimensions while maintaining aspect ratio
-            if width > height:
-                if width > max_size:
-                    new_width = max_size
-                    new_height = int((height * max_size) / width)
-                else:
-                    new_width, new_height = width, height
-            else:
-                if height > max_size:
-                    new_height = max_size
-                    new_width = int((width * max_size) / height)
-                else:
-                    new_width, new_height = width, height
-            
-            # Resize if necessary
-            if new_width != width or new_height != height:
-                img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                print(f"  Resized from {width}x{height} to {new_width}x{new_height}")
-            
-            return img
-            
-    except Exception as e:
-        print(f"  Error resizing image: {e}")
-        return None
-
-def pil_to_cv2(pil_image):
-    """Convert PIL Image to OpenCV format for DeepFace"""
-    # Convert PIL RGB to OpenCV BGR
-    opencv_image = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
-    return opencv_image
+    key = detection_cache_key(image_hash)
+    detected = detection_cache.get(key) if detection_cache else None
+    if detected is not None:
+        print(f"  Detection cache hit: {len(detected[1])} faces")
+        return detected
+
+    # Resize image for processing
+    resized_img = resize_image_for_processing(filepath)
+    if resized_img is None:
+        return None, []
+
+    # Convert PIL to OpenCV format for DeepFace
+    cv2_image = pil_to_cv2(resized_img)
+
+    # Extract all faces from the resized image
+    faces = DeepFace.extract_faces(
+        cv2_image,
+        detector_backend=detector_backend,
+        enforce_detection=False
+    )
+    print(f"  Found {len(faces)} faces")
+
+    if detection_cache:
+        detection_cache.put(key, cv2_image.shape, faces)
+    return cv2_image.shape, faces
+
+def faces_from_cache(filename, rows):
+    """Face data for an image whose faces came from the cache (see utils.face_rows)"""
+    return [dict(
+        face_record(filename, i+1, tuple(float(v) for v in row[:4]), float(row[4])),
+        embedding=row[BOX_COLUMNS:]
+    ) for i, row in enumerate(rows)]
+
+def cache_faces(cache_key, faces_data):
+    """Store an image's detected faces and embeddings in the embedding cache"""
+    embedding_cache.put(cache_key, face_rows(
+        [face['box'] for face in faces_data],
+        [face['confidence'] for face in faces_data],
+        [face['embedding'] for face in faces_data]
+    ))
 
 def process_image_efficiently(filepath, filename):
     """
@@ -190,128 +261,737 @@ def process_image_efficiently(filepath, filename):
     
     try:
         print(f"Processing {filename}...")
-        
-        # Resize image for processing
-        resized_img = resize_image_for_processing(filepath)
-        if resized_img is None:
+
+        # Skip detection and inference for images we have already embedded
+        image_hash = hash_image(filepath)
+        cache_key = build_cache_key(image_hash)
+        cached = embedding_cache.get(cache_key)
+        if cached is not None:
+            print(f"  Cache hit: {len(cached)} faces")
+            return faces_from_cache(filename, cached)
+
+        image_shape, faces = detect_faces(filepath, image_hash)
+        if image_shape is None:
             return faces_data
-        
-        # Convert PIL to OpenCV format for DeepFace
-        cv2_image = pil_to_cv2(resized_img)
-        
-        # Extract all faces from the resized image
-        faces = DeepFace.extract_faces(
-            cv2_image, 
-            detector_backend=detector_backend, 
-            enforce_detection=False
-        )
-        
-        print(f"  Found {len(faces)} faces")
-        
+
+        # One crop per forward pass, so serial builds keep their exact
+        # embeddings; --pipeline batches crops instead
         for i, face in enumerate(faces):
-            face_data = face["face"]
-            
-            # Generate embedding
-            rep = DeepFace.represent(
-                face_data,
-                model_name=model_name,
-                detector_backend="skip",
-                enforce_detection=False
-            )[0]["embedding"]
-            
-            # Normalize embedding
-            emb = np.array(rep).astype("float32")
-            emb = emb / (np.linalg.norm(emb) + 1e-10)
-            
-            # Store face data
-            faces_data.append({
-                'embedding': emb,
-                'filename': f"{filename}_face{i+1}",
-                'face_index': i+1,
-                'original_filename': filename
-            })
-        
-        # Clean up memory
-        del resized_img, cv2_image
+            faces_data.append(dict(
+                face_record(filename, i+1, face_box(face["facial_area"], image_shape),
+                            float(face.get("confidence", 0.0))),
+                embedding=embed_face_crop(face["face"], model_name)
+            ))
+
+        cache_faces(cache_key, faces_data)
         
     except Exception as e:
         print(f"  Error processing {filename}: {e}")
     
     return faces_data
 
-# Initialize storage
-embeddings = []
-filenames = []
-face_metadata = []
+def load_image_for_detection(filepath):
+    """
+    Look an image up in the embedding and detection caches, or decode and
+    resize it into OpenCV format. Returns (image_hash, cached_embeddings,
+    cached_detections, cv2_image), with only the first available of the
+    last three set.
+    Runs on the pipeline's worker threads; hashing, PIL and OpenCV release
+    the GIL, so these overlap with detection.
+    """
+    try:
+        image_hash = hash_image(filepath)
+    except OSError as e:
+        print(f"  Error reading image: {e}")
+        return None, None, None, None
 
-print("=== Building FAISS index with optimized image processing ===")
-print(f"Max image dimension: {MAX_IMAGE_SIZE}px")
+    cached = embedding_cache.get(build_cache_key(image_hash))
+    if cached is not None:
+        return image_hash, cached, None, None
 
-# Process all images
-total_images = len([f for f in os.listdir(dataset_dir) 
-                   if f.lower().endswith((".jpg", ".jpeg", ".png"))])
-processed_images = 0
+    detected = detection_cache.get(detection_cache_key(image_hash)) if detection_cache else None
+    if detected is not None:
+        return image_hash, None, detected, None
 
-for filename in os.listdir(dataset_dir):
-    if not filename.lower().endswith((".jpg", ".jpeg", ".png")):
-        continue
-    
-    processed_images += 1
-    filepath = os.path.join(dataset_dir, filename)
-    
-    print(f"\n[{processed_images}/{total_images}] {filename}")
-    
-    # Process image efficiently
-    faces_data = process_image_efficiently(filepath, filename)
-    
-    # Add to collections
-    for face_data in faces_data:
-        embeddings.append(face_data['embedding'])
-        filenames.append(face_data['filename'])
-        face_metadata.append({
-            'original_filename': face_data['original_filename'],
-            'face_index': face_data['face_index']
-        })
-
-print(f"\n=== Processing Complete ===")
-print(f"Processed {processed_images} images")
-print(f"Found {len(embeddings)} faces total")
-
-if len(embeddings) == 0:
-    print("No faces found! Check your dataset directory and image files.")
-    exit(1)
-
-# Convert to numpy array
-embeddings = np.array(embeddings).astype("float32")
-
-# Debug information
-print(f"\nEmbeddings shape: {embeddings.shape}")
-print(f"First 5 embedding norms: {np.linalg.norm(embeddings[:5], axis=1)}")
-
-# Build FAISS index
-print("\n=== Building FAISS Index ===")
-dim = embeddings.shape[1]
-index = faiss.IndexFlatIP(dim)  # Inner Product (cosine similarity for normalized vectors)
-index.add(embeddings)
-
-# Save index and metadata
-index_path = os.path.join(output_dir, "faces.index")
-filenames_path = os.path.join(output_dir, "filenames.npy")
-metadata_path = os.path.join(output_dir, "face_metadata.npy")
+    resized_img = resize_image_for_processing(filepath)
+    if resized_img is None:
+        return image_hash, None, None, None
+    return image_hash, None, None, pil_to_cv2(resized_img)
 
-faiss.write_index(index, index_path)
-np.save(filenames_path, np.array(filenames))
-np.save(metadata_path, np.array(face_metadata))
-
-print(f"\n=== Index Built Successfully ===")
-print(f"Index saved to: {index_path}")
-print(f"Filenames saved to: {filenames_path}")
-print(f"Metadata saved to: {metadata_path}")
-print(f"Total faces indexed: {len(filenames)}")
-print(f"Average faces per image: {len(filenames)/processed_images:.2f}")
-
-# Verify index
-print(f"\n=== Verification ===")
-print(f"Index dimension: {index.d}")
-print(f"Index size: {index.ntotal}")
-print("Index build complete!")
\ No newline at end of file
+def process_images_pipelined(image_files, workers=DEFAULT_WORKERS, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Process images with a pool of decode/resize workers feeding detection,
+    and embed the detected faces in batches.
+    Faces are returned in the same order as the serial path; their batched
+    embeddings can differ from the serial path's in the last float bits.
+    """
+    faces_data = []
+    # Faces in dataset order; detected ones still carry a 'face' crop to embed,
+    # cache hits already have their 'embedding'
+    pending = []
+
+    def embed(faces):
+        embs = embed_face_crops([face['face'] for face in faces], model_name)
+        for face, emb in zip(faces, embs):
+            face['embedding'] = emb
+
+    def flush_pending():
+        to_embed = [face for face in pending if 'face' in face]
+        by_image = {}
+        for face in to_embed:
+            by_image.setdefault(face['cache_key'], []).append(face)
+        try:
+            if to_embed:
+                embed(to_embed)
+        except Exception as e:
+            # Retry image by image, so one bad crop only loses its own image
+            print(f"  Error embedding batch of {len(to_embed)} faces: {e}; retrying per image")
+            for image_faces in by_image.values():
+                try:
+                    embed(image_faces)
+                except Exception as e:
+                    print(f"  Error embedding {image_faces[0]['original_filename']}: {e}")
+
+        for cache_key, image_faces in by_image.items():
+            for face in image_faces:
+                del face['face'], face['cache_key']
+            if 'embedding' in image_faces[0]:
+                cache_faces(cache_key, image_faces)
+        faces_data.extend(face for face in pending if 'embedding' in face)
+        pending.clear()
+
+    queued = iter(image_files)
+    window = deque()
+
+    def submit_next(pool, count):
+        for filename in itertools.islice(queued, count):
+            window.append((filename, pool.submit(load_image_for_detection, os.path.join(dataset_dir, filename))))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # At most workers * 2 decoded images wait at a time, taken in
+        # submission order so the index layout matches the serial build
+        submit_next(pool, workers * 2)
+        processed = 0
+        while window:
+            filename, future = window.popleft()
+            submit_next(pool, 1)
+            image_hash, cached, detected, cv2_image = future.result()
+            processed += 1
+            print(f"\n[{processed}/{len(image_files)}] {filename}")
+            if cached is not None:
+                print(f"  Cache hit: {len(cached)} faces")
+                pending.extend(faces_from_cache(filename, cached))
+                continue
+
+            if detected is not None:
+                image_shape, faces = detected
+                print(f"  Detection cache hit: {len(faces)} faces")
+            elif cv2_image is not None:
+                try:
+                    faces = DeepFace.extract_faces(
+                        cv2_image,
+                        detector_backend=detector_backend,
+                        enforce_detection=False
+                    )
+                except Exception as e:
+                    print(f"  Error processing {filename}: {e}")
+                    continue
+                image_shape = cv2_image.shape
+                print(f"  Found {len(faces)} faces")
+                if detection_cache:
+                    detection_cache.put(detection_cache_key(image_hash), image_shape, faces)
+            else:
+                continue
+
+            cache_key = build_cache_key(image_hash)
+            if not faces:
+                cache_faces(cache_key, [])
+
+            for i, face in enumerate(faces):
+                pending.append(dict(
+                    face_record(filename, i+1, face_box(face["facial_area"], image_shape),
+                                float(face.get("confidence", 0.0))),
+                    face=face["face"],
+                    cache_key=cache_key
+                ))
+
+            if len(pending) >= batch_size:
+                flush_pending()
+
+    flush_pending()
+    return faces_data
+
+def list_events():
+    """Event names: the subdirectories of the dataset root"""
+    return sorted(d for d in os.listdir(dataset_root)
+                  if os.path.isdir(os.path.join(dataset_root, d)))
+
+def use_event_shard(event):
+    """Point the dataset and output paths at one event's shard"""
+    global dataset_dir, index_path, metadata_dir, manifest_path, vectors_path, filenames_path, metadata_path
+    global checkpoint_dir
+    directory = shard_dir(output_dir, event)
+    os.makedirs(directory, exist_ok=True)
+    dataset_dir = os.path.join(dataset_root, event)
+    index_path = os.path.join(directory, "faces.index")
+    metadata_dir = os.path.join(directory, "metadata")
+    manifest_path = os.path.join(directory, "manifest.json")
+    vectors_path = os.path.join(directory, EXACT_VECTORS_NAME)
+    filenames_path = os.path.join(directory, "filenames.npy")
+    metadata_path = os.path.join(directory, "face_metadata.npy")
+    checkpoint_dir = os.path.join(directory, "build-checkpoint")
+
+def list_dataset_images():
+    """List image files in the dataset directory"""
+    return [f for f in os.listdir(dataset_dir)
+            if f.lower().endswith((".jpg", ".jpeg", ".png"))]
+
+def file_fingerprint(filepath, sha256=None):
+    """
+    Size, mtime and SHA-256 content hash of a dataset file.
+    Used by the manifest to detect new, changed and deleted images.
+    Pass sha256 if the file was just hashed, to skip reading it again.
+    """
+    stat = os.stat(filepath)
+    return {
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'sha256': sha256 or file_content_hash(filepath)
+    }
+
+def embedded_file_fingerprint(filepath):
+    """Fingerprint of an image embedded by the last embed_images call"""
+    return file_fingerprint(filepath, image_hashes.get(filepath))
+
+def embed_images(image_files, args):
+    """Run detection + embedding over a list of dataset images"""
+    image_hashes.clear()
+    if args.pipeline:
+        print(f"Pipeline mode: {args.workers} workers, batch size {args.batch_size}")
+        return process_images_pipelined(image_files, args.workers, args.batch_size)
+
+    all_faces = []
+    for processed_images, filename in enumerate(image_files, start=1):
+        filepath = os.path.join(dataset_dir, filename)
+
+        print(f"\n[{processed_images}/{len(image_files)}] {filename}")
+
+        # Process image efficiently
+        all_faces.extend(process_image_efficiently(filepath, filename))
+    return all_faces
+
+def build_settings():
+    """Everything a checkpoint's embeddings depend on"""
+    return {
+        'dataset_dir': dataset_dir,
+        'model_name': model_name,
+        'detector_backend': detector_backend,
+        'max_image_size': MAX_IMAGE_SIZE
+    }
+
+def load_checkpoint(restart=False):
+    """
+    The checkpoint of an interrupted full build with the same settings, or a
+    new empty one. A checkpoint lists completed chunks; each chunk has a
+    .npy of embeddings and a .json with its face records and the
+    fingerprints of the images it covers.
+    """
+    path = os.path.join(checkpoint_dir, CHECKPOINT_NAME)
+    if os.path.exists(path) and not restart:
+        with open(path) as f:
+            checkpoint = json.load(f)
+        if checkpoint['settings'] == build_settings():
+            return checkpoint
+        print("Checkpoint was written with different settings; starting over")
+
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
+    os.makedirs(checkpoint_dir)
+    checkpoint = {'settings': build_settings(), 'chunks': []}
+    save_checkpoint(checkpoint)
+    return checkpoint
+
+def save_checkpoint(checkpoint):
+    path = os.path.join(checkpoint_dir, CHECKPOINT_NAME)
+    with open(path + ".tmp", "w") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+def write_chunk(checkpoint, chunk_files, faces, phash=False):
+    """
+    Write one chunk's embeddings and records, then add it to the checkpoint.
+    With phash, each image's perceptual hash is kept with its fingerprint.
+    A crash before the checkpoint is saved just leaves files that the
+    resumed build overwrites.
+    """
+    name = f"chunk_{len(checkpoint['chunks']):05d}"
+    chunk = {'embeddings': None, 'records': [], 'files': {}}
+
+    if faces:
+        chunk['embeddings'] = f"{name}.npy"
+        with open(os.path.join(checkpoint_dir, chunk['embeddings']), "wb") as f:
+            np.save(f, np.array([face['embedding'] for face in faces]).astype("float32"))
+    chunk['records'] = [face_record(
+        face['original_filename'], face['face_index'],
+        [float(v) for v in face['box']], float(face['confidence'])
+    ) for face in faces]
+    for filename in chunk_files:
+        chunk['files'][filename] = embedded_file_fingerprint(os.path.join(dataset_dir, filename))
+        if phash:
+            chunk['files'][filename]['phash'] = image_phash(os.path.join(dataset_dir, filename))
+
+    with open(os.path.join(checkpoint_dir, f"{name}.json"), "w") as f:
+        json.dump(chunk, f)
+    checkpoint['chunks'].append(name)
+    save_checkpoint(checkpoint)
+
+def load_manifest():
+    """Load the processed-files manifest, or an empty one"""
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+def save_artifacts(index, records, manifest, vectors=None):
+    """
+    Write the index, metadata store and manifest, plus the float32 vectors
+    by face id if given (a list of chunks); otherwise any older vectors file
+    is removed, as it would no longer match the index.
+    """
+    staged = [(index_path + ".tmp", index_path), (manifest_path + ".tmp", manifest_path)]
+
+    faiss.write_index(index, index_path + ".tmp")
+    if vectors is not None:
+        write_exact_vectors(vectors_path + ".tmp.npy", vectors)
+        staged.append((vectors_path + ".tmp.npy", vectors_path))
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    # The store's meta.json is renamed after its columns: the API only trusts a complete store
+    build_info = {'model': model_name, 'detector': detector_backend}
+    duplicates = {}
+    for filename, entry in manifest.items():
+        if entry.get('duplicate_of'):
+            duplicates.setdefault(entry['duplicate_of'], []).append(filename)
+    staged[1:1] = stage_metadata_store(metadata_dir, records, build_info, duplicates)
+
+    # Rename into place only once everything is written, so a running API
+    # hot-reloading the index never reads a partially written file
+    for tmp_path, path in staged:
+        os.replace(tmp_path, path)
+    if vectors is None and os.path.exists(vectors_path):
+        os.remove(vectors_path)
+
+    # The pickled arrays of older builds would now be stale
+    for legacy_path in (filenames_path, metadata_path):
+        if os.path.exists(legacy_path):
+            os.remove(legacy_path)
+
+def load_metadata_records():
+    """
+    Face records of the existing build, migrating filenames.npy if needed.
+    Exits if the build used another embedding model: its vectors would not
+    be comparable with new ones.
+    """
+    if os.path.exists(os.path.join(metadata_dir, "meta.json")):
+        store = FaceMetadataStore.open(metadata_dir)
+        built_with = store.build_info.get('model', model_name)
+        if built_with != model_name:
+            print(f"Existing index was built with {built_with}, not {model_name}. Run a full build.")
+            exit(1)
+        if store.build_info.get('detector', detector_backend) != detector_backend:
+            print(f"Warning: existing index was built with the {store.build_info['detector']} detector; "
+                  f"new images will use {detector_backend}")
+        return store.records()
+    print("Migrating filenames.npy to the metadata store...")
+    return FaceMetadataStore.from_legacy(filenames_path).records()
+
+def load_id_mapped_index():
+    """
+    Load the existing index so vectors can be added and removed by id.
+    Flat indexes from full builds are plain IndexFlatIP with implicit ids
+    0..n-1 and are converted once here to an IndexIDMap2. IVF indexes hold
+    the ids in their lists; ones written inside an IndexIDMap2 by earlier
+    builds are unwrapped (see index_factory.create_index). The other
+    approximate types are already written as IndexIDMap2.
+    """
+    index = faiss.read_index(index_path)
+    if isinstance(index, faiss.IndexIVF):
+        return index
+    if isinstance(index, faiss.IndexIDMap2):
+        if not isinstance(unwrap_index(index), faiss.IndexIVF):
+            return index
+        print("Moving face ids into the IVF index...")
+        try:
+            return unwrap_id_mapped_ivf(index)
+        except ValueError as e:
+            print(f"{e}. Run a full build.")
+            exit(1)
+
+    print("Converting existing index to an ID-mapped index...")
+    vectors = index.reconstruct_n(0, index.ntotal)
+    id_index = faiss.IndexIDMap2(faiss.IndexFlatIP(index.d))
+    id_index.add_with_ids(vectors, np.arange(index.ntotal, dtype="int64"))
+    return id_index
+
+def collapse_duplicates(records, manifest, chunks, args):
+    """
+    Keep one photo of each group of near-duplicates (see duplicate_groups.py),
+    the one whose faces the detector is most confident about. The others stay
+    in the manifest, marked duplicate_of, but their faces are dropped from the
+    records and embeddings, and face ids are renumbered. Chunks that lose
+    faces are rewritten one at a time to new memory-mapped files in the
+    checkpoint directory, so the embeddings are never all in memory.
+    Returns the new (records, chunks).
+    """
+    print("\n=== Collapsing near-duplicate photos ===")
+    images = sorted(filename for filename, entry in manifest.items() if entry['face_ids'])
+    for filename in images:
+        # Chunks written without --collapse-duplicates have no hash yet
+        if 'phash' not in manifest[filename]:
+            manifest[filename]['phash'] = image_phash(os.path.join(dataset_dir, filename))
+    images = [filename for filename in images if manifest[filename]['phash']]
+
+    offsets = np.cumsum([0] + [len(chunk) for chunk in chunks])
+
+    def face_embeddings(position):
+        face_ids = np.array(manifest[images[position]]['face_ids'])
+        chunk_nos = np.searchsorted(offsets, face_ids, side="right") - 1
+        return np.array([chunks[c][face_id - offsets[c]] for c, face_id in zip(chunk_nos, face_ids)])
+
+    groups = duplicate_groups([manifest[filename]['phash'] for filename in images], face_embeddings,
+                              args.duplicate_hash_distance, args.duplicate_similarity)
+    dropped = []
+    for group in groups:
+        filenames = [images[position] for position in group]
+        representative = max(filenames, key=lambda filename: sum(
+            records[face_id]['confidence'] for face_id in manifest[filename]['face_ids']))
+        for filename in filenames:
+            if filename != representative:
+                dropped.extend(manifest[filename]['face_ids'])
+                manifest[filename].update(face_ids=[], duplicate_of=representative)
+
+    print(f"{len(groups)} groups of near-duplicates; {sum(len(g) - 1 for g in groups)} photos "
+          f"and {len(dropped)} faces collapsed")
+    if not dropped:
+        return records, chunks
+
+    keep = np.ones(len(records), dtype=bool)
+    keep[dropped] = False
+    new_ids = np.cumsum(keep) - 1
+    for entry in manifest.values():
+        entry['face_ids'] = [int(new_ids[face_id]) for face_id in entry['face_ids']]
+    records = [record for record, kept in zip(records, keep) if kept]
+    collapsed = []
+    for c, chunk in enumerate(chunks):
+        kept = np.flatnonzero(keep[offsets[c]:offsets[c + 1]])
+        if len(kept) == len(chunk):
+            collapsed.append(chunk)
+        elif len(kept):
+            # Only the kept rows are read; a resumed build overwrites the file
+            path = os.path.join(checkpoint_dir, f"collapsed_{c:05d}.npy")
+            with open(path, "wb") as f:
+                np.save(f, np.asarray(chunk[kept], dtype="float32"))
+            collapsed.append(np.load(path, mmap_mode="r"))
+    return records, collapsed
+
+def build_full_index(args):
+    """
+    Embed the whole dataset and write fresh artifacts.
+    Embeddings are streamed to checkpointed chunks of --chunk-images images,
+    so an interrupted build resumes where it stopped and memory does not
+    grow with the dataset; the index is then assembled chunk by chunk.
+    """
+    print("=== Building FAISS index with optimized image processing ===")
+    print(f"Max image dimension: {MAX_IMAGE_SIZE}px")
+
+    checkpoint = load_checkpoint(restart=args.restart)
+    done_files = set()
+    for name in checkpoint['chunks']:
+        with open(os.path.join(checkpoint_dir, f"{name}.json")) as f:
+            done_files.update(json.load(f)['files'])
+
+    # Process the images not covered by the checkpoint
+    image_files = list_dataset_images()
+    remaining = [filename for filename in image_files if filename not in done_files]
+    if done_files:
+        print(f"Resuming from checkpoint: {len(checkpoint['chunks'])} chunks, "
+              f"{len(done_files)} images done, {len(remaining)} to go")
+
+    for start in range(0, len(remaining), args.chunk_images):
+        chunk_files = remaining[start:start + args.chunk_images]
+        write_chunk(checkpoint, chunk_files, embed_images(chunk_files, args), phash=args.collapse_duplicates)
+        print(f"\nCheckpoint: {len(done_files) + start + len(chunk_files)}/{len(done_files) + len(remaining)} images")
+
+    # Assemble records, manifest and the chunk list; ids follow chunk order
+    records = []
+    manifest = {}
+    chunks = []
+    for name in checkpoint['chunks']:
+        with open(os.path.join(checkpoint_dir, f"{name}.json")) as f:
+            chunk = json.load(f)
+        for filename, fingerprint in chunk['files'].items():
+            manifest[filename] = dict(fingerprint, face_ids=[])
+        for record in chunk['records']:
+            manifest[record['original_filename']]['face_ids'].append(len(records))
+            records.append(face_record(
+                record['original_filename'], record['face_index'],
+                tuple(record['box']), record['confidence']
+            ))
+        if chunk['embeddings']:
+            chunks.append(np.load(os.path.join(checkpoint_dir, chunk['embeddings']), mmap_mode="r"))
+
+    if args.collapse_duplicates:
+        records, chunks = collapse_duplicates(records, manifest, chunks, args)
+
+    processed_images = len(manifest)
+    print(f"\n=== Processing Complete ===")
+    print(f"Processed {processed_images} images")
+    print(f"Found {len(records)} faces total")
+
+    if len(records) == 0:
+        print("No faces found! Check your dataset directory and image files.")
+        exit(1)
+
+    # Debug information
+    print(f"\nEmbeddings shape: ({len(records)}, {chunks[0].shape[1]}) in {len(chunks)} chunks")
+    print(f"First 5 embedding norms: {np.linalg.norm(chunks[0][:5], axis=1)}")
+
+    # Build FAISS index (inner product = cosine similarity for normalized vectors)
+    print(f"\n=== Building FAISS Index ({args.index_type}) ===")
+    index = create_index_from_chunks(
+        chunks,
+        index_type=args.index_type,
+        nlist=args.nlist,
+        pq_m=args.pq_m,
+        hnsw_m=args.hnsw_m,
+        train_size=args.train_size
+    )
+
+    # Save index and metadata
+    save_artifacts(index, records, manifest, vectors=chunks if args.exact_vectors else None)
+    del chunks
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
+
+    print(f"\n=== Index Built Successfully ===")
+    print(f"Index saved to: {index_path}")
+    print(f"Metadata saved to: {metadata_dir}")
+    print(f"Manifest saved to: {manifest_path}")
+    print(f"Total faces indexed: {len(records)}")
+    print(f"Average faces per image: {len(records)/processed_images:.2f}")
+
+    # Verify index
+    print(f"\n=== Verification ===")
+    print(f"Index type: {describe_index(index)}")
+    print(f"Index dimension: {index.d}")
+    print(f"Index size: {index.ntotal}")
+    print("Index build complete!")
+    return index, manifest
+
+def update_index_incrementally(args):
+    """
+    Embed only new or changed images and drop vectors of deleted ones.
+    Face ids are row positions in the metadata store; removed faces are
+    kept as empty rows so existing ids stay valid for the API.
+    """
+    print("=== Updating FAISS index incrementally ===")
+
+    manifest = load_manifest()
+    if not manifest or not os.path.exists(index_path):
+        print("No existing index/manifest found. Run a full build first.")
+        exit(1)
+
+    index = load_id_mapped_index()
+    records = load_metadata_records()
+
+    # Classify dataset files against the manifest
+    image_files = list_dataset_images()
+    new_files, changed_files = [], []
+    fingerprints = {}
+    for filename in image_files:
+        filepath = os.path.join(dataset_dir, filename)
+        entry = manifest.get(filename)
+        if entry is None:
+            new_files.append(filename)
+            continue
+
+        stat = os.stat(filepath)
+        if stat.st_size == entry['size'] and stat.st_mtime == entry['mtime']:
+            continue
+
+        # Size/mtime differ: only re-embed if the content actually changed
+        fingerprints[filename] = file_fingerprint(filepath)
+        if fingerprints[filename]['sha256'] == entry['sha256']:
+            entry.update(size=fingerprints[filename]['size'], mtime=fingerprints[filename]['mtime'])
+        else:
+            changed_files.append(filename)
+
+    present = set(image_files)
+    deleted_files = [f for f in manifest if f not in present]
+
+    # Photos collapsed into a deleted or changed photo are embedded on their own again
+    replaced = set(deleted_files) | set(changed_files)
+    orphaned = [f for f in image_files
+                if manifest.get(f, {}).get('duplicate_of') in replaced and f not in changed_files]
+    new_files.extend(orphaned)
+
+    print(f"New images: {len(new_files)}")
+    print(f"Changed images: {len(changed_files)}")
+    print(f"Deleted images: {len(deleted_files)}")
+    if orphaned:
+        print(f"Near-duplicates to re-embed: {len(orphaned)}")
+
+    # Remove vectors of deleted and changed images
+    stale_ids = []
+    for filename in deleted_files + changed_files:
+        stale_ids.extend(manifest[filename]['face_ids'])
+    for filename in deleted_files:
+        del manifest[filename]
+
+    if stale_ids:
+        try:
+            removed = index.remove_ids(np.array(stale_ids, dtype="int64"))
+        except RuntimeError as e:
+            # HNSW graphs cannot drop vectors in place
+            print(f"{describe_index(index)} does not support removing vectors: {e}")
+            print("Run a full build to pick up changed or deleted images.")
+            exit(1)
+        for face_id in stale_ids:
+            records[face_id] = None
+        print(f"Removed {removed} stale face vectors")
+
+    # Embed new and changed images, appending ids after the existing ones
+    to_embed = new_files + changed_files
+    all_faces = embed_images(to_embed, args) if to_embed else []
+
+    face_ids = {filename: [] for filename in to_embed}
+    first_new_id = len(records)
+    new_embeddings = []
+    for face_data in all_faces:
+        face_ids[face_data['original_filename']].append(len(records))
+        new_embeddings.append(face_data['embedding'])
+        records.append(face_record(
+            face_data['original_filename'], face_data['face_index'],
+            face_data['box'], face_data['confidence']
+        ))
+
+    if new_embeddings:
+        ids = np.arange(first_new_id, len(records), dtype="int64")
+        index.add_with_ids(np.array(new_embeddings).astype("float32"), ids)
+
+    # Keep the exact vectors in step with the face ids; removed faces keep their rows
+    vectors = None
+    if os.path.exists(vectors_path):
+        vectors = [np.load(vectors_path, mmap_mode="r")]
+        if new_embeddings:
+            vectors.append(np.array(new_embeddings).astype("float32"))
+    elif args.exact_vectors:
+        print("No vectors file from the full build to extend; run a full build with --exact-vectors")
+
+    for filename in to_embed:
+        entry = fingerprints.get(filename) or embedded_file_fingerprint(os.path.join(dataset_dir, filename))
+        entry['face_ids'] = face_ids[filename]
+        manifest[filename] = entry
+
+    save_artifacts(index, records, manifest, vectors)
+
+    print(f"\n=== Index Updated Successfully ===")
+    print(f"Added {len(new_embeddings)} faces from {len(to_embed)} images")
+    print(f"Index size: {index.ntotal}")
+    return index, manifest
+
+def build_event_shard(event, args):
+    """Build (or update) one event's shard and register it for the API"""
+    print(f"\n##### Event: {event} #####")
+    use_event_shard(event)
+    if not os.path.isdir(dataset_dir):
+        print(f"Dataset directory not found: {dataset_dir}")
+        exit(1)
+
+    # A new event has nothing to update yet
+    if args.incremental and os.path.exists(index_path):
+        index, manifest = update_index_incrementally(args)
+    else:
+        index, manifest = build_full_index(args)
+
+    register_shard(output_dir, event, dataset_dir, describe_index(index), int(index.ntotal), len(manifest))
+    print(f"Registered shard {event} in {os.path.join(output_dir, 'shards.json')}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build the FAISS face index")
+    parser.add_argument("--model", default=MODEL_NAME,
+                        help="DeepFace recognition model (default: FACE_MODEL or ArcFace)")
+    parser.add_argument("--detector", choices=DETECTOR_BACKENDS, default=DETECTOR_BACKEND,
+                        help="DeepFace face detector (default: FACE_DETECTOR or mtcnn)")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="Use parallel decode workers and batched embedding")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="Number of decode/resize workers (pipeline mode)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Face crops per embedding batch (pipeline mode)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only embed new/changed images and drop deleted ones")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="flat",
+                        help="FAISS index type for full builds")
+    parser.add_argument("--nlist", type=int, default=None,
+                        help="IVF inverted lists (default: about 4*sqrt(faces))")
+    parser.add_argument("--pq-m", type=int, default=DEFAULT_PQ_M,
+                        help="IVF-PQ sub-quantizers (must divide the embedding dimension)")
+    parser.add_argument("--hnsw-m", type=int, default=DEFAULT_HNSW_M,
+                        help="HNSW neighbours per node")
+    parser.add_argument("--train-size", type=int, default=DEFAULT_TRAIN_SIZE,
+                        help="Embeddings sampled to train IVF/PQ indexes")
+    parser.add_argument("--exact-vectors", action="store_true",
+                        help="Also keep float32 vectors in vectors.npy so the API can re-rank "
+                             f"candidates of a quantized index ({', '.join(QUANTIZED_TYPES)}) exactly")
+    parser.add_argument("--chunk-images", type=int, default=DEFAULT_CHUNK_IMAGES,
+                        help="Images embedded between checkpoints (full builds)")
+    parser.add_argument("--restart", action="store_true",
+                        help="Discard the checkpoint of an interrupted full build")
+    parser.add_argument("--collapse-duplicates", action="store_true",
+                        help="Index one photo per group of near-duplicates (full builds)")
+    parser.add_argument("--duplicate-hash-distance", type=int, default=DEFAULT_HASH_DISTANCE,
+                        help="Maximum perceptual hash distance (bits of 64) between near-duplicates")
+    parser.add_argument("--duplicate-similarity", type=float, default=DEFAULT_FACE_SIMILARITY,
+                        help="Minimum similarity of every face pair between near-duplicates")
+    parser.add_argument("--event", action="append", default=None,
+                        help="Build the shard for this event (dataset subdirectory); repeatable")
+    parser.add_argument("--all-events", action="store_true",
+                        help="Build a shard for every subdirectory of the dataset root")
+    parser.add_argument("--cache-dir", default=None,
+                        help="On-disk embedding cache shared across runs (default: memory only)")
+    parser.add_argument("--cache-entries", type=int, default=DEFAULT_CACHE_ENTRIES,
+                        help="In-memory embedding cache size (images)")
+    parser.add_argument("--cache-max-mb", type=int, default=None,
+                        help="Cap on the on-disk embedding cache (default: unbounded)")
+    parser.add_argument("--detection-cache-dir", default=DEFAULT_DETECTION_CACHE_DIR,
+                        help="On-disk store of detected faces and aligned crops, reused across models")
+    parser.add_argument("--no-detection-cache", action="store_true",
+                        help="Always run the face detector")
+    return parser.parse_args()
+
+def main():
+    global embedding_cache, detection_cache, model_name, detector_backend
+    args = parse_args()
+    model_name, detector_backend = args.model, args.detector
+    print(f"Model: {model_name}, detector: {detector_backend}")
+    embedding_cache = EmbeddingCache(
+        max_entries=args.cache_entries, disk_dir=args.cache_dir,
+        max_disk_bytes=args.cache_max_mb * 1024 * 1024 if args.cache_max_mb else None
+    )
+    if not args.no_detection_cache:
+        detection_cache = DetectionCache(args.detection_cache_dir)
+
+    events = list_events() if args.all_events else args.event
+    if events:
+        for event in events:
+            build_event_shard(event, args)
+    elif args.incremental:
+        update_index_incrementally(args)
+    else:
+        build_full_index(args)
+
+    print(f"Embedding cache: {embedding_cache.stats()}")
+    if detection_cache:
+        print(f"Detection cache: {detection_cache.stats()}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Offline person clustering over the indexed faces.
+
+Builds a k-NN graph over every stored embedding with the shard's own index
+(each face is a query), keeps the edges at or above --threshold cosine
+similarity and takes the connected components as identities. The cluster
+id of every face is written into the shard's metadata store (see
+metadata_store.write_clusters); /search?gallery=1 then returns a query's
+whole cluster with one lookup.
+
+Connected components chain through look-alikes and bad crops, so clusters
+larger than --max-cluster-size are left unclustered rather than served as
+one person's gallery. Singletons are not clustered either.
+
+Usage (from flask-api/src), after build_index.py:
+    python cluster_faces.py --threshold 0.5
+    python cluster_faces.py --event convocation-2024 --k 30
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import faiss
+
+from index_factory import DEFAULT_NPROBE, DEFAULT_EF_SEARCH, read_index, search_parameters, stored_ids, unwrap_index
+from metadata_store import FaceMetadataStore, write_clusters
+from shard_registry import load_registry
+
+embeddings_dir = "../embeddings"
+dataset_dir = "../dataset/convocation-2024"  # Single index from before per-event shards
+
+DEFAULT_K = 20
+DEFAULT_THRESHOLD = 0.5
+DEFAULT_MAX_CLUSTER_SIZE = 2000
+DEFAULT_BATCH_SIZE = 4096
+
+def list_shards(events=None):
+    """(event, index path, metadata dir) of the shards to cluster"""
+    registry = load_registry(embeddings_dir)
+    if registry is None:
+        registry = {os.path.basename(dataset_dir): {
+            "index": os.path.join(embeddings_dir, "faces.index"),
+            "metadata": os.path.join(embeddings_dir, "metadata")
+        }}
+    unknown = [event for event in events or () if event not in registry]
+    if unknown:
+        sys.exit(f"Unknown events: {', '.join(unknown)} (indexed: {', '.join(registry)})")
+    return [(event, entry["index"], entry["metadata"])
+            for event, entry in registry.items() if not events or event in events]
+
+def stored_vectors(index, ids, start, count):
+    """
+    Face ids and vectors of stored entries start..start+count, in storage
+    order; ids is index_factory.stored_ids(index). PQ indexes return their
+    (approximate) reconstructions.
+    """
+    ids = ids[start:start + count]
+    if isinstance(index, faiss.IndexIVF):
+        # Ids live in the inverted lists: look vectors up by id (see knn_edges)
+        return ids, index.reconstruct_batch(ids)
+    return ids, unwrap_index(index).reconstruct_n(start, count)
+
+def knn_edges(index, k, threshold, nprobe, ef_search, batch_size):
+    """(u, v) face id pairs with similarity >= threshold among each face's k neighbours"""
+    params = search_parameters(index, nprobe=nprobe, ef_search=ef_search)
+    all_ids = stored_ids(index)
+    if isinstance(index, faiss.IndexIVF):
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)
+    sources, targets = [], []
+    for start in range(0, index.ntotal, batch_size):
+        ids, vectors = stored_vectors(index, all_ids, start, min(batch_size, index.ntotal - start))
+        # k + 1: each face finds itself first
+        D, I = index.search(vectors, min(k + 1, index.ntotal), params=params)
+        keep = (D >= threshold) & (I >= 0) & (I != ids[:, None])
+        sources.append(np.broadcast_to(ids[:, None], I.shape)[keep])
+        targets.append(I[keep])
+        print(f"  [{start + len(ids)}/{index.ntotal}] {sum(len(s) for s in sources)} edges")
+    if not sources:
+        return np.zeros(0, dtype="int64"), np.zeros(0, dtype="int64")
+    return np.concatenate(sources), np.concatenate(targets)
+
+def connected_components(n, u, v):
+    """Component label per node (the smallest node id in it), by hooking and pointer jumping"""
+    labels = np.arange(n, dtype="int64")
+    while True:
+        before = labels.copy()
+        lu, lv = labels[u], labels[v]
+        smaller = np.minimum(lu, lv)
+        # Hook each root onto the smaller root across its edges
+        np.minimum.at(labels, lu, smaller)
+        np.minimum.at(labels, lv, smaller)
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+        if np.array_equal(labels, before):
+            return labels
+
+def cluster_ids_from_components(labels, valid, max_cluster_size):
+    """
+    Cluster id per face, numbered by descending size; -1 for removed faces,
+    singletons and components over max_cluster_size.
+    """
+    cluster_ids = np.full(len(labels), -1, dtype="int32")
+    roots, inverse, sizes = np.unique(labels[valid], return_inverse=True, return_counts=True)
+    usable = (sizes >= 2) & (sizes <= max_cluster_size)
+    order = np.argsort(-sizes[usable], kind="stable")
+    new_ids = np.full(len(roots), -1, dtype="int32")
+    new_ids[np.flatnonzero(usable)[order]] = np.arange(len(order), dtype="int32")
+    cluster_ids[valid] = new_ids[inverse]
+    return cluster_ids, sizes, usable
+
+def cluster_shard(event, index_path, metadata_dir, args):
+    print(f"=== Clustering {event} ===")
+    start = time.time()
+    index = read_index(index_path, mmap=True)
+    metadata = FaceMetadataStore.open(metadata_dir)
+    valid = np.asarray(metadata.image_ids) >= 0
+
+    u, v = knn_edges(index, args.k, args.threshold, args.nprobe, args.ef_search, args.batch_size)
+    labels = connected_components(len(metadata), u, v)
+    cluster_ids, sizes, usable = cluster_ids_from_components(labels, valid, args.max_cluster_size)
+
+    info = {
+        "threshold": args.threshold,
+        "k": args.k,
+        "max_cluster_size": args.max_cluster_size,
+        "oversized_components": int(((sizes > args.max_cluster_size)).sum()),
+        "largest_cluster": int(sizes[usable].max()) if usable.any() else 0,
+        "built_at": time.time()
+    }
+    write_clusters(metadata_dir, cluster_ids, info)
+    print(f"  {int(usable.sum())} clusters covering {int((cluster_ids >= 0).sum())} of {int(valid.sum())} faces, "
+          f"largest {info['largest_cluster']}, {info['oversized_components']} oversized "
+          f"({time.time() - start:.1f}s)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Cluster indexed faces into people")
+    parser.add_argument("--event", action="append", default=None,
+                        help="Cluster this event's shard (repeatable; default all)")
+    parser.add_argument("--k", type=int, default=DEFAULT_K, help="Neighbours per face in the k-NN graph")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Minimum cosine similarity for an edge")
+    parser.add_argument("--max-cluster-size", type=int, default=DEFAULT_MAX_CLUSTER_SIZE,
+                        help="Larger components are left unclustered")
+    parser.add_argument("--nprobe", type=int, default=DEFAULT_NPROBE, help="IVF lists to scan")
+    parser.add_argument("--ef-search", type=int, default=DEFAULT_EF_SEARCH, help="HNSW search depth")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Faces searched at a time")
+    args = parser.parse_args()
+
+    for event, index_path, metadata_dir in list_shards(args.event):
+        cluster_shard(event, index_path, metadata_dir, args)
+
+if __name__ == "__main__":
+    main()
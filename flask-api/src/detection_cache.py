@@ -0,0 +1,121 @@
+"""
+On-disk store of face detections per image.
+
+Face detection (MTCNN on CPU) is the most expensive stage of a build. Each
+image's detected boxes, landmarks, confidences and aligned crops are kept,
+keyed by image content hash and detector settings, so re-embedding the
+dataset after switching or upgrading the recognition model only runs the
+embedding model.
+
+One .npz per image, stored under key[:2]/key.npz. Crops are kept as uint8:
+DeepFace produces them by dividing 8-bit pixels by 255, so the round trip
+is exact at a quarter of the float32 size.
+"""
+import os
+import threading
+import numpy as np
+
+# facial_area keys besides x, y, w, h; detectors fill in some or all of them
+LANDMARKS = ("left_eye", "right_eye", "nose", "mouth_left", "mouth_right")
+
+def _pack(image_shape, faces):
+    """Arrays for one image's DeepFace.extract_faces results"""
+    n_faces = len(faces)
+    areas = np.zeros((n_faces, 4), dtype="int32")
+    landmarks = np.full((n_faces, len(LANDMARKS), 2), np.nan, dtype="float32")
+    confidences = np.zeros(n_faces, dtype="float32")
+    crop_shapes = np.zeros((n_faces, 3), dtype="int32")
+    crops = []
+
+    for i, face in enumerate(faces):
+        area = face["facial_area"]
+        areas[i] = [area["x"], area["y"], area["w"], area["h"]]
+        for j, name in enumerate(LANDMARKS):
+            if area.get(name) is not None:
+                landmarks[i, j] = area[name]
+        confidences[i] = face.get("confidence", 0.0)
+        crop = np.round(np.asarray(face["face"]) * 255).clip(0, 255).astype("uint8")
+        crop_shapes[i] = crop.shape
+        crops.append(crop.ravel())
+
+    return {
+        "image_shape": np.asarray(image_shape[:3], dtype="int32"),
+        "areas": areas,
+        "landmarks": landmarks,
+        "confidences": confidences,
+        "crop_shapes": crop_shapes,
+        "crops": np.concatenate(crops) if crops else np.zeros(0, dtype="uint8")
+    }
+
+def _unpack(arrays):
+    """(image_shape, faces) with faces shaped like DeepFace.extract_faces output"""
+    faces = []
+    offset = 0
+    for i, shape in enumerate(arrays["crop_shapes"]):
+        size = int(np.prod(shape))
+        crop = arrays["crops"][offset:offset + size].reshape(shape).astype("float32") / 255
+        offset += size
+
+        x, y, w, h = (int(v) for v in arrays["areas"][i])
+        facial_area = {"x": x, "y": y, "w": w, "h": h}
+        for j, name in enumerate(LANDMARKS):
+            point = arrays["landmarks"][i, j]
+            if not np.isnan(point).any():
+                facial_area[name] = (int(point[0]), int(point[1]))
+
+        faces.append({
+            "face": crop,
+            "facial_area": facial_area,
+            "confidence": float(arrays["confidences"][i])
+        })
+    return tuple(int(v) for v in arrays["image_shape"]), faces
+
+class DetectionCache:
+    """Maps a cache key to one image's detected faces. Thread-safe"""
+
+    def __init__(self, disk_dir):
+        self.disk_dir = disk_dir
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(disk_dir, exist_ok=True)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], f"{key}.npz")
+
+    def get(self, key):
+        """(image_shape, faces) for key, or None"""
+        path = self._disk_path(key)
+        detected = None
+        if os.path.exists(path):
+            try:
+                with np.load(path) as arrays:
+                    detected = _unpack(arrays)
+            except (OSError, ValueError, KeyError):
+                detected = None
+
+        with self._lock:
+            if detected is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return detected
+
+    def put(self, key, image_shape, faces):
+        """Store the faces detected in an image of the given (resized) shape"""
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **_pack(image_shape, faces))
+        os.replace(tmp_path, path)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "disk_store": self.disk_dir,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
@@ -0,0 +1,61 @@
+"""
+Near-duplicate photo grouping for full builds (build_index.py --collapse-duplicates).
+
+Burst shots of the same moment put near-identical face vectors in the index
+and fill a search's top-k with copies of one photo. Two photos are near
+duplicates when their perceptual hashes (utils.image_phash) are within
+max_distance bits and their faces pair up one-to-one with embedding
+similarity >= min_similarity; groups are the connected components of that
+relation. The hash comparison is a FAISS binary range search, so only
+candidate pairs have their faces compared.
+"""
+import numpy as np
+import faiss
+
+from cluster_faces import connected_components
+
+DEFAULT_HASH_DISTANCE = 10    # Of 64 bits
+DEFAULT_FACE_SIMILARITY = 0.9
+
+def hash_pairs(phashes, max_distance, batch_size=65536):
+    """(i, j) index pairs, i < j, of hex hashes within max_distance bits"""
+    codes = np.array([np.frombuffer(bytes.fromhex(h), dtype="uint8") for h in phashes],
+                     dtype="uint8").reshape(-1, 8)
+    index = faiss.IndexBinaryFlat(64)
+    index.add(codes)
+    pairs = []
+    for start in range(0, len(codes), batch_size):
+        # Radius is exclusive
+        lims, _, I = index.range_search(codes[start:start + batch_size], max_distance + 1)
+        sources = start + np.repeat(np.arange(len(lims) - 1), np.diff(lims).astype("int64"))
+        keep = sources < I
+        pairs.append(np.stack([sources[keep], I[keep]], axis=1))
+    return np.concatenate(pairs) if pairs else np.zeros((0, 2), dtype="int64")
+
+def same_faces(a, b, min_similarity):
+    """Whether two photos' face embeddings pair up one-to-one above min_similarity"""
+    if len(a) != len(b) or not len(a):
+        return False
+    similarity = a @ b.T
+    best = similarity.argmax(axis=1)
+    return len(set(best.tolist())) == len(a) and bool((similarity.max(axis=1) >= min_similarity).all())
+
+def duplicate_groups(phashes, face_embeddings, max_distance=DEFAULT_HASH_DISTANCE,
+                     min_similarity=DEFAULT_FACE_SIMILARITY):
+    """
+    Groups (lists of image positions, two or more, in order) of near-duplicate
+    photos. phashes has one hex hash per image; face_embeddings(i) returns
+    image i's normalized face embeddings.
+    """
+    candidates = hash_pairs(phashes, max_distance)
+    verified = [(i, j) for i, j in candidates
+                if same_faces(face_embeddings(i), face_embeddings(j), min_similarity)]
+    if not verified:
+        return []
+    u, v = np.array(verified, dtype="int64").T
+    labels = connected_components(len(phashes), u, v)
+
+    groups = {}
+    for position in np.unique(np.concatenate([u, v])):
+        groups.setdefault(int(labels[position]), []).append(int(position))
+    return sorted(groups.values())
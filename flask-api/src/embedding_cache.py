@@ -0,0 +1,184 @@
+"""
+Embedding cache keyed by image content hash.
+
+Repeated images (the same official portrait uploaded by many parents, or a
+photo that is already indexed) skip face detection and ArcFace inference.
+Entries live in an in-process LRU bounded by entry count, optionally backed
+by an on-disk store of .npy files shared across processes and restarts.
+The on-disk store can be capped like the thumbnail cache: past max_disk_bytes
+the least recently used files (by mtime, refreshed on every hit) are deleted
+until it is back under 90% of the cap. Disk errors never fail a lookup or a
+store; the entry is then only kept in memory.
+"""
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+def content_hash(data):
+    """SHA-256 hex digest of raw image bytes"""
+    return hashlib.sha256(data).hexdigest()
+
+def file_content_hash(filepath):
+    """SHA-256 hex digest of a file, read in chunks"""
+    sha256 = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+class EmbeddingCache:
+    """
+    Maps a cache key to one float32 array of an image's faces. The builder and
+    the API store utils.face_rows: one row per face, its box and detector
+    confidence (the first BOX_COLUMNS values) followed by its embedding.
+    Thread-safe; an image with no faces is cached as a (0, BOX_COLUMNS) array.
+    """
+
+    def __init__(self, max_entries=1024, disk_dir=None, max_disk_bytes=None):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes  # None = unbounded
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes = None  # Approximate store size, measured on first write
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.disk_errors = 0
+        self.evictions = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(image_hash, *settings):
+        """
+        Combine the image hash with everything that changes the embeddings
+        (pipeline name, model, detector, resize limit).
+        """
+        return hashlib.sha256("|".join([image_hash, *map(str, settings)]).encode()).hexdigest()
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], f"{key}.npy")
+
+    def get(self, key):
+        """Cached embeddings for key, or None"""
+        with self._lock:
+            embeddings = self._entries.get(key)
+            if embeddings is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return embeddings
+
+        if self.disk_dir:
+            path = self._disk_path(key)
+            if os.path.exists(path):
+                try:
+                    embeddings = np.load(path)
+                    os.utime(path)  # Mark as recently used
+                except (OSError, ValueError):
+                    embeddings = None
+                if embeddings is not None:
+                    self._remember(key, embeddings)
+                    with self._lock:
+                        self.disk_hits += 1
+                    return embeddings
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, embeddings):
+        """Store embeddings in memory and, if configured, on disk"""
+        embeddings = np.asarray(embeddings, dtype="float32")
+        self._remember(key, embeddings)
+        if not self.disk_dir:
+            return
+
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                np.save(f, embeddings)
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except OSError as e:
+            # Full disk, permissions, read-only volume: the search itself still succeeded
+            print(f"  Embedding cache write failed ({e}); keeping the entry in memory only")
+            with self._lock:
+                self.disk_errors += 1
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+
+        if self.max_disk_bytes is not None:
+            with self._lock:
+                if self._disk_bytes is None:
+                    self._disk_bytes = self._scan_bytes()
+                else:
+                    self._disk_bytes += size
+                over_cap = self._disk_bytes > self.max_disk_bytes
+            if over_cap:
+                self._evict()
+
+    def _disk_files(self):
+        """(mtime, size, path) of every stored entry"""
+        files = []
+        for root, _, names in os.walk(self.disk_dir):
+            for name in names:
+                if name.endswith(".npy"):
+                    try:
+                        stat = os.stat(os.path.join(root, name))
+                    except OSError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+        return files
+
+    def _scan_bytes(self):
+        return sum(size for _, size, _ in self._disk_files())
+
+    def _evict(self):
+        """Delete least recently used entries until under 90% of the cap"""
+        with self._lock:
+            # Rescan: other processes add and evict files too
+            files = sorted(self._disk_files())
+            total = sum(size for _, size, _ in files)
+            target = self.max_disk_bytes * 0.9
+            for _, size, path in files:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                    self.evictions += 1
+                except OSError:
+                    pass
+                total -= size
+            self._disk_bytes = total
+
+    def _remember(self, key, embeddings):
+        with self._lock:
+            self._entries[key] = embeddings
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "disk_store": self.disk_dir,
+                "disk_bytes": self._disk_bytes,
+                "max_disk_bytes": self.max_disk_bytes,
+                "disk_errors": self.disk_errors,
+                "evictions": self.evictions,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0
+            }
@@ -0,0 +1,155 @@
+"""
+Recall, latency and memory report for the approximate index types.
+
+Reads the exact vectors from a flat faces.index (or the vectors.npy of a
+build with --exact-vectors), holds out a sample of them as queries, builds
+each candidate index type from the rest and compares top-k results against
+exact search. Held-out queries are not in the index, so no query trivially
+finds itself as its top hit. Quantized types are also measured with
+exact re-ranking of --rerank candidates, as the API does with
+RERANK_CANDIDATES; each row records the index size per face.
+
+Usage (from flask-api/src):
+    python evaluate_index.py --k 10 --queries 1000
+    python evaluate_index.py --types sq-fp16,sq-int8,pq --rerank 200
+"""
+import os
+import json
+import time
+import argparse
+import numpy as np
+import faiss
+
+from index_factory import (
+    INDEX_TYPES, QUANTIZED_TYPES, DEFAULT_PQ_M, DEFAULT_HNSW_M, DEFAULT_TRAIN_SIZE, EXACT_VECTORS_NAME,
+    create_index, exact_vectors, search_parameters, rerank
+)
+
+DEFAULT_INDEX_PATH = "../embeddings/faces.index"
+DEFAULT_REPORT_PATH = "../embeddings/index_report.json"
+
+def parse_int_list(value):
+    return [int(v) for v in value.split(",") if v]
+
+def load_vectors(index_path):
+    """Exact vectors of a flat index, or the vectors.npy saved beside a quantized one"""
+    try:
+        return exact_vectors(faiss.read_index(index_path))
+    except ValueError:
+        vectors_path = os.path.join(os.path.dirname(index_path), EXACT_VECTORS_NAME)
+        if not os.path.exists(vectors_path):
+            raise
+        return np.load(vectors_path)
+
+def index_bytes(index):
+    """Serialized size of an index, roughly what it occupies in memory"""
+    return len(faiss.serialize_index(index))
+
+def time_queries(index, queries, k, params=None, vectors=None, candidates=0):
+    """
+    Search one query at a time, as /search does, re-ranking the top
+    candidates exactly if vectors are given. Returns results and per-query ms
+    """
+    all_ids = np.empty((len(queries), k), dtype="int64")
+    latencies = np.empty(len(queries))
+    for i, query in enumerate(queries):
+        query = query.reshape(1, -1)
+        start = time.perf_counter()
+        if vectors is None:
+            _, ids = index.search(query, k, params=params)
+        else:
+            _, ids = index.search(query, max(k, candidates), params=params)
+            _, ids = rerank(query, ids, vectors, k)
+        latencies[i] = (time.perf_counter() - start) * 1000
+        all_ids[i] = ids[0]
+    return all_ids, latencies
+
+def recall_at_k(found_ids, exact_ids):
+    """Fraction of the exact top-k that the approximate search also returned"""
+    hits = sum(len(np.intersect1d(found, exact)) for found, exact in zip(found_ids, exact_ids))
+    return hits / exact_ids.size
+
+def summarize(name, params_label, found_ids, exact_ids, latencies, build_seconds, size, n_vectors):
+    row = {
+        "index_type": name,
+        "params": params_label,
+        "recall_at_k": round(recall_at_k(found_ids, exact_ids), 4),
+        "index_mb": round(size / 2**20, 1),
+        "bytes_per_face": round(size / n_vectors, 1),
+        "mean_ms": round(float(latencies.mean()), 3),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+        "build_seconds": round(build_seconds, 2)
+    }
+    print(f"{name:<10} {params_label:<24} recall@k={row['recall_at_k']:.4f}  "
+          f"mean={row['mean_ms']:.3f}ms  p95={row['p95_ms']:.3f}ms  {row['bytes_per_face']:.0f} B/face")
+    return row
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall vs latency of approximate FAISS indexes")
+    parser.add_argument("--index", default=DEFAULT_INDEX_PATH, help="Flat index with the exact vectors")
+    parser.add_argument("--output", default=DEFAULT_REPORT_PATH, help="Where to write the JSON report")
+    parser.add_argument("--types", default="ivf-flat,ivf-pq,hnsw,sq-fp16,sq-int8,pq",
+                        help="Comma-separated index types")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=1000, help="Stored faces sampled as queries")
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--pq-m", type=int, default=DEFAULT_PQ_M)
+    parser.add_argument("--hnsw-m", type=int, default=DEFAULT_HNSW_M)
+    parser.add_argument("--train-size", type=int, default=DEFAULT_TRAIN_SIZE)
+    parser.add_argument("--nprobe", type=parse_int_list, default=[1, 4, 8, 16, 32, 64])
+    parser.add_argument("--ef-search", type=parse_int_list, default=[16, 32, 64, 128, 256])
+    parser.add_argument("--rerank", type=int, default=100,
+                        help="Candidates re-ranked exactly for quantized types (0 to skip)")
+    args = parser.parse_args()
+
+    index_types = [t for t in args.types.split(",") if t]
+    for index_type in index_types:
+        if index_type not in INDEX_TYPES:
+            parser.error(f"Unknown index type: {index_type}")
+
+    vectors = load_vectors(args.index)
+    rng = np.random.default_rng(0)
+    held_out = np.zeros(len(vectors), dtype=bool)
+    held_out[rng.choice(len(vectors), min(args.queries, len(vectors) - 1), replace=False)] = True
+    queries, vectors = vectors[held_out], vectors[~held_out]
+    k = min(args.k, len(vectors))
+    print(f"=== {len(vectors)} vectors, {len(queries)} queries, k={k} ===")
+
+    exact = create_index(vectors, "flat")
+    exact_ids, exact_latencies = time_queries(exact, queries, k)
+    flat_size = index_bytes(exact)
+    rows = [summarize("flat", "exact", exact_ids, exact_ids, exact_latencies, 0.0, flat_size, len(vectors))]
+
+    for index_type in index_types:
+        start = time.perf_counter()
+        index = create_index(vectors, index_type, nlist=args.nlist, pq_m=args.pq_m,
+                             hnsw_m=args.hnsw_m, train_size=args.train_size)
+        build_seconds = time.perf_counter() - start
+        size = index_bytes(index)
+
+        if index_type == "hnsw":
+            sweep = [(f"efSearch={ef}", search_parameters(index, ef_search=ef)) for ef in args.ef_search]
+        elif index_type.startswith("ivf"):
+            sweep = [(f"nprobe={n}", search_parameters(index, nprobe=n)) for n in args.nprobe]
+        else:
+            sweep = [("exhaustive", None)]
+
+        for label, params in sweep:
+            found_ids, latencies = time_queries(index, queries, k, params)
+            rows.append(summarize(index_type, label, found_ids, exact_ids, latencies, build_seconds,
+                                  size, len(vectors)))
+            if index_type in QUANTIZED_TYPES and args.rerank:
+                # The float32 vectors are read from disk at query time, not held with the index
+                found_ids, latencies = time_queries(index, queries, k, params, vectors, args.rerank)
+                rows.append(summarize(index_type, f"{label} +rerank{args.rerank}", found_ids, exact_ids,
+                                      latencies, build_seconds, size, len(vectors)))
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump({"vectors": len(vectors), "queries": len(queries), "k": k,
+                   "flat_bytes_per_face": round(flat_size / len(vectors), 1), "results": rows}, f, indent=2)
+    print(f"\nReport saved to: {args.output}")
+
+if __name__ == "__main__":
+    main()
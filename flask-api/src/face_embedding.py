@@ -0,0 +1,37 @@
+"""
+Face crop embedding shared by the index builder, the API and the batch
+query CLI, so dataset faces and query faces go through the same model call.
+"""
+from deepface import DeepFace
+
+from utils import normalize_embeddings
+
+def embed_face_crops(face_crops, model_name):
+    """
+    Embed already-detected, aligned face crops with a single forward pass.
+    Returns a (len(face_crops), dim) array of normalized float32 embeddings.
+    """
+    reps = DeepFace.represent(
+        list(face_crops),
+        model_name=model_name,
+        detector_backend="skip",
+        enforce_detection=False
+    )
+    # A batched call returns one result list per input crop
+    if reps and isinstance(reps[0], dict):
+        reps = [reps]
+    return normalize_embeddings([rep[0]["embedding"] for rep in reps])
+
+def embed_face_crop(face_crop, model_name):
+    """
+    Embed one face crop in a forward pass of its own, as the serial index
+    build does; batched results can differ from it in the last float bits.
+    Returns a normalized float32 embedding.
+    """
+    rep = DeepFace.represent(
+        face_crop,
+        model_name=model_name,
+        detector_backend="skip",
+        enforce_detection=False
+    )
+    return normalize_embeddings(rep[0]["embedding"])
@@ -0,0 +1,240 @@
+"""
+FAISS index construction shared by the index builder, the API and the
+recall/latency report.
+
+All index types use inner product over L2-normalized ArcFace embeddings,
+i.e. cosine similarity, the same as the original IndexFlatIP.
+
+The quantized flat types store each vector in 1 KB (sq-fp16), 512 bytes
+(sq-int8) or pq_m bytes (pq) instead of 2 KB and are scanned exhaustively.
+Their scores are approximate; a build can also keep the float32 vectors in
+vectors.npy (indexed by face id) so the API re-ranks the top candidates
+exactly from a memory-mapped file, which costs disk but not RAM.
+"""
+import numpy as np
+import faiss
+
+INDEX_TYPES = ("flat", "ivf-flat", "ivf-pq", "hnsw", "sq-fp16", "sq-int8", "pq")
+QUANTIZED_TYPES = ("ivf-pq", "sq-fp16", "sq-int8", "pq")
+
+# Float32 vectors by face id, next to faces.index, for exact re-ranking
+EXACT_VECTORS_NAME = "vectors.npy"
+
+# Build-time defaults
+DEFAULT_PQ_M = 64        # PQ sub-quantizers (512-d ArcFace -> 8 dims each)
+DEFAULT_HNSW_M = 32      # HNSW graph neighbours per node
+DEFAULT_TRAIN_SIZE = 50000
+
+# Search-time defaults and limits (nprobe above nlist scans every list)
+DEFAULT_NPROBE = 16
+DEFAULT_EF_SEARCH = 64
+MAX_NPROBE = 4096
+MAX_EF_SEARCH = 4096
+
+def default_nlist(n_vectors):
+    """About 4*sqrt(n) inverted lists, keeping at least 39 training points per list"""
+    return max(1, min(int(4 * np.sqrt(n_vectors)), n_vectors // 39))
+
+def factory_string(index_type, n_vectors, nlist=None, pq_m=DEFAULT_PQ_M, hnsw_m=DEFAULT_HNSW_M):
+    """FAISS index_factory description for one of INDEX_TYPES"""
+    nlist = nlist or default_nlist(n_vectors)
+    if index_type == "flat":
+        return "Flat"
+    if index_type == "ivf-flat":
+        return f"IVF{nlist},Flat"
+    if index_type == "ivf-pq":
+        return f"IVF{nlist},PQ{pq_m}"
+    if index_type == "hnsw":
+        return f"HNSW{hnsw_m},Flat"
+    if index_type == "sq-fp16":
+        return "SQfp16"
+    if index_type == "sq-int8":
+        return "SQ8"
+    if index_type == "pq":
+        return f"PQ{pq_m}"
+    raise ValueError(f"Unknown index type: {index_type} (expected one of {', '.join(INDEX_TYPES)})")
+
+def create_index(embeddings, index_type="flat", nlist=None, pq_m=DEFAULT_PQ_M,
+                 hnsw_m=DEFAULT_HNSW_M, train_size=DEFAULT_TRAIN_SIZE, seed=0):
+    """
+    Create an index of the given type, train it on a random sample of the
+    embeddings if needed, and add all embeddings with ids 0..n-1.
+    "flat" stays a plain IndexFlatIP, as written by earlier builds. IVF
+    indexes keep the ids in their inverted lists; the other approximate
+    types are wrapped in an IndexIDMap2 so incremental updates can remove
+    vectors by id. (An IndexIDMap2 renumbers its map on removal, which only
+    matches indexes that compact their storage the same way; IVF lists keep
+    their ids, so a wrapped IVF index returns the wrong faces afterwards.)
+    """
+    return create_index_from_chunks([embeddings], index_type, nlist, pq_m, hnsw_m, train_size, seed)
+
+def create_index_from_chunks(chunks, index_type="flat", nlist=None, pq_m=DEFAULT_PQ_M,
+                             hnsw_m=DEFAULT_HNSW_M, train_size=DEFAULT_TRAIN_SIZE, seed=0):
+    """
+    create_index over embeddings split into consecutive chunks (arrays or
+    memory-mapped .npy files). Chunks are added one at a time, so beyond the
+    index itself only one chunk and the training sample are in memory.
+    """
+    sizes = [len(chunk) for chunk in chunks]
+    n_vectors, dim = sum(sizes), chunks[0].shape[1]
+    offsets = np.cumsum([0] + sizes)
+
+    if index_type == "flat":
+        index = faiss.IndexFlatIP(dim)
+        for chunk in chunks:
+            index.add(np.ascontiguousarray(chunk, dtype="float32"))
+        return index
+
+    description = factory_string(index_type, n_vectors, nlist, pq_m, hnsw_m)
+    index = faiss.index_factory(dim, description, faiss.METRIC_INNER_PRODUCT)
+
+    if not index.is_trained:
+        rng = np.random.default_rng(seed)
+        sample_ids = np.sort(rng.choice(n_vectors, min(n_vectors, train_size), replace=False))
+        print(f"Training {description} on {len(sample_ids)} vectors...")
+        # Gather the sample chunk by chunk; ids are sorted, so each chunk's share is contiguous
+        bounds = np.searchsorted(sample_ids, offsets)
+        index.train(np.vstack([
+            np.asarray(chunk[sample_ids[bounds[i]:bounds[i + 1]] - offsets[i]], dtype="float32")
+            for i, chunk in enumerate(chunks)
+        ]))
+
+    if not isinstance(index, faiss.IndexIVF):
+        index = faiss.IndexIDMap2(index)
+    for i, chunk in enumerate(chunks):
+        index.add_with_ids(np.ascontiguousarray(chunk, dtype="float32"),
+                           np.arange(offsets[i], offsets[i + 1], dtype="int64"))
+    return index
+
+def read_index(path, mmap=False):
+    """
+    Read an index written by faiss.write_index. With mmap the vector data
+    stays in the file and is paged in on demand through the OS page cache,
+    so every worker process on a host shares one physical copy: flat and HNSW
+    storage through IO_FLAG_MMAP_IFC, IVF inverted lists through
+    IO_FLAG_MMAP. The loaded index is read-only; HNSW links and ID maps are
+    still read into each process.
+    """
+    if not mmap:
+        return faiss.read_index(path)
+    flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+    try:
+        # IO_FLAG_MMAP_IFC needs faiss >= 1.10
+        return faiss.read_index(path, flags | getattr(faiss, "IO_FLAG_MMAP_IFC", 0))
+    except RuntimeError:
+        # IVF inverted lists reject the flat-codes flag
+        return faiss.read_index(path, flags)
+
+def write_exact_vectors(path, chunks):
+    """Write float32 vectors (arrays or memory-mapped .npy chunks) to one .npy, chunk by chunk"""
+    n_vectors, dim = sum(len(chunk) for chunk in chunks), chunks[0].shape[1]
+    vectors = np.lib.format.open_memmap(path, mode="w+", dtype="float32", shape=(n_vectors, dim))
+    start = 0
+    for chunk in chunks:
+        vectors[start:start + len(chunk)] = chunk
+        start += len(chunk)
+    vectors.flush()
+    del vectors
+
+def rerank(queries, candidate_ids, vectors, k):
+    """
+    Exact similarities of each query's candidate ids (-1 = none), read
+    from float32 vectors indexed by id (e.g. a memory-mapped vectors.npy).
+    Returns distances and ids of the best k, like index.search.
+    """
+    candidate_ids = np.asarray(candidate_ids)
+    D = np.full(candidate_ids.shape, -np.inf, dtype="float32")
+    for row, (query, ids) in enumerate(zip(queries, candidate_ids)):
+        valid = ids >= 0
+        # Sorted reads keep the memory-mapped file access sequential
+        order = np.argsort(ids[valid])
+        D[row, np.flatnonzero(valid)[order]] = vectors[ids[valid][order]] @ query
+    order = np.argsort(-D, axis=1, kind="stable")[:, :k]
+    D, I = np.take_along_axis(D, order, 1), np.take_along_axis(candidate_ids, order, 1)
+    I[np.isinf(D)] = -1
+    return D, I
+
+def merge_shard_results(shard_results, limit):
+    """
+    Merge the (distances, ids) results of several shards, which hold one
+    row per query, into the best `limit` of each row across shards.
+    Returns (distances, shard positions, ids) per query row, best first;
+    ties keep shard order.
+    """
+    merged = []
+    for row in range(len(shard_results[0][0])):
+        distances = np.concatenate([D[row] for D, _ in shard_results])
+        ids = np.concatenate([I[row] for _, I in shard_results])
+        positions = np.concatenate([np.full(len(D[row]), pos) for pos, (D, _) in enumerate(shard_results)])
+        order = np.argsort(-distances, kind="stable")[:limit]
+        merged.append((distances[order], positions[order], ids[order]))
+    return merged
+
+def stored_ids(index):
+    """Ids of the stored vectors, in storage order"""
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.vector_to_array(index.id_map)
+    if isinstance(index, faiss.IndexIVF):
+        invlists = index.invlists
+        return np.concatenate([np.zeros(0, dtype="int64")] + [
+            faiss.rev_swig_ptr(invlists.get_ids(list_no), invlists.list_size(list_no)).copy()
+            for list_no in range(index.nlist) if invlists.list_size(list_no)
+        ])
+    return np.arange(index.ntotal, dtype="int64")
+
+def unwrap_id_mapped_ivf(index):
+    """
+    The IVF index inside an IndexIDMap2 (as written by earlier builds), with
+    the ids moved into its inverted lists. Raises ValueError if vectors were
+    already removed through the wrapper: the ids no longer line up, and only
+    a full build can fix the index.
+    """
+    ivf = faiss.downcast_index(index.index)
+    id_map = faiss.vector_to_array(index.id_map)
+    if not np.array_equal(np.sort(stored_ids(ivf)), np.arange(len(id_map))):
+        raise ValueError("Vectors were removed from this IVF index through its id map, "
+                         "so its ids are wrong")
+    invlists = ivf.invlists
+    for list_no in range(ivf.nlist):
+        size = invlists.list_size(list_no)
+        if size:
+            ids = np.ascontiguousarray(id_map[faiss.rev_swig_ptr(invlists.get_ids(list_no), size)])
+            codes = faiss.rev_swig_ptr(invlists.get_codes(list_no), size * invlists.code_size).copy()
+            invlists.update_entries(list_no, 0, size, faiss.swig_ptr(ids), faiss.swig_ptr(codes))
+    # A standalone copy: the wrapper owns (and frees) the original
+    return faiss.deserialize_index(faiss.serialize_index(ivf))
+
+def unwrap_index(index):
+    """The underlying index of an ID-mapped index (or the index itself)"""
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.downcast_index(index.index)
+    return index
+
+def search_parameters(index, nprobe=DEFAULT_NPROBE, ef_search=DEFAULT_EF_SEARCH):
+    """
+    Per-call search parameters for the index type, or None for exact indexes.
+    Passing these to index.search() instead of setting index.nprobe keeps
+    concurrent requests with different settings from interfering.
+    Raises ValueError unless 1 <= nprobe <= MAX_NPROBE and
+    1 <= ef_search <= MAX_EF_SEARCH.
+    """
+    if not 1 <= nprobe <= MAX_NPROBE or not 1 <= ef_search <= MAX_EF_SEARCH:
+        raise ValueError(f"nprobe must be in 1..{MAX_NPROBE} and ef_search in 1..{MAX_EF_SEARCH}")
+    inner = unwrap_index(index)
+    if isinstance(inner, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(nprobe=nprobe)
+    if isinstance(inner, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(efSearch=ef_search)
+    return None
+
+def describe_index(index):
+    """Short name of the index type, e.g. IndexIVFFlat"""
+    return type(unwrap_index(index)).__name__
+
+def exact_vectors(index):
+    """Stored float32 vectors of a flat index, in insertion order"""
+    inner = unwrap_index(index)
+    if not isinstance(inner, faiss.IndexFlat):
+        raise ValueError(f"Exact vectors need a flat index, got {describe_index(index)}. "
+                         "Build with --index-type flat first.")
+    return inner.reconstruct_n(0, inner.ntotal)
@@ -0,0 +1,272 @@
+"""
+Compact, memory-mapped per-face metadata.
+
+Replaces filenames.npy (a numpy string array) and face_metadata.npy (a
+pickled object array of dicts). Each column is a plain .npy file indexed by
+face id, so the API can memory-map them: startup does not parse anything
+and pages are shared between workers through the OS page cache.
+
+    image_ids.npy          int32   image id per face (-1 = removed face)
+    face_indices.npy       int32   1-based face number within its image
+    boxes.npy              float32 (n, 4) x, y, w, h as fractions of the image
+    confidences.npy        float32 detector confidence
+    image_name_offsets.npy int64   (n_images + 1) offsets into image_names.npy
+    image_names.npy        uint8   interned UTF-8 image filenames, concatenated
+    meta.json              format version, counts and the model/detector
+                           the faces were embedded with, written last
+
+Optional person clusters, written by cluster_faces.py after a build:
+
+    cluster_ids.npy        int32   cluster id per face (-1 = not clustered)
+    cluster_faces.npy      int64   face ids grouped by cluster
+    cluster_offsets.npy    int64   (n_clusters + 1) offsets into cluster_faces.npy
+
+They are only used while meta.json records the clustering ("clusters"); a
+rebuild rewrites meta.json without it, which retires the stale files.
+
+Near-duplicate photos collapsed by build_index.py --collapse-duplicates have
+no faces of their own; they are listed under the photo that represents them
+(meta.json "collapsed_images" > 0):
+
+    duplicate_offsets.npy  int64   (n_images + 1) offsets into duplicate_ids.npy
+    duplicate_ids.npy      int32   image ids of the photos each image represents
+"""
+import os
+import json
+import numpy as np
+
+FORMAT_VERSION = 1
+COLUMNS = ("image_ids", "face_indices", "boxes", "confidences", "image_name_offsets", "image_names")
+CLUSTER_COLUMNS = ("cluster_ids", "cluster_faces", "cluster_offsets")
+DUPLICATE_COLUMNS = ("duplicate_offsets", "duplicate_ids")
+META_NAME = "meta.json"
+
+def face_record(original_filename, face_index, box=(0.0, 0.0, 0.0, 0.0), confidence=0.0):
+    """The per-face fields stored in the metadata store"""
+    return {
+        'original_filename': original_filename,
+        'face_index': face_index,
+        'box': box,
+        'confidence': confidence
+    }
+
+def build_columns(records, duplicates=None):
+    """
+    Columns for a list of face records indexed by face id; None marks a
+    removed face. duplicates maps a photo's filename to the filenames of
+    the near-duplicates it represents.
+    """
+    n_faces = len(records)
+    image_ids = np.full(n_faces, -1, dtype="int32")
+    face_indices = np.zeros(n_faces, dtype="int32")
+    boxes = np.zeros((n_faces, 4), dtype="float32")
+    confidences = np.zeros(n_faces, dtype="float32")
+
+    names = {}  # Image filename -> image id, in first-seen order
+    for face_id, record in enumerate(records):
+        if record is None:
+            continue
+        image_ids[face_id] = names.setdefault(record['original_filename'], len(names))
+        face_indices[face_id] = record['face_index']
+        boxes[face_id] = record.get('box', (0.0, 0.0, 0.0, 0.0))
+        confidences[face_id] = record.get('confidence', 0.0)
+
+    # Collapsed photos have no faces; their names follow the indexed ones
+    duplicate_lists = [[] for _ in names]
+    for filename, members in (duplicates or {}).items():
+        if filename in names:
+            duplicate_lists[names[filename]] = [names.setdefault(member, len(names)) for member in members]
+    duplicate_lists.extend([] for _ in range(len(names) - len(duplicate_lists)))
+
+    encoded = [name.encode("utf-8") for name in names]
+    image_name_offsets = np.zeros(len(encoded) + 1, dtype="int64")
+    image_name_offsets[1:] = np.cumsum([len(name) for name in encoded])
+    image_names = np.frombuffer(b"".join(encoded), dtype="uint8")
+
+    columns = {
+        "image_ids": image_ids,
+        "face_indices": face_indices,
+        "boxes": boxes,
+        "confidences": confidences,
+        "image_name_offsets": image_name_offsets,
+        "image_names": image_names
+    }
+    if any(duplicate_lists):
+        columns["duplicate_offsets"] = np.zeros(len(duplicate_lists) + 1, dtype="int64")
+        columns["duplicate_offsets"][1:] = np.cumsum([len(ids) for ids in duplicate_lists])
+        columns["duplicate_ids"] = np.array([i for ids in duplicate_lists for i in ids], dtype="int32")
+    return columns
+
+def stage_metadata_store(directory, records, build_info=None, duplicates=None):
+    """
+    Write the store's files next to their final names with a .tmp suffix.
+    build_info (e.g. model and detector) is kept in meta.json; duplicates
+    as in build_columns.
+    Returns (tmp_path, path) pairs for the caller to os.replace() once every
+    artifact of the build is written.
+    """
+    os.makedirs(directory, exist_ok=True)
+    columns = build_columns(records, duplicates)
+    staged = []
+    for name in COLUMNS + (DUPLICATE_COLUMNS if "duplicate_ids" in columns else ()):
+        path = os.path.join(directory, f"{name}.npy")
+        with open(path + ".tmp", "wb") as f:
+            np.save(f, columns[name])
+        staged.append((path + ".tmp", path))
+
+    meta_path = os.path.join(directory, META_NAME)
+    with open(meta_path + ".tmp", "w") as f:
+        json.dump(dict(build_info or {}, **{
+            "format": FORMAT_VERSION,
+            "faces": len(columns["image_ids"]),
+            "images": len(columns["image_name_offsets"]) - 1,
+            "collapsed_images": len(columns.get("duplicate_ids", ()))
+        }), f)
+    staged.append((meta_path + ".tmp", meta_path))
+    return staged
+
+def write_clusters(directory, cluster_ids, info):
+    """
+    Add person clusters to an existing store: a cluster id per face, plus
+    the face ids grouped by cluster so a gallery is a single slice. info
+    (threshold, counts, ...) is recorded under "clusters" in meta.json,
+    which is replaced last.
+    """
+    cluster_ids = np.asarray(cluster_ids, dtype="int32")
+    meta_path = os.path.join(directory, META_NAME)
+    with open(meta_path) as f:
+        meta = json.load(f)
+    if len(cluster_ids) != meta["faces"]:
+        raise ValueError(f"{len(cluster_ids)} cluster ids for a store of {meta['faces']} faces")
+
+    n_clusters = int(cluster_ids.max()) + 1 if len(cluster_ids) else 0
+    clustered = np.flatnonzero(cluster_ids >= 0)
+    columns = {
+        "cluster_ids": cluster_ids,
+        "cluster_faces": clustered[np.argsort(cluster_ids[clustered], kind="stable")].astype("int64"),
+        "cluster_offsets": np.concatenate([[0], np.cumsum(np.bincount(cluster_ids[clustered],
+                                                                      minlength=n_clusters))]).astype("int64")
+    }
+    for name in CLUSTER_COLUMNS:
+        path = os.path.join(directory, f"{name}.npy")
+        with open(path + ".tmp", "wb") as f:
+            np.save(f, columns[name])
+        os.replace(path + ".tmp", path)
+
+    meta["clusters"] = dict(info, clusters=n_clusters, clustered_faces=len(clustered))
+    with open(meta_path + ".tmp", "w") as f:
+        json.dump(meta, f)
+    os.replace(meta_path + ".tmp", meta_path)
+
+def _load_column(path):
+    try:
+        return np.load(path, mmap_mode="r")
+    except ValueError:
+        # Empty arrays cannot be memory-mapped
+        return np.load(path)
+
+class FaceMetadataStore:
+    """Read-only view over the metadata columns, indexed by face id"""
+
+    def __init__(self, image_ids, face_indices, boxes, confidences, image_name_offsets, image_names):
+        self.image_ids = image_ids
+        self.face_indices = face_indices
+        self.boxes = boxes
+        self.confidences = confidences
+        self.image_name_offsets = image_name_offsets
+        self.image_names = image_names
+        self.build_info = {}  # Model/detector the faces were embedded with, if recorded
+        # Person clusters (see write_clusters), if the store has them
+        self.clusters = {}
+        self.cluster_ids = None
+        self.cluster_faces = None
+        self.cluster_offsets = None
+        # Near-duplicate photos collapsed into each image, if any
+        self.duplicate_offsets = None
+        self.duplicate_ids = None
+
+    @classmethod
+    def open(cls, directory):
+        """Memory-map a store written by stage_metadata_store"""
+        with open(os.path.join(directory, META_NAME)) as f:
+            meta = json.load(f)
+        if meta.get("format") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported metadata format: {meta.get('format')}")
+
+        store = cls(**{name: _load_column(os.path.join(directory, f"{name}.npy")) for name in COLUMNS})
+        if len(store) != meta["faces"]:
+            raise ValueError(f"Metadata store is incomplete: {len(store)} of {meta['faces']} faces")
+        store.build_info = {key: meta[key] for key in ("model", "detector") if key in meta}
+        if "clusters" in meta:
+            store.clusters = meta["clusters"]
+            for name in CLUSTER_COLUMNS:
+                setattr(store, name, _load_column(os.path.join(directory, f"{name}.npy")))
+            if len(store.cluster_ids) != len(store):
+                raise ValueError("Cluster ids do not match the metadata store")
+        if meta.get("collapsed_images"):
+            for name in DUPLICATE_COLUMNS:
+                setattr(store, name, _load_column(os.path.join(directory, f"{name}.npy")))
+        return store
+
+    @classmethod
+    def from_legacy(cls, filenames_path):
+        """
+        In-memory store built from an older filenames.npy; boxes and
+        confidences are unknown.
+        """
+        records = []
+        for filename in np.load(filenames_path, allow_pickle=True):
+            original_filename, sep, face_index = str(filename).rpartition("_face")
+            if not filename:
+                records.append(None)
+            elif sep and face_index.isdigit():
+                records.append(face_record(original_filename, int(face_index)))
+            else:
+                # One embedding per image, from the earliest builds
+                records.append(face_record(str(filename), 1))
+        return cls(**build_columns(records))
+
+    def __len__(self):
+        return len(self.image_ids)
+
+    def image_name(self, image_id):
+        start, end = self.image_name_offsets[image_id], self.image_name_offsets[image_id + 1]
+        return bytes(self.image_names[start:end]).decode("utf-8")
+
+    def duplicates(self, image_id):
+        """Filenames of the near-duplicate photos collapsed into an image"""
+        if self.duplicate_offsets is None:
+            return []
+        start, end = self.duplicate_offsets[image_id], self.duplicate_offsets[image_id + 1]
+        return [self.image_name(int(i)) for i in self.duplicate_ids[start:end]]
+
+    def original_filename(self, face_id):
+        """Filename of the photo a face came from, or None for a removed face"""
+        image_id = int(self.image_ids[face_id])
+        return self.image_name(image_id) if image_id >= 0 else None
+
+    def filename(self, face_id):
+        """The face's name as used in results, e.g. IMG_0001.jpg_face2"""
+        original_filename = self.original_filename(face_id)
+        if original_filename is None:
+            return ""
+        return f"{original_filename}_face{int(self.face_indices[face_id])}"
+
+    def record(self, face_id):
+        """The face_record for a face id, or None for a removed face"""
+        original_filename = self.original_filename(face_id)
+        if original_filename is None:
+            return None
+        return face_record(
+            original_filename,
+            int(self.face_indices[face_id]),
+            tuple(float(v) for v in self.boxes[face_id]),
+            float(self.confidences[face_id])
+        )
+
+    def cluster_members(self, cluster_id):
+        """Face ids in one person cluster"""
+        return self.cluster_faces[self.cluster_offsets[cluster_id]:self.cluster_offsets[cluster_id + 1]]
+
+    def records(self):
+        return [self.record(face_id) for face_id in range(len(self))]
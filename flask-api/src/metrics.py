@@ -0,0 +1,64 @@
+"""
+Prometheus metrics and per-request stage timing.
+
+Under gunicorn every worker is a separate process and a scrape of /metrics
+is answered by whichever worker accepts it, so metrics use prometheus_client
+in multiprocess mode: with PROMETHEUS_MULTIPROC_DIR set (before the client is
+imported; see scripts/setup-services.sh), every worker writes its samples to
+files in that directory and render() aggregates all of them. Counters and
+histograms are summed across workers, dead ones included; gauges are combined
+as their multiprocess_mode says. gunicorn.conf.py marks exited workers dead.
+Without PROMETHEUS_MULTIPROC_DIR (flask run, tests) the process's own
+metrics are rendered.
+
+The directory must be emptied between runs of the server, or counters
+continue from the previous run's files.
+"""
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import REGISTRY, CollectorRegistry, generate_latest, multiprocess
+
+# Seconds; covers cache hits (~1 ms) through cold MTCNN passes on large uploads
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def multiprocess_dir():
+    """The shared sample directory, or None when running single-process"""
+    return os.environ.get("PROMETHEUS_MULTIPROC_DIR") or None
+
+def render():
+    """Metrics of every worker (or of this process) in the Prometheus text format"""
+    if multiprocess_dir():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry)
+
+def mark_worker_dead(pid):
+    """Drop the live-only gauges of an exited worker; its counters are kept"""
+    if multiprocess_dir():
+        multiprocess.mark_process_dead(pid)
+
+class StageTimer:
+    """Wall-clock durations of the named stages of one request, in order"""
+
+    def __init__(self):
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        self.stages.append((name, seconds))
+
+    def server_timing(self, total=None):
+        """Server-Timing header value, durations in ms, with an optional total"""
+        stages = self.stages + ([("total", total)] if total is not None else [])
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in stages)
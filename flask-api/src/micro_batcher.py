@@ -0,0 +1,124 @@
+"""
+Dynamic micro-batching for concurrent requests.
+
+Request threads submit one item each and block; a single background thread
+collects items that arrive within a short window (or until the batch is
+full), processes them together, and hands each caller its own result.
+Under load this turns many small forward passes / FAISS searches into a few
+large ones; a lone request only waits the (few ms) window.
+"""
+import time
+import queue
+import threading
+from concurrent.futures import Future, TimeoutError
+
+def process_groups(items, results, key, process_group):
+    """
+    Process a batch in groups of items with the same key(item), e.g. the
+    same search settings. process_group(key, positions) returns one result
+    per position. Items whose slot in results is already filled (say, with
+    an exception from an earlier step) are left out. An exception raised
+    for one group becomes the result of that group's items only, so one bad
+    request does not fail the rest of the batch. Returns results.
+    """
+    groups = {}
+    for pos, item in enumerate(items):
+        if results[pos] is None:
+            groups.setdefault(key(item), []).append(pos)
+
+    for group_key, positions in groups.items():
+        try:
+            group_results = process_group(group_key, positions)
+        except Exception as e:
+            group_results = [e] * len(positions)
+        for pos, result in zip(positions, group_results):
+            results[pos] = result
+    return results
+
+class MicroBatcher:
+    """
+    process_batch(items) must return one result per item, in order. A result
+    that is an Exception instance is raised in that item's caller only; an
+    exception raised by process_batch itself fails the whole batch, as does
+    a short result list for the items it left out.
+    """
+
+    def __init__(self, process_batch, max_batch_size=32, max_wait_ms=5, name="micro-batcher"):
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms / 1000)
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+        self.timeouts = 0
+        threading.Thread(target=self._run, name=name, daemon=True).start()
+
+    def submit(self, item, timeout=None):
+        """
+        Queue an item and wait for its result. Raises TimeoutError after
+        timeout seconds; an item still queued by then is never processed.
+        """
+        future = Future()
+        self._queue.put((item, future))
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            future.cancel()
+            with self._lock:
+                self.timeouts += 1
+            raise
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                # Once the window has closed, still take whatever is already queued
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            # Drop items whose callers already timed out
+            batch = [(item, future) for item, future in self._collect()
+                     if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                results = list(self.process_batch([item for item, _ in batch]))
+                for (_, future), result in zip(batch, results):
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+                if len(results) < len(batch):
+                    raise RuntimeError(f"process_batch returned {len(results)} results for {len(batch)} items")
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+            with self._lock:
+                self.batches += 1
+                self.items += len(batch)
+                self.largest_batch = max(self.largest_batch, len(batch))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "batches": self.batches,
+                "requests": self.items,
+                "largest_batch": self.largest_batch,
+                "timeouts": self.timeouts,
+                "mean_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0
+            }
@@ -0,0 +1,24 @@
+"""
+Opaque cursors for paging through threshold-mode /search results.
+
+A cursor carries the offset of the next page and the index generation the
+first page came from, so the API can refuse to continue across a reload.
+"""
+import json
+import base64
+
+def encode_cursor(offset, generation):
+    """Opaque pagination cursor for threshold mode"""
+    payload = json.dumps({"offset": offset, "generation": generation}).encode()
+    return base64.urlsafe_b64encode(payload).decode()
+
+def decode_cursor(cursor):
+    """
+    (offset, generation) of a cursor from encode_cursor.
+    Raises ValueError, KeyError or TypeError for anything else.
+    """
+    payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    offset, generation = int(payload["offset"]), int(payload["generation"])
+    if offset < 0:
+        raise ValueError(f"Negative cursor offset: {offset}")
+    return offset, generation
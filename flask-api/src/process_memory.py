@@ -0,0 +1,91 @@
+"""
+Memory use of the API worker processes, read from /proc (Linux only).
+
+RSS counts every page a process has mapped, including page-cache pages of a
+memory-mapped index that other workers map too, so summing RSS over workers
+overstates the total. PSS splits each shared page between the processes
+mapping it; the sum of PSS is what the workers actually cost the host.
+
+Usage (from flask-api/src), with the gunicorn master's pid:
+    python process_memory.py --pid 12345
+"""
+import os
+import json
+import argparse
+
+def _read_kb_fields(path):
+    """The "Name: value kB" lines of a /proc file as a dict of kB values"""
+    fields = {}
+    with open(path) as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            parts = value.split()
+            if len(parts) == 2 and parts[1] == "kB":
+                fields[name] = int(parts[0])
+    return fields
+
+def process_memory(pid="self"):
+    """RSS, PSS and the shared/private split of one process, in MB"""
+    try:
+        fields = _read_kb_fields(f"/proc/{pid}/smaps_rollup")
+    except OSError:
+        # Kernels before 4.14: RSS only
+        fields = {"Rss": _read_kb_fields(f"/proc/{pid}/status").get("VmRSS", 0)}
+
+    def mb(*names):
+        return round(sum(fields.get(name, 0) for name in names) / 1024, 1)
+
+    return {
+        "pid": os.getpid() if pid == "self" else int(pid),
+        "rss_mb": mb("Rss"),
+        "pss_mb": mb("Pss") if "Pss" in fields else None,
+        "shared_mb": mb("Shared_Clean", "Shared_Dirty"),
+        "private_mb": mb("Private_Clean", "Private_Dirty")
+    }
+
+def child_pids(pid):
+    """Direct children of a process, e.g. the workers of a gunicorn master"""
+    children = []
+    for task in os.listdir(f"/proc/{pid}/task"):
+        with open(f"/proc/{pid}/task/{task}/children") as f:
+            children.extend(int(child) for child in f.read().split())
+    return sorted(children)
+
+def worker_memory_report(master_pid):
+    """Per-worker memory and totals for all workers of a master process"""
+    workers = []
+    for pid in child_pids(master_pid):
+        try:
+            workers.append(process_memory(pid))
+        except OSError:
+            # Worker exited (e.g. max-requests restart) while we were reading
+            continue
+    pss = [w["pss_mb"] for w in workers if w["pss_mb"] is not None]
+    return {
+        "master": process_memory(master_pid),
+        "workers": workers,
+        "total_rss_mb": round(sum(w["rss_mb"] for w in workers), 1),
+        "total_pss_mb": round(sum(pss), 1) if len(pss) == len(workers) else None
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-worker and total memory of the API workers")
+    parser.add_argument("--pid", type=int, required=True, help="gunicorn master pid")
+    parser.add_argument("--output", default=None, help="Also write the report to this JSON file")
+    args = parser.parse_args()
+
+    report = worker_memory_report(args.pid)
+    print(f"{'pid':>8} {'rss MB':>10} {'pss MB':>10} {'shared MB':>10} {'private MB':>10}")
+    for worker in report["workers"]:
+        print(f"{worker['pid']:>8} {worker['rss_mb']:>10} {worker['pss_mb']:>10} "
+              f"{worker['shared_mb']:>10} {worker['private_mb']:>10}")
+    print(f"Total RSS: {report['total_rss_mb']} MB (counts shared pages once per worker)")
+    print(f"Total PSS: {report['total_pss_mb']} MB")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report saved to: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -23,36 +23,350 @@
 # for rank, idx in enumerate(I[0]):
 #     print(f"{rank+1}. {filenames[idx]} (similarity={D[0][rank]:.4f})")
 
-import numpy as np, faiss
+# import numpy as np, faiss
+# from deepface import DeepFace
+# from metadata_store import FaceMetadataStore
+# from utils import MODEL_NAME, DETECTOR_BACKEND
+
+# index = faiss.read_index("../embeddings/faces.index")
+# metadata = FaceMetadataStore.open("../embeddings/metadata")
+
+# query_path = "../query.jpg"
+# model_name = MODEL_NAME
+# detector_backend = DETECTOR_BACKEND
+
+# # Extract query embedding
+# rep = DeepFace.represent(
+#     query_path,
+#     model_name=model_name,
+#     detector_backend=detector_backend,
+#     enforce_detection=False
+# )[0]["embedding"]
+
+# query_emb = np.array(rep).astype("float32")
+# query_emb = query_emb / (np.linalg.norm(query_emb) + 1e-10)
+
+# print("Query norm:", np.linalg.norm(query_emb))
+
+# # Quick sanity check: similarity with itself
+# print("Raw dot with itself:", np.dot(query_emb, query_emb))
+
+# # Search top-5
+# D, I = index.search(query_emb.reshape(1, -1), k=5)
+
+# print("\n=== Top Matches ===")
+# for rank, idx in enumerate(I[0]):
+#     print(f"{rank+1}. {metadata.filename(idx)} (similarity={D[0][rank]:.4f})")
+
+"""
+Batch face search: match a folder of query photos (e.g. student ID
+portraits) against the event index to pre-generate personal galleries.
+
+Query images are decoded and run through the detector by a thread pool,
+one batch ahead of the main thread, which embeds each batch's faces with
+one ArcFace forward pass and searches every shard once per batch, merging
+and re-ranking the shards' results the same way as /search. The
+most confident face of each query image is searched. Results are appended
+to a CSV (one row per match) or JSONL (one line per query) file after
+every batch; rerunning the same command skips the queries already in the
+file, so an interrupted run resumes where it stopped.
+
+Usage (from flask-api/src):
+    python query.py ../portraits --output ../galleries.csv --k 50 --min-similarity 0.45
+    python query.py ../query.jpg
+"""
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from deepface import DeepFace
 
-index = faiss.read_index("../embeddings/faces.index")
-filenames = np.load("../embeddings/filenames.npy")
+from index_factory import (
+    DEFAULT_NPROBE, DEFAULT_EF_SEARCH, EXACT_VECTORS_NAME, read_index, search_parameters, rerank, merge_shard_results
+)
+from metadata_store import FaceMetadataStore
+from shard_registry import load_registry
+from utils import (
+    MODEL_NAME, DETECTOR_BACKEND, DETECTOR_BACKENDS,
+    resize_image_for_processing, pil_to_cv2
+)
+from face_embedding import embed_face_crops
+
+# === CONFIG ===
+embeddings_dir = "../embeddings"
+dataset_dir = "../dataset/convocation-2024"  # Single index from before per-event shards
+model_name = MODEL_NAME
+detector_backend = DETECTOR_BACKEND
+
+DEFAULT_QUERY_PATH = "../query.jpg"
+DEFAULT_OUTPUT_PATH = "../query_results.csv"
+DEFAULT_WORKERS = os.cpu_count() or 4  # Decode/detect threads
+DEFAULT_BATCH_SIZE = 64                # Queries per forward pass and per search
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+CSV_COLUMNS = ("query", "face_confidence", "rank", "event", "filename", "original_filename",
+               "similarity", "path", "duplicates", "error")
+
+class Shard:
+    """One event's index, its face metadata and its photos"""
+
+    def __init__(self, event, index, metadata, dataset_dir, exact_vectors=None):
+        self.event = event
+        self.index = index
+        self.metadata = metadata
+        self.dataset_dir = dataset_dir
+        self.exact_vectors = exact_vectors  # Float32 vectors by face id, for re-ranking
+
+def load_shards(events=None):
+    """The registered event shards (or the single legacy index), memory-mapped"""
+    registry = load_registry(embeddings_dir)
+    if registry is None:
+        registry = {os.path.basename(dataset_dir): {
+            "index": os.path.join(embeddings_dir, "faces.index"),
+            "metadata": os.path.join(embeddings_dir, "metadata"),
+            "dataset": dataset_dir
+        }}
+    unknown = [event for event in events or () if event not in registry]
+    if unknown:
+        sys.exit(f"Unknown events: {', '.join(unknown)} (indexed: {', '.join(registry)})")
+
+    shards = []
+    for event, entry in registry.items():
+        if events and event not in events:
+            continue
+        if os.path.exists(os.path.join(entry["metadata"], "meta.json")):
+            metadata = FaceMetadataStore.open(entry["metadata"])
+        else:
+            metadata = FaceMetadataStore.from_legacy(os.path.join(embeddings_dir, "filenames.npy"))
+        built_with = metadata.build_info.get("model", model_name)
+        if built_with != model_name:
+            sys.exit(f"Shard {event} was built with {built_with}, but FACE_MODEL is {model_name}")
+        exact_vectors = None
+        vectors_path = os.path.join(os.path.dirname(entry["index"]), EXACT_VECTORS_NAME)
+        if os.path.exists(vectors_path):
+            exact_vectors = np.load(vectors_path, mmap_mode="r")
+            if len(exact_vectors) != len(metadata):
+                print(f"Warning: {vectors_path} has {len(exact_vectors)} vectors for {len(metadata)} faces; "
+                      "not re-ranking")
+                exact_vectors = None
+        shards.append(Shard(event, read_index(entry["index"], mmap=True), metadata, entry["dataset"], exact_vectors))
+        print(f"Shard {event}: {shards[-1].index.ntotal} faces")
+    return shards
+
+def list_queries(path):
+    """(query name, file path) pairs; names are relative to the query directory"""
+    if os.path.isfile(path):
+        return [(os.path.basename(path), path)]
+    queries = []
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                filepath = os.path.join(root, filename)
+                queries.append((os.path.relpath(filepath, path), filepath))
+    return queries
+
+def detect_query_face(filepath):
+    """
+    The most confident face in a query image, as (crop, confidence), or
+    (None, error message) if it could not be read or processed.
+    """
+    try:
+        image = resize_image_for_processing(filepath)
+        if image is None:
+            return None, "Could not decode image"
+        faces = DeepFace.extract_faces(pil_to_cv2(image), detector_backend=detector_backend,
+                                       enforce_detection=False)
+        # Ties (e.g. the whole-image fallback) go to the largest face
+        best = max(faces, key=lambda face: (face.get("confidence", 0.0),
+                                            face["facial_area"]["w"] * face["facial_area"]["h"]))
+        return best["face"], float(best.get("confidence", 0.0))
+    except Exception as e:
+        return None, str(e)
+
+def search_batch(shards, queries, k, nprobe, ef_search, rerank_candidates=0):
+    """
+    One search per shard for the whole batch; per query, merged (distances,
+    shard positions, ids). Like /search, shards with exact vectors re-score
+    the top rerank_candidates (if > 0) exactly.
+    """
+    results = []
+    for shard in shards:
+        params = search_parameters(shard.index, nprobe=nprobe, ef_search=ef_search)
+        if shard.exact_vectors is None or rerank_candidates <= 0:
+            results.append(shard.index.search(queries, k=min(k, shard.index.ntotal), params=params))
+            continue
+        _, I = shard.index.search(queries, k=min(max(k, rerank_candidates), shard.index.ntotal), params=params)
+        results.append(rerank(queries, I, shard.exact_vectors, k))
+    return merge_shard_results(results, k)
+
+def format_matches(shards, distances, positions, ids, min_similarity=None):
+    """Match records for one query, best first, one per original photo"""
+    matches = []
+    seen = set()
+    for distance, position, idx in zip(distances, positions, ids):
+        if idx < 0 or (min_similarity is not None and distance < min_similarity):
+            continue
+        shard = shards[position]
+        image_id = int(shard.metadata.image_ids[idx])
+        if image_id < 0 or (shard.event, image_id) in seen:
+            # Removed by an incremental update, or another face in the same photo
+            continue
+        seen.add((shard.event, image_id))
+        original_filename = shard.metadata.image_name(image_id)
+        matches.append({
+            "rank": len(matches) + 1,
+            "event": shard.event,
+            "filename": f"{original_filename}_face{int(shard.metadata.face_indices[idx])}",
+            "original_filename": original_filename,
+            "similarity": round(float(distance), 4),
+            "path": os.path.join(shard.dataset_dir, original_filename),
+            # Near-identical shots collapsed into this photo at build time
+            "duplicates": shard.metadata.duplicates(image_id)
+        })
+    return matches
+
+# === OUTPUT ===
+def output_format(path, requested=None):
+    return requested or ("csv" if path.lower().endswith(".csv") else "jsonl")
+
+def completed_queries(path, fmt):
+    """
+    Queries already written to an output file. A line cut off by an
+    interruption is removed so the resumed run appends cleanly.
+    """
+    if not os.path.exists(path):
+        return set()
+    with open(path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            f.truncate(end)
+    lines = data[:end].decode("utf-8").splitlines()
+    if fmt == "csv":
+        return {row["query"] for row in csv.DictReader(lines)}
+    return {json.loads(line)["query"] for line in lines if line.strip()}
+
+def write_results(f, fmt, results):
+    """Append one batch of (query, face confidence, matches, error) and flush to disk"""
+    if fmt == "csv":
+        writer = csv.DictWriter(f, fieldnames=CSV_COLUMNS)
+        if f.tell() == 0:
+            writer.writeheader()
+        for query, confidence, matches, error in results:
+            if error or not matches:
+                # Keep a row per query so the resume check sees it
+                writer.writerow({"query": query, "face_confidence": confidence, "error": error or ""})
+            for match in matches:
+                writer.writerow(dict(match, query=query, face_confidence=confidence,
+                                     duplicates=";".join(match["duplicates"]), error=""))
+    else:
+        for query, confidence, matches, error in results:
+            record = {"query": query, "face_confidence": confidence, "matches": matches}
+            if error:
+                record["error"] = error
+            f.write(json.dumps(record) + "\n")
+    f.flush()
+    os.fsync(f.fileno())
+
+def run_queries(shards, queries, args, fmt):
+    batches = [queries[i:i + args.batch_size] for i in range(0, len(queries), args.batch_size)]
+    start = time.time()
+    done = 0
+    last_results = []
+
+    with ThreadPoolExecutor(max_workers=args.workers) as pool, \
+            open(args.output, "a", newline="", encoding="utf-8") as f:
+        upcoming = pool.map(detect_query_face, [filepath for _, filepath in batches[0]]) if batches else None
+        for b, batch in enumerate(batches):
+            detected = list(upcoming)
+            if b + 1 < len(batches):
+                # Detect the next batch while this one is embedded and searched
+                upcoming = pool.map(detect_query_face, [filepath for _, filepath in batches[b + 1]])
+
+            found = [pos for pos, (crop, _) in enumerate(detected) if crop is not None]
+            matches = {}
+            if found:
+                try:
+                    embeddings = embed_face_crops([detected[pos][0] for pos in found], model_name)
+                    merged = search_batch(shards, np.ascontiguousarray(embeddings), args.k,
+                                          args.nprobe, args.ef_search, args.rerank_candidates)
+                    for pos, row in zip(found, merged):
+                        matches[pos] = format_matches(shards, *row, min_similarity=args.min_similarity)
+                except Exception as e:
+                    print(f"  Error embedding batch {b + 1}: {e}")
+                    detected = [(None, str(e)) if crop is not None else (crop, info) for crop, info in detected]
+
+            results = []
+            for pos, (query, _) in enumerate(batch):
+                crop, info = detected[pos]
+                if crop is None:
+                    results.append((query, None, [], info))
+                else:
+                    results.append((query, round(info, 4), matches.get(pos, []), None))
+            write_results(f, fmt, results)
+            last_results = results
 
-query_path = "../query.jpg"
-model_name = "ArcFace"
-detector_backend = "mtcnn"
+            done += len(batch)
+            elapsed = time.time() - start
+            print(f"[{done}/{len(queries)}] {elapsed:.1f}s, {done / elapsed:.1f} queries/s")
+    return last_results
 
-# Extract query embedding
-rep = DeepFace.represent(
-    query_path,
-    model_name=model_name,
-    detector_backend=detector_backend,
-    enforce_detection=False
-)[0]["embedding"]
+def parse_args():
+    parser = argparse.ArgumentParser(description="Match a folder of query photos against the face index")
+    parser.add_argument("queries", nargs="?", default=DEFAULT_QUERY_PATH,
+                        help="Query image, or a directory of them (searched recursively)")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT_PATH, help="Results file (.csv or .jsonl)")
+    parser.add_argument("--format", choices=("csv", "jsonl"), default=None,
+                        help="Output format (default: from the output extension)")
+    parser.add_argument("--k", type=int, default=5, help="Faces retrieved per query, before deduplication")
+    parser.add_argument("--min-similarity", type=float, default=None,
+                        help="Drop matches below this cosine similarity")
+    parser.add_argument("--event", action="append", default=None,
+                        help="Only search this event's shard (repeatable; default all)")
+    parser.add_argument("--nprobe", type=int, default=DEFAULT_NPROBE, help="IVF lists to scan")
+    parser.add_argument("--ef-search", type=int, default=DEFAULT_EF_SEARCH, help="HNSW search depth")
+    parser.add_argument("--rerank-candidates", type=int, default=int(os.environ.get("RERANK_CANDIDATES", "0")),
+                        help="Candidates re-scored from vectors.npy, as in the API (default: RERANK_CANDIDATES, 0 = off)")
+    parser.add_argument("--detector", choices=DETECTOR_BACKENDS, default=DETECTOR_BACKEND,
+                        help="Face detector for the query photos")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Decode/detect threads")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Queries embedded and searched together")
+    parser.add_argument("--restart", action="store_true",
+                        help="Overwrite the output file instead of resuming it")
+    return parser.parse_args()
 
-query_emb = np.array(rep).astype("float32")
-query_emb = query_emb / (np.linalg.norm(query_emb) + 1e-10)
+def main():
+    global detector_backend
+    args = parse_args()
+    detector_backend = args.detector
+    fmt = output_format(args.output, args.format)
 
-print("Query norm:", np.linalg.norm(query_emb))
+    queries = list_queries(args.queries)
+    if not queries:
+        sys.exit(f"No query images found in {args.queries}")
+    if args.restart and os.path.exists(args.output):
+        os.remove(args.output)
+    done = completed_queries(args.output, fmt)
+    pending = [(query, filepath) for query, filepath in queries if query not in done]
+    print(f"=== {len(queries)} queries, {len(queries) - len(pending)} already in {args.output} ===")
+    if not pending:
+        return
 
-# Quick sanity check: similarity with first db vector
-sample_embedding = np.load("../embeddings/filenames.npy", allow_pickle=True)
-print("Raw dot with first db vector:", np.dot(query_emb, query_emb))
+    shards = load_shards(args.event)
+    DeepFace.build_model(model_name, task="facial_recognition")
+    results = run_queries(shards, pending, args, fmt)
 
-# Search top-5
-D, I = index.search(query_emb.reshape(1, -1), k=5)
+    if len(queries) == 1 and results:
+        query, confidence, matches, error = results[0]
+        print(f"\n=== Top Matches for {query} ===" if not error else f"\n{query}: {error}")
+        for match in matches:
+            print(f"{match['rank']}. {match['filename']} [{match['event']}] (similarity={match['similarity']:.4f})")
+    print(f"\nResults saved to: {args.output}")
 
-print("\n=== Top Matches ===")
-for rank, idx in enumerate(I[0]):
-    print(f"{rank+1}. {filenames[idx]} (similarity={D[0][rank]:.4f})")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Registry of per-event index shards.
+
+Each event (e.g. convocation-2024) is built into its own directory under
+embeddings/shards/ with the usual faces.index, metadata store and manifest.
+embeddings/shards.json lists the shards the API should load; paths in it
+are relative to the embeddings directory, so the builder (run from src/)
+and the API (run from flask-api/) resolve them the same way.
+
+    {"format": 1, "shards": {"convocation-2024": {
+        "index": "shards/convocation-2024/faces.index",
+        "metadata": "shards/convocation-2024/metadata",
+        "dataset": "../dataset/convocation-2024",
+        "index_type": "IndexFlatIP", "faces": 10234, "images": 3120,
+        "built_at": 1760000000.0}}}
+"""
+import os
+import json
+import time
+
+FORMAT_VERSION = 1
+REGISTRY_NAME = "shards.json"
+SHARDS_DIR = "shards"
+
+def registry_path(embeddings_dir):
+    return os.path.join(embeddings_dir, REGISTRY_NAME)
+
+def shard_dir(embeddings_dir, event):
+    """Directory holding one event's index, metadata store and manifest"""
+    return os.path.join(embeddings_dir, SHARDS_DIR, event)
+
+def load_registry(embeddings_dir):
+    """
+    Registered shards by event name, with paths resolved against the
+    embeddings directory, or None when no registry has been written.
+    """
+    path = registry_path(embeddings_dir)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        registry = json.load(f)
+    if registry.get("format") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported shard registry format: {registry.get('format')}")
+
+    shards = {}
+    for event, entry in registry["shards"].items():
+        shards[event] = dict(entry, **{
+            key: os.path.normpath(os.path.join(embeddings_dir, entry[key]))
+            for key in ("index", "metadata", "dataset")
+        })
+    return shards
+
+def register_shard(embeddings_dir, event, dataset_dir, index_type, faces, images):
+    """Add or update one event's entry; the registry is replaced atomically"""
+    path = registry_path(embeddings_dir)
+    registry = {"format": FORMAT_VERSION, "shards": {}}
+    if os.path.exists(path):
+        with open(path) as f:
+            registry = json.load(f)
+
+    directory = shard_dir(embeddings_dir, event)
+    registry["shards"][event] = {
+        "index": os.path.relpath(os.path.join(directory, "faces.index"), embeddings_dir),
+        "metadata": os.path.relpath(os.path.join(directory, "metadata"), embeddings_dir),
+        "dataset": os.path.relpath(dataset_dir, embeddings_dir),
+        "index_type": index_type,
+        "faces": faces,
+        "images": images,
+        "built_at": time.time()
+    }
+    registry["shards"] = dict(sorted(registry["shards"].items()))
+
+    with open(path + ".tmp", "w") as f:
+        json.dump(registry, f, indent=2)
+    os.replace(path + ".tmp", path)
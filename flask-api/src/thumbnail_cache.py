@@ -0,0 +1,118 @@
+"""
+On-disk cache of resized dataset photos for /download?size=...
+
+Variants are produced with utils.resize_image_for_processing (the same
+Pillow path the builder uses), turned upright per the EXIF orientation tag
+since the saved JPEG carries no EXIF, and saved under a key derived from the
+source file, its size and mtime, and the requested size and quality, so a
+replaced photo never serves a stale variant. The directory is shared by all
+gunicorn workers; when it grows past max_bytes, the least recently used
+files (by mtime, refreshed on every hit) are deleted until it is back under
+90% of the cap.
+"""
+import os
+import hashlib
+import threading
+
+from utils import resize_image_for_processing
+
+class ThumbnailCache:
+    """Resized JPEG variants of dataset photos, bounded by total size. Thread-safe"""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._bytes = None  # Approximate total size, measured on first write
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, source_path, stat, size, quality):
+        # "upright": variants from before EXIF orientation was applied are never served
+        key = hashlib.sha256(
+            f"{os.path.abspath(source_path)}|{stat.st_size}|{stat.st_mtime_ns}|{size}|{quality}|upright".encode()
+        ).hexdigest()
+        return os.path.join(self.directory, key[:2], f"{key}.jpg")
+
+    def get(self, source_path, size, quality):
+        """
+        Path of the resized variant of source_path, creating it if needed.
+        Returns None if the source cannot be decoded.
+        """
+        path = self._path(source_path, os.stat(source_path), size, quality)
+        if os.path.exists(path):
+            try:
+                os.utime(path)  # Mark as recently used
+                with self._lock:
+                    self.hits += 1
+                return path
+            except OSError:
+                pass  # Evicted by another worker in the meantime
+
+        resized = resize_image_for_processing(source_path, max_size=size, exif_transpose=True)
+        if resized is None:
+            return None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        resized.save(tmp_path, format="JPEG", quality=quality, optimize=True)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self.misses += 1
+            if self._bytes is None:
+                self._bytes = self._scan_bytes()
+            else:
+                self._bytes += os.path.getsize(path)
+            over_cap = self._bytes > self.max_bytes
+        if over_cap:
+            self._evict()
+        return path
+
+    def _files(self):
+        """(mtime, size, path) of every cached variant"""
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith(".jpg"):
+                    try:
+                        stat = os.stat(os.path.join(root, name))
+                    except OSError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+        return files
+
+    def _scan_bytes(self):
+        return sum(size for _, size, _ in self._files())
+
+    def _evict(self):
+        """Delete least recently used variants until under 90% of the cap"""
+        with self._lock:
+            # Rescan: other workers add and evict files too
+            files = sorted(self._files())
+            total = sum(size for _, size, _ in files)
+            target = self.max_bytes * 0.9
+            for _, size, path in files:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                    self.evictions += 1
+                except OSError:
+                    pass
+                total -= size
+            self._bytes = total
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "directory": self.directory,
+                "max_bytes": self.max_bytes,
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
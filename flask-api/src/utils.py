@@ -0,0 +1,121 @@
+"""
+Image helpers shared by the index builder and the Flask API, so dataset
+photos and query uploads go through the same preprocessing.
+"""
+import os
+import numpy as np
+from PIL import Image, ImageOps
+import cv2
+
+# Image preprocessing settings
+MAX_IMAGE_SIZE = 800  # Maximum dimension (width or height)
+
+# Recognition model and face detector. Index and queries must use the same
+# model; the API may use a faster detector for queries (QUERY_DETECTOR).
+MODEL_NAME = os.environ.get("FACE_MODEL", "ArcFace")
+DETECTOR_BACKEND = os.environ.get("FACE_DETECTOR", "mtcnn")
+DETECTOR_BACKENDS = ("opencv", "ssd", "dlib", "mtcnn", "retinaface", "mediapipe",
+                     "yolov8", "yunet", "fastmtcnn", "centerface")
+
+def resize_image_for_processing(image_path, max_size=MAX_IMAGE_SIZE, exif_transpose=False):
+    """
+    Resize image for processing without modifying the original file.
+    Accepts a path or a file-like object (e.g. an upload in memory).
+    exif_transpose rotates the pixels upright per the EXIF orientation tag,
+    for output saved without EXIF (the face pipeline leaves it alone so
+    stored boxes keep matching the file).
+    Returns PIL Image object.
+    """
+    try:
+        # Open image with PIL
+        with Image.open(image_path) as img:
+            if exif_transpose:
+                img = ImageOps.exif_transpose(img)
+            # Convert to RGB if necessary (handles RGBA, grayscale, etc.)
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            
+            # Get current dimensions
+            width, height = img.size
+            
+            # Calculate new dimensions while maintaining aspect ratio
+            if width > height:
+                if width > max_size:
+                    new_width = max_size
+                    new_height = int((height * max_size) / width)
+                else:
+                    new_width, new_height = width, height
+            else:
+                if height > max_size:
+                    new_height = max_size
+                    new_width = int((width * max_size) / height)
+                else:
+                    new_width, new_height = width, height
+            
+            # Resize if necessary
+            if new_width != width or new_height != height:
+                img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+                print(f"  Resized from {width}x{height} to {new_width}x{new_height}")
+            else:
+                # Load pixels before the with-block closes the file
+                img = img.copy()
+            
+            return img
+            
+    except Exception as e:
+        print(f"  Error resizing image: {e}")
+        return None
+
+def image_phash(image_path, hash_size=8):
+    """
+    Difference hash of an image as 16 hex digits (64 bits), or None if it
+    cannot be decoded. Survives re-encoding, resizing and small exposure
+    changes; compare hashes by Hamming distance.
+    """
+    try:
+        with Image.open(image_path) as img:
+            # JPEGs decode at a reduced scale; the hash only needs a thumbnail
+            img.draft("L", (hash_size * 32, hash_size * 32))
+            pixels = np.asarray(
+                img.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS),
+                dtype="int16"
+            )
+    except Exception as e:
+        print(f"  Error hashing image: {e}")
+        return None
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    return np.packbits(bits).tobytes().hex()
+
+def pil_to_cv2(pil_image):
+    """Convert PIL Image to OpenCV format for DeepFace"""
+    # Convert PIL RGB to OpenCV BGR
+    opencv_image = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
+    return opencv_image
+
+def normalize_embeddings(embeddings):
+    """L2-normalize embedding rows so inner product equals cosine similarity"""
+    embeddings = np.asarray(embeddings, dtype="float32")
+    return embeddings / (np.linalg.norm(embeddings, axis=-1, keepdims=True) + 1e-10)
+
+# Cached face rows: box (x, y, w, h), detector confidence, then the embedding
+BOX_COLUMNS = 5
+
+def face_box(facial_area, image_shape):
+    """x, y, w, h of a detected face as fractions of the image size"""
+    height, width = image_shape[:2]
+    return (
+        facial_area["x"] / width,
+        facial_area["y"] / height,
+        facial_area["w"] / width,
+        facial_area["h"] / height
+    )
+
+def face_rows(boxes, confidences, embeddings):
+    """Pack per-face boxes, confidences and embeddings into one float32 array"""
+    if not len(boxes):
+        # An image without faces; cached so it is not run through the detector again
+        return np.zeros((0, BOX_COLUMNS), dtype="float32")
+    boxes = np.asarray(boxes, dtype="float32").reshape(-1, 4)
+    confidences = np.asarray(confidences, dtype="float32").reshape(-1, 1)
+    embeddings = np.asarray(embeddings, dtype="float32").reshape(len(boxes), -1)
+    return np.hstack([boxes, confidences, embeddings])
@@ -0,0 +1,11 @@
+"""
+The API's helper modules live in flask-api/src and import each other by
+bare name (they run from that directory), so put it on the path.
+
+Run from flask-api:
+    python -m pytest -q tests
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
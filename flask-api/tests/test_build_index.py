@@ -0,0 +1,267 @@
+import importlib
+import json
+import os
+import sys
+import types
+from pathlib import Path
+
+import faiss
+import numpy as np
+import pytest
+
+from PIL import Image
+
+from detection_cache import DetectionCache
+from embedding_cache import EmbeddingCache
+from index_factory import search_parameters, stored_ids
+
+try:
+    import deepface  # noqa: F401
+except ImportError:
+    # Detection and embedding are stubbed below; build_index only has to import
+    sys.modules["deepface"] = types.SimpleNamespace(DeepFace=None)
+
+DIM = 16
+
+class StubEmbedder:
+    """
+    Stands in for the detector and ArcFace. An image file holds "seed:faces";
+    each face's embedding is a fixed random unit vector of its seed and position.
+    """
+
+    def __init__(self, fail_after=None):
+        self.detected = []
+        self.fail_after = fail_after
+
+    def detect_faces(self, filepath, image_hash):
+        if self.fail_after is not None and len(self.detected) == self.fail_after:
+            raise KeyboardInterrupt
+        self.detected.append(os.path.basename(filepath))
+        with open(filepath) as f:
+            seed, n_faces = map(int, f.read().split(":"))
+        return (100, 100, 3), [
+            {"face": (seed, i), "facial_area": {"x": 10 * i, "y": 0, "w": 10, "h": 10}, "confidence": 0.9}
+            for i in range(n_faces)
+        ]
+
+    def embed_face_crop(self, face_crop, model_name):
+        return face_vector(*face_crop)
+
+    def embed_face_crops(self, face_crops, model_name):
+        return np.array([face_vector(seed, i) for seed, i in face_crops])
+
+def face_vector(seed, i):
+    vector = np.random.default_rng(seed * 100 + i).standard_normal(DIM).astype("float32")
+    return vector / np.linalg.norm(vector)
+
+def write_image(directory, filename, seed, n_faces):
+    (directory / filename).write_text(f"{seed}:{n_faces}")
+
+@pytest.fixture
+def shard(tmp_path, monkeypatch):
+    """build_index pointed at an empty shard under tmp_path"""
+    # The module creates ../embeddings on import
+    (tmp_path / "src").mkdir()
+    monkeypatch.chdir(tmp_path / "src")
+    build_index = importlib.import_module("build_index")
+
+    monkeypatch.setattr(build_index, "output_dir", str(tmp_path / "embeddings"))
+    monkeypatch.setattr(build_index, "dataset_root", str(tmp_path / "dataset"))
+    (tmp_path / "dataset" / "event").mkdir(parents=True)
+    build_index.use_event_shard("event")
+    monkeypatch.setattr(build_index, "model_name", "ArcFace")
+    monkeypatch.setattr(build_index, "detector_backend", "mtcnn")
+    return build_index
+
+@pytest.fixture
+def build(shard, monkeypatch):
+    """The shard's build_index with the stub embedder"""
+    use_embedder(shard, monkeypatch, StubEmbedder())
+    return shard
+
+def use_embedder(build_index, monkeypatch, embedder):
+    """Swap in a stub embedder, with an empty embedding cache so every image reaches it"""
+    monkeypatch.setattr(build_index, "embedding_cache", EmbeddingCache())
+    monkeypatch.setattr(build_index, "detect_faces", embedder.detect_faces)
+    monkeypatch.setattr(build_index, "embed_face_crop", embedder.embed_face_crop)
+    monkeypatch.setattr(build_index, "embed_face_crops", embedder.embed_face_crops)
+    return embedder
+
+def parse_args(build_index, monkeypatch, *argv):
+    monkeypatch.setattr(sys, "argv", ["build_index.py", *argv])
+    return build_index.parse_args()
+
+def dataset(build_index):
+    directory = Path(build_index.dataset_dir)
+    for n in range(5):
+        write_image(directory, f"img{n}.jpg", seed=n, n_faces=n % 3 + 1)
+    return directory
+
+def built_vectors(build_index):
+    index = faiss.read_index(build_index.index_path)
+    return index.reconstruct_n(0, index.ntotal)
+
+def test_full_build_assembles_chunks_in_order(build, monkeypatch):
+    dataset(build)
+    hashed = []
+    file_content_hash = build.file_content_hash
+    monkeypatch.setattr(build, "file_content_hash", lambda path: hashed.append(path) or file_content_hash(path))
+
+    index, manifest = build.build_full_index(parse_args(build, monkeypatch, "--chunk-images", "2"))
+
+    records = build.load_metadata_records()
+    assert index.ntotal == len(records) == 1 + 2 + 3 + 1 + 2
+    for filename, entry in manifest.items():
+        seed = int(filename[3])
+        assert [records[face_id]['original_filename'] for face_id in entry['face_ids']] == [filename] * (seed % 3 + 1)
+        expected = [face_vector(seed, i) for i in range(seed % 3 + 1)]
+        np.testing.assert_allclose(built_vectors(build)[entry['face_ids']], expected, rtol=1e-6)
+    # Fingerprints reuse the hash of the cache lookup
+    assert len(hashed) == len(manifest) == 5
+    assert not os.path.exists(build.checkpoint_dir)
+
+def test_interrupted_build_resumes_from_checkpoint(build, monkeypatch):
+    dataset(build)
+    args = parse_args(build, monkeypatch, "--chunk-images", "2")
+    use_embedder(build, monkeypatch, StubEmbedder(fail_after=3))
+    with pytest.raises(KeyboardInterrupt):
+        build.build_full_index(args)
+    with open(os.path.join(build.checkpoint_dir, build.CHECKPOINT_NAME)) as f:
+        assert len(json.load(f)['chunks']) == 1
+
+    embedder = use_embedder(build, monkeypatch, StubEmbedder())
+    build.build_full_index(args)
+    assert len(embedder.detected) == 3
+    resumed = built_vectors(build), build.load_manifest()
+
+    use_embedder(build, monkeypatch, StubEmbedder())
+    build.build_full_index(parse_args(build, monkeypatch, "--chunk-images", "2", "--restart"))
+    np.testing.assert_array_equal(resumed[0], built_vectors(build))
+    assert ({f: e['face_ids'] for f, e in resumed[1].items()}
+            == {f: e['face_ids'] for f, e in build.load_manifest().items()})
+
+def test_checkpoint_with_other_settings_is_discarded(build, monkeypatch):
+    dataset(build)
+    use_embedder(build, monkeypatch, StubEmbedder(fail_after=3))
+    with pytest.raises(KeyboardInterrupt):
+        build.build_full_index(parse_args(build, monkeypatch, "--chunk-images", "2"))
+    assert build.load_checkpoint()['chunks'] == ["chunk_00000"]
+
+    monkeypatch.setattr(build, "model_name", "Facenet512")
+    checkpoint = build.load_checkpoint()
+    assert checkpoint['chunks'] == []
+    assert checkpoint['settings']['model_name'] == "Facenet512"
+    assert os.listdir(build.checkpoint_dir) == [build.CHECKPOINT_NAME]
+
+@pytest.mark.parametrize("index_args", [("--index-type", "flat"), ("--index-type", "ivf-flat", "--nlist", "2")])
+def test_incremental_update_follows_the_dataset(build, monkeypatch, index_args):
+    directory = dataset(build)
+    build.build_full_index(parse_args(build, monkeypatch, *index_args))
+    before = build.load_manifest()
+
+    write_image(directory, "img1.jpg", seed=11, n_faces=2)   # Changed
+    os.remove(directory / "img2.jpg")                        # Deleted
+    write_image(directory, "img5.jpg", seed=5, n_faces=1)    # New
+    stat = os.stat(directory / "img3.jpg")                   # Touched, same content
+    os.utime(directory / "img3.jpg", (stat.st_atime, stat.st_mtime + 10))
+    embedder = use_embedder(build, monkeypatch, StubEmbedder())
+
+    index, manifest = build.update_index_incrementally(parse_args(build, monkeypatch, "--incremental"))
+
+    assert sorted(embedder.detected) == ["img1.jpg", "img5.jpg"]
+    assert sorted(manifest) == ["img0.jpg", "img1.jpg", "img3.jpg", "img4.jpg", "img5.jpg"]
+    for filename in ("img0.jpg", "img3.jpg", "img4.jpg"):
+        assert manifest[filename]['face_ids'] == before[filename]['face_ids']
+    assert manifest["img3.jpg"]['mtime'] == stat.st_mtime + 10
+
+    # Stale faces keep empty rows; new ones are numbered after all earlier ids
+    records = build.load_metadata_records()
+    for face_id in before["img1.jpg"]['face_ids'] + before["img2.jpg"]['face_ids']:
+        assert records[face_id] is None
+    assert sorted(manifest["img1.jpg"]['face_ids'] + manifest["img5.jpg"]['face_ids']) == [9, 10, 11]
+    assert len(records) == 12
+
+    # The index holds exactly the manifest's faces, each found under its own id
+    index = faiss.read_index(build.index_path)
+    live = sorted(face_id for entry in manifest.values() for face_id in entry['face_ids'])
+    assert sorted(stored_ids(index).tolist()) == live
+    seeds = {"img0.jpg": 0, "img1.jpg": 11, "img3.jpg": 3, "img4.jpg": 4, "img5.jpg": 5}
+    for filename, entry in manifest.items():
+        queries = np.array([face_vector(seeds[filename], i) for i in range(len(entry['face_ids']))])
+        _, ids = index.search(queries, 1, params=search_parameters(index, nprobe=2))
+        assert ids[:, 0].tolist() == entry['face_ids']
+
+class StubDetector:
+    """Stands in for DeepFace.extract_faces: one face per image, its crop the image's red level"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def extract_faces(self, image, detector_backend, enforce_detection):
+        self.calls += 1
+        # OpenCV order: red is the last channel
+        crop = np.full((4, 4, 3), image[0, 0, 2] / 255, dtype="float32")
+        return [{"face": crop, "facial_area": {"x": 1, "y": 2, "w": 3, "h": 4}, "confidence": 0.8}]
+
+class CropEmbedder:
+    """Embeds StubDetector crops by their level, recording the crops of each call"""
+
+    def __init__(self):
+        self.crops_per_call = []
+
+    def embed_face_crop(self, crop, model_name):
+        self.crops_per_call.append(1)
+        return face_vector(int(round(crop[0, 0, 0] * 255)), 0)
+
+    def embed_face_crops(self, crops, model_name):
+        self.crops_per_call.append(len(crops))
+        return np.array([face_vector(int(round(crop[0, 0, 0] * 255)), 0) for crop in crops])
+
+def image_dataset(build_index, monkeypatch):
+    """Real images for the decode path, with the stub detector and crop embedder"""
+    for n in range(3):
+        Image.new("RGB", (40, 30), (50 * n, 0, 0)).save(Path(build_index.dataset_dir) / f"img{n}.png")
+    detector, embedder = StubDetector(), CropEmbedder()
+    monkeypatch.setattr(build_index, "DeepFace", detector)
+    monkeypatch.setattr(build_index, "embed_face_crop", embedder.embed_face_crop)
+    monkeypatch.setattr(build_index, "embed_face_crops", embedder.embed_face_crops)
+    return detector, embedder
+
+def test_serial_build_embeds_one_crop_per_call(shard, monkeypatch):
+    _, embedder = image_dataset(shard, monkeypatch)
+    shard.build_full_index(parse_args(shard, monkeypatch))
+    assert embedder.crops_per_call == [1, 1, 1]
+    serial = built_vectors(shard)
+
+    # --pipeline batches crops; with an exact embedder the index is the same
+    monkeypatch.setattr(shard, "embedding_cache", EmbeddingCache())
+    embedder.crops_per_call.clear()
+    shard.build_full_index(parse_args(shard, monkeypatch, "--pipeline", "--batch-size", "2"))
+    assert max(embedder.crops_per_call) == 2
+    np.testing.assert_array_equal(built_vectors(shard), serial)
+
+@pytest.mark.parametrize("mode", [(), ("--pipeline", "--workers", "2", "--batch-size", "2")])
+def test_detections_are_reused_across_models(shard, monkeypatch, tmp_path, mode):
+    detector, embedder = image_dataset(shard, monkeypatch)
+    monkeypatch.setattr(shard, "detection_cache", DetectionCache(str(tmp_path / "detections")))
+    args = parse_args(shard, monkeypatch, *mode)
+
+    def rebuild():
+        monkeypatch.setattr(shard, "embedding_cache", EmbeddingCache())
+        shard.build_full_index(args)
+        return built_vectors(shard)
+
+    first = rebuild()
+    assert detector.calls == 3
+
+    # Another recognition model re-embeds the cached crops without detecting again
+    monkeypatch.setattr(shard, "model_name", "Facenet512")
+    np.testing.assert_array_equal(rebuild(), first)
+    assert detector.calls == 3
+    assert sum(embedder.crops_per_call) == 6
+    assert shard.detection_cache.stats()["hits"] == 3
+
+    # Another detector does not match the cached detections
+    monkeypatch.setattr(shard, "detector_backend", "retinaface")
+    rebuild()
+    assert detector.calls == 6
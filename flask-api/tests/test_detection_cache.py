@@ -0,0 +1,44 @@
+import numpy as np
+
+from detection_cache import DetectionCache
+
+def detected_face(level, landmarks=True):
+    """A face like DeepFace.extract_faces returns, its crop made of 8-bit levels"""
+    facial_area = {"x": 10, "y": 20, "w": 30, "h": 40}
+    if landmarks:
+        facial_area.update(left_eye=(15, 25), right_eye=(30, 26))
+    crop = (np.arange(2 * 3 * 3).reshape(2, 3, 3) + level) / 255
+    return {"face": crop, "facial_area": facial_area, "confidence": 0.99}
+
+def test_round_trip_keeps_crops_boxes_and_landmarks(tmp_path):
+    cache = DetectionCache(str(tmp_path))
+    faces = [detected_face(0), detected_face(100, landmarks=False)]
+    cache.put("ab12", (600, 800, 3), faces)
+
+    image_shape, cached = cache.get("ab12")
+
+    assert image_shape == (600, 800, 3)
+    assert [face["facial_area"] for face in cached] == [face["facial_area"] for face in faces]
+    for face, original in zip(cached, faces):
+        assert face["face"].dtype == np.float32
+        np.testing.assert_allclose(face["face"], original["face"], atol=1e-7)
+        assert abs(face["confidence"] - 0.99) < 1e-6
+
+def test_image_without_faces_is_cached(tmp_path):
+    cache = DetectionCache(str(tmp_path))
+    cache.put("cd34", (10, 10, 3), [])
+    assert cache.get("cd34") == ((10, 10, 3), [])
+
+def test_missing_or_unreadable_entries_are_misses(tmp_path):
+    cache = DetectionCache(str(tmp_path))
+    cache.put("ef56", (10, 10, 3), [detected_face(0)])
+    with open(cache._disk_path("ef56"), "wb") as f:
+        f.write(b"truncated")
+
+    assert cache.get("ef56") is None
+    assert cache.get("0000") is None
+    cache.put("ef56", (10, 10, 3), [detected_face(0)])
+    assert cache.get("ef56") is not None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+    assert cache.stats()["hit_rate"] == round(1 / 3, 4)
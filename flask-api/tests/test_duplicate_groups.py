@@ -0,0 +1,41 @@
+import numpy as np
+
+from duplicate_groups import duplicate_groups, hash_pairs, same_faces
+
+def unit(*rows):
+    rows = np.array(rows, dtype="float32")
+    return rows / np.linalg.norm(rows, axis=1, keepdims=True)
+
+def test_hash_pairs_within_distance():
+    phashes = ["0000000000000000", "0000000000000007", "ffffffffffffffff", "000000000000003f"]
+
+    pairs = {tuple(pair) for pair in hash_pairs(phashes, max_distance=3).tolist()}
+
+    # 3 bits apart is included, 6 bits apart is not
+    assert pairs == {(0, 1), (1, 3)}
+
+def test_same_faces_needs_a_one_to_one_pairing():
+    a = unit([1, 0, 0], [0, 1, 0])
+    assert same_faces(a, a[::-1], 0.9)
+    assert not same_faces(a, unit([1, 0, 0], [1, 0.01, 0]), 0.9)  # Both match the first face
+    assert not same_faces(a, a[:1], 0.9)
+    assert not same_faces(a[:0], a[:0], 0.9)  # Photos without faces are never duplicates
+
+def test_groups_need_close_hashes_and_matching_faces():
+    faces = {
+        0: unit([1, 0, 0]),
+        1: unit([1, 0.05, 0]),   # Burst shot of photo 0
+        2: unit([0, 1, 0]),      # Same framing, someone else
+        3: unit([1, 0.02, 0]),   # Same person, different photo
+        4: unit([1, 0.04, 0]),   # Chained to 1 through its hash
+    }
+    phashes = ["0000000000000000", "0000000000000001", "0000000000000003",
+               "ffffffffffffffff", "0000000000000005"]
+
+    groups = duplicate_groups(phashes, faces.__getitem__, max_distance=2, min_similarity=0.99)
+
+    assert groups == [[0, 1, 4]]
+
+def test_no_images():
+    assert duplicate_groups([], lambda position: None) == []
+    assert hash_pairs([], 10).shape == (0, 2)
@@ -0,0 +1,47 @@
+import os
+import numpy as np
+
+from embedding_cache import EmbeddingCache
+
+def rows(n, dim=8):
+    return np.full((n, dim), n, dtype="float32")
+
+def test_memory_lru_evicts_least_recently_used():
+    cache = EmbeddingCache(max_entries=2)
+    cache.put("a", rows(1))
+    cache.put("b", rows(2))
+    cache.get("a")
+    cache.put("c", rows(3))
+    assert cache.get("b") is None
+    np.testing.assert_array_equal(cache.get("a"), rows(1))
+    assert cache.stats()["entries"] == 2
+
+def test_disk_store_is_shared_between_instances(tmp_path):
+    EmbeddingCache(disk_dir=str(tmp_path)).put("key", rows(2))
+    other = EmbeddingCache(disk_dir=str(tmp_path))
+    np.testing.assert_array_equal(other.get("key"), rows(2))
+    assert other.stats()["disk_hits"] == 1
+
+def test_disk_write_failure_keeps_the_entry_in_memory(tmp_path):
+    cache = EmbeddingCache(disk_dir=str(tmp_path))
+    # A file where the store expects a directory makes every write fail
+    blocker = tmp_path / "blocker"
+    blocker.write_text("")
+    cache.disk_dir = str(blocker)
+    cache.put("key", rows(1))
+    np.testing.assert_array_equal(cache.get("key"), rows(1))
+    assert cache.stats()["disk_errors"] == 1
+
+def test_disk_store_evicts_least_recently_used_past_the_cap(tmp_path):
+    probe = EmbeddingCache(disk_dir=str(tmp_path / "probe"))
+    probe.put("probe", rows(4))
+    entry_bytes = os.path.getsize(probe._disk_path("probe"))
+    cache = EmbeddingCache(max_entries=1, disk_dir=str(tmp_path / "store"), max_disk_bytes=entry_bytes * 5)
+    for i in range(6):
+        cache.put(f"key{i}", rows(4))
+        path = cache._disk_path(f"key{i}")
+        os.utime(path, (i, i))  # Distinct, increasing last-use times
+    stored = [f"key{i}" for i in range(6) if os.path.exists(cache._disk_path(f"key{i}"))]
+    assert "key0" not in stored and "key5" in stored
+    assert cache.stats()["evictions"] >= 1
+    assert sum(os.path.getsize(cache._disk_path(key)) for key in stored) <= entry_bytes * 5
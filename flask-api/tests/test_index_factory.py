@@ -0,0 +1,147 @@
+import faiss
+import numpy as np
+import pytest
+
+from index_factory import (
+    MAX_EF_SEARCH, MAX_NPROBE, create_index, merge_shard_results, rerank, search_parameters, stored_ids,
+    unwrap_id_mapped_ivf
+)
+
+def load_for_update(index):
+    """Like build_index.load_id_mapped_index: plain flat indexes get an id map"""
+    if isinstance(index, faiss.IndexFlat):
+        wrapped = faiss.IndexIDMap2(faiss.IndexFlatIP(index.d))
+        wrapped.add_with_ids(index.reconstruct_n(0, index.ntotal), np.arange(index.ntotal, dtype="int64"))
+        return wrapped
+    return index
+
+def test_merge_orders_rows_across_shards_best_first():
+    # Two queries; each shard returns its own top 2 per query
+    shard_a = (np.array([[0.9, 0.5], [0.4, 0.3]]), np.array([[10, 11], [12, 13]]))
+    shard_b = (np.array([[0.7, 0.6], [0.8, 0.1]]), np.array([[20, 21], [22, 23]]))
+
+    merged = merge_shard_results([shard_a, shard_b], limit=3)
+
+    distances, positions, ids = merged[0]
+    np.testing.assert_allclose(distances, [0.9, 0.7, 0.6])
+    assert positions.tolist() == [0, 1, 1]
+    assert ids.tolist() == [10, 20, 21]
+    distances, positions, ids = merged[1]
+    np.testing.assert_allclose(distances, [0.8, 0.4, 0.3])
+    assert positions.tolist() == [1, 0, 0]
+    assert ids.tolist() == [22, 12, 13]
+
+def test_merge_of_threshold_rows_with_different_lengths():
+    # Range search rows are ragged; a shard may have no match for a query
+    shard_a = ([np.array([0.6]), np.array([], dtype="float32")], [np.array([1]), np.array([], dtype="int64")])
+    shard_b = ([np.array([0.9, 0.7]), np.array([0.75])], [np.array([5, 6]), np.array([7])])
+
+    merged = merge_shard_results([shard_a, shard_b], limit=10)
+
+    assert merged[0][2].tolist() == [5, 6, 1]
+    assert merged[0][1].tolist() == [1, 1, 0]
+    assert merged[1][2].tolist() == [7]
+
+def test_merge_ties_keep_shard_order():
+    shard_a = (np.array([[0.5]]), np.array([[1]]))
+    shard_b = (np.array([[0.5]]), np.array([[2]]))
+
+    distances, positions, ids = merge_shard_results([shard_a, shard_b], limit=2)[0]
+
+    assert positions.tolist() == [0, 1]
+    assert ids.tolist() == [1, 2]
+
+def test_rerank_orders_candidates_by_exact_similarity():
+    vectors = np.eye(4, dtype="float32")
+    vectors[3] = [0.6, 0.8, 0.0, 0.0]
+    queries = np.array([[1.0, 0.0, 0.0, 0.0], [0.0, 1.0, 0.0, 0.0]], dtype="float32")
+    # Candidates as an approximate index might return them, with padding
+    candidates = np.array([[2, 3, 0, -1], [0, -1, 3, 1]])
+
+    D, I = rerank(queries, candidates, vectors, k=3)
+
+    assert I.tolist() == [[0, 3, 2], [1, 3, 0]]
+    np.testing.assert_allclose(D, [[1.0, 0.6, 0.0], [1.0, 0.8, 0.0]], atol=1e-6)
+
+def test_rerank_pads_with_minus_one():
+    vectors = np.eye(2, dtype="float32")
+
+    D, I = rerank(vectors[:1], np.array([[1, -1, -1]]), vectors, k=3)
+
+    assert I.tolist() == [[1, -1, -1]]
+    assert D[0, 0] == 0.0
+
+def test_rerank_reads_memory_mapped_vectors(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((50, 8)).astype("float32")
+    np.save(tmp_path / "vectors.npy", vectors)
+    mapped = np.load(tmp_path / "vectors.npy", mmap_mode="r")
+    candidates = rng.permutation(50)[None, :20]
+
+    D, I = rerank(vectors[:1], candidates, mapped, k=5)
+
+    scores = vectors[candidates[0]] @ vectors[0]
+    assert I[0].tolist() == candidates[0][np.argsort(-scores)[:5]].tolist()
+
+def normalized_vectors(n, dim=32, seed=0):
+    vectors = np.random.default_rng(seed).standard_normal((n, dim)).astype("float32")
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf-flat", "sq-fp16"])
+def test_search_after_removing_ids_returns_the_right_faces(index_type):
+    vectors = normalized_vectors(2000)
+    index = load_for_update(create_index(vectors, index_type, nlist=8))
+
+    index.remove_ids(np.arange(5, dtype="int64"))
+    index.add_with_ids(vectors[:2], np.array([2000, 2001], dtype="int64"))
+    _, I = index.search(vectors[100:110], 1, params=search_parameters(index, nprobe=8))
+
+    assert I.ravel().tolist() == list(range(100, 110))
+    assert sorted(stored_ids(index).tolist()) == list(range(5, 2002))
+
+def test_ivf_pq_keeps_ids_in_its_lists():
+    vectors = normalized_vectors(300)
+    index = create_index(vectors, "ivf-pq", nlist=2, pq_m=2)
+    assert isinstance(index, faiss.IndexIVF)
+
+    index.remove_ids(np.arange(5, dtype="int64"))
+
+    assert sorted(stored_ids(index).tolist()) == list(range(5, 300))
+
+def id_mapped_ivf(vectors):
+    """An IVF index wrapped in an IndexIDMap2, as earlier builds wrote them"""
+    ivf = faiss.IndexIVFFlat(faiss.IndexFlatIP(vectors.shape[1]), vectors.shape[1], 8, faiss.METRIC_INNER_PRODUCT)
+    ivf.train(vectors)
+    index = faiss.IndexIDMap2(ivf)
+    index.add_with_ids(vectors, np.arange(len(vectors), dtype="int64") + 1000)
+    return faiss.deserialize_index(faiss.serialize_index(index))
+
+def test_unwrap_id_mapped_ivf_moves_ids_into_the_lists():
+    vectors = normalized_vectors(1000)
+
+    index = unwrap_id_mapped_ivf(id_mapped_ivf(vectors))
+    index.remove_ids(np.arange(1000, 1005, dtype="int64"))
+    _, I = index.search(vectors[100:110], 1, params=faiss.SearchParametersIVF(nprobe=8))
+
+    assert isinstance(index, faiss.IndexIVFFlat)
+    assert I.ravel().tolist() == list(range(1100, 1110))
+
+def test_unwrap_id_mapped_ivf_refuses_an_index_already_updated_through_its_map():
+    index = id_mapped_ivf(normalized_vectors(1000))
+    index.remove_ids(np.arange(1000, 1005, dtype="int64"))
+
+    with pytest.raises(ValueError):
+        unwrap_id_mapped_ivf(index)
+
+@pytest.mark.parametrize("nprobe, ef_search", [(0, 64), (-3, 64), (16, 0), (16, -1), (MAX_NPROBE + 1, 64),
+                                               (16, MAX_EF_SEARCH + 1)])
+def test_search_parameters_reject_out_of_range_settings(nprobe, ef_search):
+    index = create_index(normalized_vectors(100), "hnsw", hnsw_m=8)
+    with pytest.raises(ValueError):
+        search_parameters(index, nprobe=nprobe, ef_search=ef_search)
+
+def test_search_parameters_by_index_type():
+    vectors = normalized_vectors(400)
+    assert search_parameters(create_index(vectors, "flat")) is None
+    assert search_parameters(create_index(vectors, "ivf-flat", nlist=4), nprobe=3).nprobe == 3
+    assert search_parameters(create_index(vectors, "hnsw", hnsw_m=8), ef_search=7).efSearch == 7
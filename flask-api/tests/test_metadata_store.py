@@ -0,0 +1,107 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from metadata_store import FaceMetadataStore, face_record, stage_metadata_store, write_clusters
+
+def write_store(directory, records, build_info=None, duplicates=None):
+    for tmp_path, path in stage_metadata_store(str(directory), records, build_info, duplicates):
+        os.replace(tmp_path, path)
+    return FaceMetadataStore.open(str(directory))
+
+RECORDS = [
+    face_record("IMG_0001.jpg", 1, (0.1, 0.2, 0.3, 0.4), 0.99),
+    face_record("IMG_0001.jpg", 2, (0.5, 0.5, 0.2, 0.2), 0.9),
+    None,  # Removed face
+    face_record("Dîplôme été.jpg", 1, (0.0, 0.0, 1.0, 1.0), 0.75),
+]
+
+def test_round_trip(tmp_path):
+    store = write_store(tmp_path, RECORDS, {"model": "ArcFace", "detector": "mtcnn"})
+
+    assert len(store) == 4
+    assert store.build_info == {"model": "ArcFace", "detector": "mtcnn"}
+    for face_id, record in enumerate(RECORDS):
+        loaded = store.record(face_id)
+        if record is None:
+            assert loaded is None
+            continue
+        assert loaded["original_filename"] == record["original_filename"]
+        assert loaded["face_index"] == record["face_index"]
+        np.testing.assert_allclose(loaded["box"], record["box"], rtol=1e-6)
+        assert loaded["confidence"] == pytest.approx(record["confidence"])
+    assert store.filename(1) == "IMG_0001.jpg_face2"
+    assert store.filename(2) == ""
+    # Both faces of a photo share one interned name
+    assert store.image_ids[0] == store.image_ids[1]
+    assert isinstance(store.image_ids, np.memmap)
+
+def test_no_staged_files_remain(tmp_path):
+    write_store(tmp_path, RECORDS)
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+def test_empty_store(tmp_path):
+    store = write_store(tmp_path, [])
+    assert len(store) == 0
+    assert store.records() == []
+
+def test_incomplete_store_is_rejected(tmp_path):
+    write_store(tmp_path, RECORDS)
+    with open(tmp_path / "meta.json") as f:
+        meta = json.load(f)
+    meta["faces"] += 1
+    with open(tmp_path / "meta.json", "w") as f:
+        json.dump(meta, f)
+
+    with pytest.raises(ValueError):
+        FaceMetadataStore.open(str(tmp_path))
+
+def test_from_legacy_filenames(tmp_path):
+    path = str(tmp_path / "filenames.npy")
+    np.save(path, np.array(["a.jpg_face1", "a.jpg_face2", "", "b.jpg"], dtype=object), allow_pickle=True)
+
+    store = FaceMetadataStore.from_legacy(path)
+
+    assert [store.filename(face_id) for face_id in range(4)] == ["a.jpg_face1", "a.jpg_face2", "", "b.jpg_face1"]
+
+def test_write_clusters_groups_faces_by_cluster(tmp_path):
+    write_store(tmp_path, RECORDS)
+
+    write_clusters(str(tmp_path), [1, 0, -1, 1], {"threshold": 0.6})
+    store = FaceMetadataStore.open(str(tmp_path))
+
+    assert store.clusters == {"threshold": 0.6, "clusters": 2, "clustered_faces": 3}
+    assert store.cluster_ids.tolist() == [1, 0, -1, 1]
+    assert store.cluster_members(0).tolist() == [1]
+    assert store.cluster_members(1).tolist() == [0, 3]
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+def test_write_clusters_rejects_a_wrong_face_count(tmp_path):
+    write_store(tmp_path, RECORDS)
+    with pytest.raises(ValueError):
+        write_clusters(str(tmp_path), [0, 0], {})
+    assert FaceMetadataStore.open(str(tmp_path)).clusters == {}
+
+def test_rebuild_retires_clusters(tmp_path):
+    write_store(tmp_path, RECORDS)
+    write_clusters(str(tmp_path), [0, 0, -1, 0], {})
+
+    store = write_store(tmp_path, RECORDS[:2])
+
+    assert store.clusters == {}
+    assert store.cluster_ids is None
+
+def test_collapsed_duplicates_are_listed_under_their_representative(tmp_path):
+    store = write_store(tmp_path, RECORDS, duplicates={"IMG_0001.jpg": ["IMG_0002.jpg", "IMG_0003.jpg"]})
+
+    assert store.duplicates(int(store.image_ids[0])) == ["IMG_0002.jpg", "IMG_0003.jpg"]
+    assert store.duplicates(int(store.image_ids[3])) == []
+    # Collapsed photos have names but no faces
+    assert len(store) == len(RECORDS)
+
+def test_store_without_duplicates(tmp_path):
+    store = write_store(tmp_path, RECORDS)
+    assert store.duplicate_ids is None
+    assert store.duplicates(0) == []
@@ -0,0 +1,58 @@
+import subprocess
+import sys
+
+from prometheus_client import Counter
+
+import metrics
+from metrics import StageTimer
+
+WORKER = """
+import os
+from prometheus_client import Counter, Gauge
+Counter("test_requests", "Requests", ("endpoint",)).labels(endpoint="/search").inc({count})
+Gauge("test_faces", "Faces", multiprocess_mode="livemax").set({faces})
+print(os.getpid())
+"""
+
+def run_worker(directory, count, faces):
+    """Record samples from a separate process, as a gunicorn worker would; returns its pid"""
+    env = {"PROMETHEUS_MULTIPROC_DIR": str(directory), "PATH": ""}
+    result = subprocess.run([sys.executable, "-c", WORKER.format(count=count, faces=faces)],
+                            env=env, check=True, capture_output=True, text=True)
+    return int(result.stdout)
+
+def test_render_aggregates_workers(tmp_path, monkeypatch):
+    pids = [run_worker(tmp_path, 2, 10), run_worker(tmp_path, 3, 40)]
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+
+    lines = metrics.render().decode().splitlines()
+    assert 'test_requests_total{endpoint="/search"} 5.0' in lines
+    assert "test_faces 40.0" in lines
+
+    # Exited workers keep counting towards counters but not live gauges
+    for pid in pids:
+        metrics.mark_worker_dead(pid)
+    lines = metrics.render().decode().splitlines()
+    assert 'test_requests_total{endpoint="/search"} 5.0' in lines
+    assert not any(line.startswith("test_faces ") for line in lines)
+
+def test_render_single_process(monkeypatch):
+    monkeypatch.delenv("PROMETHEUS_MULTIPROC_DIR", raising=False)
+    Counter("test_single_requests", "Requests").inc(2)
+
+    assert "test_single_requests_total 2.0" in metrics.render().decode().splitlines()
+
+def test_mark_worker_dead_without_directory_is_a_no_op(monkeypatch):
+    monkeypatch.delenv("PROMETHEUS_MULTIPROC_DIR", raising=False)
+    metrics.mark_worker_dead(12345)
+
+def test_server_timing():
+    timer = StageTimer()
+    timer.record("read", 0.0015)
+    with timer.stage("search"):
+        pass
+
+    assert [name for name, _ in timer.stages] == ["read", "search"]
+    assert timer.server_timing().startswith("read;dur=1.5, search;dur=")
+    assert timer.server_timing(total=0.25).endswith(", total;dur=250.0")
+    assert len(timer.stages) == 2
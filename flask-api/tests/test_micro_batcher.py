@@ -0,0 +1,110 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import pytest
+
+from micro_batcher import MicroBatcher, process_groups
+
+def submit_concurrently(batcher, items, timeout=5):
+    with ThreadPoolExecutor(max_workers=len(items)) as pool:
+        futures = [pool.submit(batcher.submit, item, timeout) for item in items]
+        outcomes = []
+        for future in futures:
+            try:
+                outcomes.append(future.result())
+            except Exception as e:
+                outcomes.append(e)
+        return outcomes
+
+def test_concurrent_items_are_batched_and_answered_in_order():
+    batches = []
+
+    def double(items):
+        batches.append(list(items))
+        return [item * 2 for item in items]
+
+    batcher = MicroBatcher(double, max_batch_size=8, max_wait_ms=200)
+    assert submit_concurrently(batcher, list(range(8))) == [i * 2 for i in range(8)]
+    assert sorted(item for batch in batches for item in batch) == list(range(8))
+    assert len(batches) < 8
+    assert batcher.stats()["requests"] == 8
+
+def test_batch_size_is_capped():
+    sizes = []
+    batcher = MicroBatcher(lambda items: sizes.append(len(items)) or list(items),
+                           max_batch_size=3, max_wait_ms=100)
+    submit_concurrently(batcher, list(range(7)))
+    assert max(sizes) <= 3 and sum(sizes) == 7
+
+def test_exception_result_fails_only_its_own_caller():
+    batcher = MicroBatcher(lambda items: [ValueError(item) if item == 2 else item for item in items],
+                           max_wait_ms=100)
+    outcomes = submit_concurrently(batcher, [1, 2, 3])
+    assert outcomes[0] == 1 and outcomes[2] == 3
+    assert isinstance(outcomes[1], ValueError)
+
+def test_exception_in_process_batch_fails_every_caller():
+    def fail(items):
+        raise RuntimeError("boom")
+
+    outcomes = submit_concurrently(MicroBatcher(fail, max_wait_ms=50), [1, 2])
+    assert all(isinstance(outcome, RuntimeError) for outcome in outcomes)
+
+def test_short_result_list_fails_the_items_left_out():
+    batcher = MicroBatcher(lambda items: list(items)[:1], max_wait_ms=200)
+    outcomes = submit_concurrently(batcher, [1, 2, 3])
+    errors = [outcome for outcome in outcomes if isinstance(outcome, RuntimeError)]
+    answered = [outcome for outcome in outcomes if not isinstance(outcome, Exception)]
+    # One answer per batch; the rest get an error instead of waiting forever
+    assert len(errors) + len(answered) == 3 and errors and answered
+    assert all("results for" in str(error) for error in errors)
+
+def test_timed_out_item_raises_and_is_skipped():
+    release = threading.Event()
+    processed = []
+
+    def slow(items):
+        processed.extend(items)
+        release.wait(5)
+        return list(items)
+
+    batcher = MicroBatcher(slow, max_batch_size=1)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        first = pool.submit(batcher.submit, "first", 5)
+        with pytest.raises(TimeoutError):
+            # Queued behind "first", which holds the batch thread
+            batcher.submit("second", timeout=0.2)
+        release.set()
+        assert first.result() == "first"
+    assert batcher.submit("third", timeout=5) == "third"
+    assert "second" not in processed
+    assert batcher.stats()["timeouts"] == 1
+
+def search_by_setting(items, results=None):
+    """Like the API's process_search_batch: one search per distinct nprobe; nprobe 0 fails"""
+    def search_group(nprobe, positions):
+        if nprobe == 0:
+            raise RuntimeError("nprobe must be positive")
+        return [(nprobe, items[pos]["query"]) for pos in positions]
+    return process_groups(items, results or [None] * len(items), lambda item: item["nprobe"], search_group)
+
+def test_failing_group_only_fails_its_own_items():
+    items = [{"nprobe": 16, "query": "a"}, {"nprobe": 0, "query": "b"}, {"nprobe": 16, "query": "c"},
+             {"nprobe": 0, "query": "d"}, {"nprobe": 8, "query": "e"}, {"nprobe": 16, "query": "f"}]
+    decode_error = ValueError("Could not decode image")  # Failed before the search
+
+    results = search_by_setting(items, [None] * 5 + [decode_error])
+
+    assert results[0] == (16, "a") and results[2] == (16, "c") and results[4] == (8, "e")
+    assert isinstance(results[1], RuntimeError) and results[1] is results[3]
+    assert results[5] is decode_error
+
+def test_failing_group_does_not_fail_the_batch():
+    batcher = MicroBatcher(search_by_setting, max_batch_size=8, max_wait_ms=200)
+    items = [{"nprobe": 16, "query": "a"}, {"nprobe": 0, "query": "b"}, {"nprobe": 16, "query": "c"},
+             {"nprobe": 4, "query": "d"}]
+
+    outcomes = submit_concurrently(batcher, items)
+
+    assert outcomes[0] == (16, "a") and outcomes[2] == (16, "c") and outcomes[3] == (4, "d")
+    assert isinstance(outcomes[1], RuntimeError)
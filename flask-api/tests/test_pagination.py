@@ -0,0 +1,25 @@
+import base64
+import json
+
+import pytest
+
+from pagination import encode_cursor, decode_cursor
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor(150, 7)) == (150, 7)
+
+def test_cursor_is_url_safe():
+    cursor = encode_cursor(10 ** 12, 3)
+    assert all(c.isalnum() or c in "-_=" for c in cursor)
+
+@pytest.mark.parametrize("cursor", [
+    "not base64!",
+    base64.urlsafe_b64encode(b"not json").decode(),
+    base64.urlsafe_b64encode(json.dumps({"offset": 5}).encode()).decode(),
+    base64.urlsafe_b64encode(json.dumps([5, 1]).encode()).decode(),
+    base64.urlsafe_b64encode(json.dumps({"offset": "x", "generation": 1}).encode()).decode(),
+    encode_cursor(-50, 1),
+])
+def test_invalid_cursors_raise_what_search_catches(cursor):
+    with pytest.raises((ValueError, KeyError, TypeError)):
+        decode_cursor(cursor)
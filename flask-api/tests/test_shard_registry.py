@@ -0,0 +1,48 @@
+import json
+import os
+
+import pytest
+
+from shard_registry import load_registry, register_shard, registry_path, shard_dir
+
+def test_no_registry(tmp_path):
+    assert load_registry(str(tmp_path)) is None
+
+def test_register_and_load_resolves_paths(tmp_path):
+    embeddings = str(tmp_path / "embeddings")
+    os.makedirs(embeddings)
+    register_shard(embeddings, "convocation-2024", str(tmp_path / "dataset" / "convocation-2024"),
+                   "IndexFlatIP", faces=12, images=5)
+    register_shard(embeddings, "convocation-2023", str(tmp_path / "dataset" / "convocation-2023"),
+                   "IndexIVFFlat", faces=3, images=2)
+
+    shards = load_registry(embeddings)
+
+    assert list(shards) == ["convocation-2023", "convocation-2024"]
+    entry = shards["convocation-2024"]
+    assert entry["index"] == os.path.join(shard_dir(embeddings, "convocation-2024"), "faces.index")
+    assert entry["metadata"] == os.path.join(shard_dir(embeddings, "convocation-2024"), "metadata")
+    assert entry["dataset"] == str(tmp_path / "dataset" / "convocation-2024")
+    assert (entry["index_type"], entry["faces"], entry["images"]) == ("IndexFlatIP", 12, 5)
+
+    # Paths are stored relative to the embeddings directory
+    with open(registry_path(embeddings)) as f:
+        stored = json.load(f)["shards"]["convocation-2024"]
+    assert stored["dataset"] == os.path.join("..", "dataset", "convocation-2024")
+
+def test_reregistering_an_event_replaces_its_entry(tmp_path):
+    register_shard(str(tmp_path), "a", str(tmp_path / "a"), "IndexFlatIP", faces=1, images=1)
+    register_shard(str(tmp_path), "a", str(tmp_path / "a"), "IndexHNSWFlat", faces=7, images=4)
+
+    shards = load_registry(str(tmp_path))
+
+    assert list(shards) == ["a"]
+    assert shards["a"]["faces"] == 7
+    assert not os.path.exists(registry_path(str(tmp_path)) + ".tmp")
+
+def test_unknown_format_is_rejected(tmp_path):
+    with open(registry_path(str(tmp_path)), "w") as f:
+        json.dump({"format": 99, "shards": {}}, f)
+
+    with pytest.raises(ValueError):
+        load_registry(str(tmp_path))
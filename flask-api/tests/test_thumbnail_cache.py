@@ -0,0 +1,52 @@
+import os
+from PIL import Image
+
+from thumbnail_cache import ThumbnailCache
+
+def save_photo(path, size=(400, 200), orientation=None):
+    image = Image.new("RGB", size, (200, 120, 40))
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation  # EXIF Orientation
+    image.save(path, format="JPEG", exif=exif.tobytes())
+    return str(path)
+
+def test_variant_is_resized_and_reused(tmp_path):
+    cache = ThumbnailCache(str(tmp_path / "cache"), max_bytes=10 * 1024 * 1024)
+    source = save_photo(tmp_path / "photo.jpg")
+    path = cache.get(source, 100, 85)
+    with Image.open(path) as variant:
+        assert max(variant.size) == 100
+    assert cache.get(source, 100, 85) == path
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+def test_variant_is_rotated_upright_per_exif_orientation(tmp_path):
+    cache = ThumbnailCache(str(tmp_path / "cache"), max_bytes=10 * 1024 * 1024)
+    # A phone portrait: landscape pixels tagged "rotate 90 degrees clockwise"
+    source = save_photo(tmp_path / "portrait.jpg", size=(400, 200), orientation=6)
+    with Image.open(cache.get(source, 100, 85)) as variant:
+        assert variant.size == (50, 100)
+        assert variant.getexif().get(0x0112) in (None, 1)
+
+def test_replaced_source_gets_a_new_variant(tmp_path):
+    cache = ThumbnailCache(str(tmp_path / "cache"), max_bytes=10 * 1024 * 1024)
+    source = save_photo(tmp_path / "photo.jpg")
+    first = cache.get(source, 100, 85)
+    save_photo(tmp_path / "photo.jpg", size=(300, 300))
+    os.utime(source, (1, 1))
+    assert cache.get(source, 100, 85) != first
+
+def test_least_recently_used_variants_are_evicted_past_the_cap(tmp_path):
+    sources = [save_photo(tmp_path / f"photo{i}.jpg") for i in range(6)]
+    probe = ThumbnailCache(str(tmp_path / "probe"), max_bytes=10 * 1024 * 1024)
+    variant_bytes = os.path.getsize(probe.get(sources[0], 100, 85))
+
+    cache = ThumbnailCache(str(tmp_path / "cache"), max_bytes=variant_bytes * 4)
+    paths = []
+    for i, source in enumerate(sources):
+        paths.append(cache.get(source, 100, 85))
+        os.utime(paths[-1], (i, i))  # Distinct, increasing last-use times
+    assert not os.path.exists(paths[0])
+    assert os.path.exists(paths[-1])
+    assert cache.stats()["evictions"] >= 2
+    assert sum(os.path.getsize(p) for p in paths if os.path.exists(p)) <= variant_bytes * 4
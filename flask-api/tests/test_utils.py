@@ -0,0 +1,25 @@
+import numpy as np
+
+from embedding_cache import EmbeddingCache
+from utils import BOX_COLUMNS, face_rows, normalize_embeddings
+
+def test_face_rows_packs_boxes_confidences_and_embeddings():
+    rows = face_rows([(0.1, 0.2, 0.3, 0.4), (0.5, 0.5, 0.1, 0.1)], [0.9, 0.8], np.ones((2, 3)))
+    assert rows.shape == (2, BOX_COLUMNS + 3)
+    assert rows.dtype == np.float32
+    np.testing.assert_allclose(rows[0, :BOX_COLUMNS], [0.1, 0.2, 0.3, 0.4, 0.9])
+    np.testing.assert_allclose(rows[:, BOX_COLUMNS:], 1.0)
+
+def test_face_rows_of_an_image_without_faces_is_empty():
+    rows = face_rows([], [], [])
+    assert rows.shape == (0, BOX_COLUMNS)
+    assert rows.dtype == np.float32
+
+def test_image_without_faces_round_trips_through_the_disk_cache(tmp_path):
+    EmbeddingCache(disk_dir=str(tmp_path)).put("key", face_rows([], [], []))
+    cached = EmbeddingCache(disk_dir=str(tmp_path)).get("key")
+    assert cached is not None and len(cached) == 0
+
+def test_normalize_embeddings_gives_unit_rows():
+    normalized = normalize_embeddings([[3.0, 4.0], [0.0, 2.0]])
+    np.testing.assert_allclose(np.linalg.norm(normalized, axis=1), 1.0, rtol=1e-5)
@@ -0,0 +1,34 @@
+import io
+import zipfile
+
+from zip_stream import stream_zip
+
+def test_archive_contains_every_entry(tmp_path):
+    photos = {"a.jpg": b"\xff\xd8" + bytes(range(256)) * 700, "b.jpg": b"\xff\xd8small"}
+    for name, data in photos.items():
+        (tmp_path / name).write_bytes(data)
+
+    pieces = list(stream_zip([(name, str(tmp_path / name)) for name in photos], chunk_size=4096))
+
+    # The large photo is emitted in several pieces rather than all at once
+    assert len(pieces) > len(photos) + 1
+    assert max(len(piece) for piece in pieces) < len(photos["a.jpg"])
+    with zipfile.ZipFile(io.BytesIO(b"".join(pieces))) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == list(photos)
+        for name, data in photos.items():
+            assert archive.read(name) == data
+            assert archive.getinfo(name).compress_type == zipfile.ZIP_STORED
+
+def test_missing_file_is_skipped(tmp_path):
+    (tmp_path / "kept.jpg").write_bytes(b"photo")
+
+    data = b"".join(stream_zip([("gone.jpg", str(tmp_path / "gone.jpg")), ("kept.jpg", str(tmp_path / "kept.jpg"))]))
+
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.namelist() == ["kept.jpg"]
+        assert archive.read("kept.jpg") == b"photo"
+
+def test_empty_archive_is_valid():
+    with zipfile.ZipFile(io.BytesIO(b"".join(stream_zip([])))) as archive:
+        assert archive.namelist() == []
@@ -30,8 +30,23 @@ const isValidDomain = (email) => {
   return ALLOWED_DOMAINS.includes(domain);
 };
 
+// Longest side of the resized images shown in the results grid
+const THUMBNAIL_SIZE = 400;
+
+// A result's photo. Camera filenames repeat across events, so a photo is
+// identified by its event and filename together.
+const resultFilename = (result) => result.original_filename || result.filename.split('_face')[0];
+const photoKey = (result) => `${result.event || ''}/${resultFilename(result)}`;
+
+const downloadUrl = (filename, event, params = {}) => {
+  const query = new URLSearchParams(params);
+  if (event) query.set('event', event);
+  const queryString = query.toString();
+  return `${API_BASE_URL}/api/download/${encodeURIComponent(filename)}${queryString ? `?${queryString}` : ''}`;
+};
+
 // Component for displaying authenticated images
-const AuthenticatedImage = ({ filename, alt, className, isSelected, onSelect }) => {
+const AuthenticatedImage = ({ filename, event, alt, className, isSelected, onSelect }) => {
   const [imageSrc, setImageSrc] = useState(null);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(false);
@@ -47,7 +62,7 @@ const AuthenticatedImage = ({ filename, alt, className, isSelected, onSelect })
         }
         
         const token = await user.getIdToken();
-        const response = await fetch(`${API_BASE_URL}/api/download/${filename}`, {
+        const response = await fetch(downloadUrl(filename, event, { size: THUMBNAIL_SIZE }), {
           headers: {
             'Authorization': `Bearer ${token}`
           }
@@ -75,7 +90,7 @@ const AuthenticatedImage = ({ filename, alt, className, isSelected, onSelect })
         URL.revokeObjectURL(imageSrc);
       }
     };
-  }, [filename]);
+  }, [filename, event]);
 
   if (loading) {
     return (
@@ -418,7 +433,7 @@ const FaceSearchApp = () => {
   }, [getAuthToken]);
 
   // Function to handle authenticated downloads
-  const handleDownload = async (filename) => {
+  const handleDownload = async (filename, event) => {
     try {
       const token = await getAuthToken();
       if (!token) {
@@ -426,7 +441,7 @@ const FaceSearchApp = () => {
         return;
       }
       
-      const response = await fetch(`${API_BASE_URL}/api/download/${filename}`, {
+      const response = await fetch(downloadUrl(filename, event), {
         headers: {
           'Authorization': `Bearer ${token}`
         }
@@ -451,13 +466,13 @@ const FaceSearchApp = () => {
     }
   };
 
-  // Bulk selection handlers
-  const handleImageSelect = (filename) => {
+  // Bulk selection handlers (selectedImages holds photo keys, see photoKey)
+  const handleImageSelect = (key) => {
     const newSelected = new Set(selectedImages);
-    if (newSelected.has(filename)) {
-      newSelected.delete(filename);
+    if (newSelected.has(key)) {
+      newSelected.delete(key);
     } else {
-      newSelected.add(filename);
+      newSelected.add(key);
     }
     setSelectedImages(newSelected);
   };
@@ -468,8 +483,7 @@ const FaceSearchApp = () => {
       setSelectedImages(new Set());
     } else {
       // Select all
-      const allFilenames = searchResults.map(result => result.original_filename || result.filename.split('_face')[0]);
-      setSelectedImages(new Set(allFilenames));
+      setSelectedImages(new Set(searchResults.map(photoKey)));
     }
   };
 
@@ -487,39 +501,45 @@ const FaceSearchApp = () => {
     }
 
     try {
-      // Create a delay function for better UX
-      const delay = (ms) => new Promise(resolve => setTimeout(resolve, ms));
-      
-      for (const filename of selectedImages) {
-        try {
-          const response = await fetch(`${API_BASE_URL}/api/download/${filename}`, {
-            headers: {
-              'Authorization': `Bearer ${token}`
-            }
-          });
+      // The selected photos with their events, once each
+      const files = new Map();
+      for (const result of searchResults) {
+        const key = photoKey(result);
+        if (selectedImages.has(key) && !files.has(key)) {
+          files.set(key, { filename: resultFilename(result), event: result.event });
+        }
+      }
 
-          if (!response.ok) {
-            console.error(`Failed to download ${filename}`);
-            continue;
-          }
+      // One request for the whole selection, streamed back as a ZIP archive
+      const response = await fetch(`${API_BASE_URL}/api/download-zip`, {
+        method: 'POST',
+        headers: {
+          'Authorization': `Bearer ${token}`,
+          'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({ files: Array.from(files.values()) })
+      });
 
-          const blob = await response.blob();
-          const url = window.URL.createObjectURL(blob);
-          const link = document.createElement('a');
-          link.href = url;
-          link.download = filename;
-          document.body.appendChild(link);
-          link.click();
-          link.remove();
-          window.URL.revokeObjectURL(url);
-
-          // Small delay between downloads to avoid overwhelming the browser
-          await delay(200);
-        } catch (error) {
-          console.error(`Error downloading ${filename}:`, error);
-        }
+      if (!response.ok) {
+        throw new Error('Failed to download images');
+      }
+
+      const missing = parseInt(response.headers.get('X-Missing-Files') || '0', 10);
+      const blob = await response.blob();
+      const url = window.URL.createObjectURL(blob);
+      const link = document.createElement('a');
+      link.href = url;
+      link.download = 'photos.zip';
+      document.body.appendChild(link);
+      link.click();
+      link.remove();
+      window.URL.revokeObjectURL(url);
+
+      if (missing > 0) {
+        setError(`${missing} of the selected images could not be found`);
       }
     } catch (error) {
+      console.error('Error downloading selected images:', error);
       setError('Failed to download some images');
     } finally {
       setIsDownloadingBulk(false);
@@ -1461,28 +1481,30 @@ const FaceSearchApp = () => {
                   {searchResults.length > 0 ? (
                     <div className="grid grid-cols-2 md:grid-cols-3 lg:grid-cols-4 xl:grid-cols-5 gap-4">
                       {searchResults.map((result, index) => {
-                        const filename = result.original_filename || result.filename.split('_face')[0];
+                        const filename = resultFilename(result);
+                        const key = photoKey(result);
                         return (
                           <div key={index} className="group">
                             <div className={`bg-white border-2 rounded-xl overflow-hidden transition-all duration-300 shadow-sm hover:shadow-lg ${
-                              selectedImages.has(filename) 
+                              selectedImages.has(key) 
                                 ? 'border-green-500 shadow-green-500/20 transform scale-[1.02]' 
                                 : 'border-green-100 hover:border-green-300'
                             }`}>
                               <div className="relative">
                                 <AuthenticatedImage 
                                   filename={filename}
+                                  event={result.event}
                                   alt={`Match ${index + 1}`}
                                   className="w-full h-36 object-cover"
-                                  isSelected={selectedImages.has(filename)}
-                                  onSelect={() => handleImageSelect(filename)}
+                                  isSelected={selectedImages.has(key)}
+                                  onSelect={() => handleImageSelect(key)}
                                 />
                                 {/* Individual download button */}
                                 <div className="absolute bottom-2 left-2 opacity-0 group-hover:opacity-100 transition-all duration-200">
                                   <button
                                     onClick={(e) => {
                                       e.stopPropagation();
-                                      handleDownload(filename);
+                                      handleDownload(filename, result.event);
                                     }}
                                     className="bg-white/95 backdrop-blur-sm text-green-700 p-2 rounded-full shadow-lg hover:bg-green-50 hover:shadow-green-500/25 border border-green-200 transition-all duration-200 hover:scale-105"
                                   >
@@ -11,6 +11,12 @@ fi
 
 echo "Configuring services with IP: $EC2_IP"
 
+# Flask capacity; the Node proxy forwards at most workers x threads requests
+# at a time and queues the rest. --keep-alive below keeps its pooled
+# connections open between requests (gunicorn's default is 2 seconds).
+FLASK_WORKERS=${FLASK_WORKERS:-2}
+FLASK_THREADS=${FLASK_THREADS:-8}
+
 # Setup Flask systemd service (use ec2-user instead of ubuntu)
 sudo tee /etc/systemd/system/flask-api.service > /dev/null << EOF
 [Unit]
@@ -22,7 +28,13 @@ Type=simple
 User=ec2-user
 WorkingDirectory=$APP_DIR/flask-api
 Environment=PATH=$APP_DIR/flask-api/venv/bin
-ExecStart=$APP_DIR/flask-api/venv/bin/gunicorn --bind 0.0.0.0:5000 --workers 2 --timeout 120 app:app
+Environment=INDEX_WATCH_INTERVAL=30
+Environment=FAISS_MMAP=1
+# /metrics aggregates every worker's samples from here; systemd recreates it
+# empty on each start (see flask-api/src/metrics.py)
+RuntimeDirectory=flask-api-metrics
+Environment=PROMETHEUS_MULTIPROC_DIR=/run/flask-api-metrics
+ExecStart=$APP_DIR/flask-api/venv/bin/gunicorn --bind 0.0.0.0:5000 --workers $FLASK_WORKERS --threads $FLASK_THREADS --keep-alive 75 --timeout 120 app:app
 Restart=always
 
 [Install]
@@ -42,7 +54,9 @@ module.exports = {
     env: {
       NODE_ENV: 'production',
       PORT: 3001,
-      FLASK_API_URL: 'http://localhost:5000'
+      FLASK_API_URL: 'http://localhost:5000',
+      FLASK_WORKERS: $FLASK_WORKERS,
+      FLASK_THREADS: $FLASK_THREADS
     },
     error_file: '$APP_DIR/logs/backend-error.log',
     out_file: '$APP_DIR/logs/backend-out.log',